@@ -0,0 +1,63 @@
+"""Compares the lxml listing parser against the BeautifulSoup one
+
+Pages can be saved from a real run with the `response` kwarg of `get_all_receipts()`,
+
+    responses = []
+    migros_api.get_all_receipts(period_from, period_to, response=responses)
+    for k, response in enumerate(responses):
+        with open("pages/page_%s.html" % k, "wb") as file:
+            file.write(response.content)
+
+and then benchmarked with `python benchmarks/bench_listing_parser.py pages/`.
+Without a directory, synthetic pages are generated instead
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from migros_api import synthetic
+from migros_api.migros_api import MigrosApi
+
+
+def synthetic_listing_page(rows: int, page: int = 1, total_pages: int = 10) -> bytes:
+    """ Listing page with `rows` receipts, see `synthetic.listing_page()` """
+    ids = ["%s%06d" % (page, row) for row in range(rows)]
+    return synthetic.listing_page(ids, page, total_pages)
+
+
+def load_pages(path: str) -> list:
+    """ Reads every saved page in `path` """
+    pages = []
+    for file_name in sorted(os.listdir(path)):
+        with open(os.path.join(path, file_name), 'rb') as file:
+            pages.append(file.read())
+    return pages
+
+
+def bench(pages: list, repeat: int) -> None:
+    """ Times both parsers over `pages`. That they agree is checked by `tests/tests_migros_api.py` """
+    for name, parser in (
+        ('soup', MigrosApi._parse_receipt_data_soup), ('lxml', MigrosApi._parse_receipt_data)
+    ):
+        timer = timeit.Timer(lambda: [parser(page, {}) for page in pages])
+        best = min(timer.repeat(repeat=repeat, number=1))
+        print("%-5s %9.2f ms for %s pages" % (name, best * 1000, len(pages)))
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    PARSER.add_argument("pages_dir", nargs="?", help="directory with saved listing pages")
+    PARSER.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000])
+    PARSER.add_argument("--repeat", type=int, default=5)
+    ARGS = PARSER.parse_args()
+
+    if ARGS.pages_dir:
+        bench(load_pages(ARGS.pages_dir), ARGS.repeat)
+    else:
+        for n_rows in ARGS.rows:
+            print("-- %s rows per page" % n_rows)
+            bench([synthetic_listing_page(n_rows, page) for page in range(1, 6)], ARGS.repeat)
@@ -0,0 +1,253 @@
+"""Benchmarks for the hot paths of migros_api
+
+Times, on synthetic inputs of configurable size,
+
+    listing   `MigrosApi._parse_receipt_data()` on listing pages
+    receipt   `ReceiptItem` parsing of both receipt formats (type one and limmatfeld)
+    e2e       `get_all_receipts()` + `get_receipts()` against a local `StubMigrosServer`
+    import    importing the package in a fresh interpreter, which must not load pandas,
+              bs4, numpy, lxml, aiohttp or pyarrow nor configure logging
+
+Results are written as json, and can be compared against an earlier run,
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+
+# Modules that only have to be loaded once data is parsed or an optional feature is used
+HEAVY_MODULES = ('pandas', 'numpy', 'bs4', 'lxml', 'aiohttp', 'pyarrow')
+
+IMPORT_SCRIPT = """
+import logging, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+heavy = sorted({{m.split('.')[0] for m in sys.modules}} & set({heavy!r}))
+print(elapsed, ','.join(heavy) or '-', len(logging.getLogger().handlers))
+"""
+
+from migros_api import synthetic
+from migros_api.migros_api import MigrosApi
+from migros_api.receipt_item import ReceiptItem
+from migros_api.replay import StubMigrosServer
+
+
+def time_call(func, repeat: int, number: int = 1) -> dict:
+    """ Runs `func` `number` times per round, for `repeat` rounds
+
+    Returns:
+        dict: best and median time of one call, in milliseconds
+    """
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+
+    return {
+        'best_ms': round(min(rounds) * 1000, 4),
+        'median_ms': round(statistics.median(rounds) * 1000, 4),
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def bench_listing(sizes: list, repeat: int) -> dict:
+    """ Listing page parsing, one entry per number of rows """
+    results = {}
+    for n_rows in sizes:
+        ids = ["%s%06d" % (20210101, k) for k in range(n_rows)]
+        page = synthetic.listing_page(ids, page=1, total_pages=10)
+
+        receipts_info = {}
+        MigrosApi._parse_receipt_data(page, receipts_info)
+        if len(receipts_info) != n_rows:
+            raise AssertionError("Listing parser found %s of %s rows" % (len(receipts_info), n_rows))
+
+        result = time_call(lambda: MigrosApi._parse_receipt_data(page, {}), repeat, number=5)
+        result['rows_per_s'] = round(n_rows / (result['best_ms'] / 1000))
+        results["listing/rows=%s" % n_rows] = result
+        print_result("listing/rows=%s" % n_rows, result)
+
+    return results
+
+
+def bench_receipt(sizes: list, repeat: int) -> dict:
+    """ Receipt export parsing for both formats, one entry per format and number of lines """
+    results = {}
+    for receipt_type in (1, 2):
+        for n_lines in sizes:
+            html = synthetic.receipt_html("bench%s" % n_lines, n_lines, receipt_type)
+            if ReceiptItem("bench", html).get_data_frame() is None:
+                raise AssertionError("Could not parse a type %s receipt" % receipt_type)
+
+            # A new item every call, items only parse once
+            result = time_call(lambda: ReceiptItem("bench", html).get_data_frame(), repeat, number=3)
+            result['lines_per_s'] = round(n_lines / (result['best_ms'] / 1000))
+            name = "receipt/type=%s/lines=%s" % (receipt_type, n_lines)
+            results[name] = result
+            print_result(name, result)
+
+    return results
+
+
+def bench_e2e(days: int, receipts_per_day: int, lines: int, max_workers: int,
+              latency: float, repeat: int, parse_processes: int = None) -> dict:
+    """ Listing and receipts download against a local stub server """
+    period_to = datetime(2021, 6, 30)
+    period_from = period_to - timedelta(days=days - 1)
+
+    rounds, n_receipts = [], 0
+    with StubMigrosServer(receipts_per_day=receipts_per_day, lines_per_receipt=lines,
+                          latency=latency) as server:
+        migros_api = MigrosApi(
+            "password", "bench@example.com",
+            base_url=server.base_url, login_base_url=server.base_url
+        )
+        for _ in range(repeat):
+            start = time.perf_counter()
+            receipts_info = migros_api.get_all_receipts(period_from, period_to, max_workers=max_workers)
+            receipt_ids = [x['receipt_id'] for x in receipts_info.values()]
+            receipts = list(migros_api.get_receipts(
+                receipt_ids, max_workers=max_workers, parse_processes=parse_processes
+            ))
+            for receipt in receipts:
+                receipt.get_data_frame()
+            rounds.append(time.perf_counter() - start)
+            n_receipts = len(receipts)
+
+    name = "e2e/receipts=%s/workers=%s" % (n_receipts, max_workers)
+    if parse_processes:
+        name += "/processes=%s" % parse_processes
+    result = {
+        'best_ms': round(min(rounds) * 1000, 4),
+        'median_ms': round(statistics.median(rounds) * 1000, 4),
+        'repeat': repeat,
+        'number': 1,
+        'receipts_per_s': round(n_receipts / min(rounds), 2),
+        'latency_s': latency,
+    }
+    print_result(name, result)
+
+    return {name: result}
+
+
+def bench_import(modules: list, repeat: int) -> dict:
+    """ Import time of each module in a fresh interpreter, failing if heavy dependencies
+        are loaded or logging handlers are installed on import """
+    results = {}
+    for module in modules:
+        script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+        rounds = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", script], cwd=ROOT_DIR, check=True,
+                capture_output=True, text=True
+            ).stdout.split()
+            elapsed, heavy, handlers = float(output[0]), output[1], int(output[2])
+            if heavy != "-":
+                raise AssertionError("Importing %s loads %s" % (module, heavy))
+            if handlers:
+                raise AssertionError("Importing %s configures logging" % module)
+            rounds.append(elapsed)
+
+        name = "import/%s" % module
+        results[name] = {
+            'best_ms': round(min(rounds) * 1000, 4),
+            'median_ms': round(statistics.median(rounds) * 1000, 4),
+            'repeat': repeat,
+            'number': 1,
+        }
+        print_result(name, results[name])
+
+    return results
+
+
+def print_result(name: str, result: dict) -> None:
+    print("%-36s best %10.3f ms  median %10.3f ms" % (name, result['best_ms'], result['median_ms']))
+
+
+def compare(results: dict, baseline_path: str, threshold: float) -> bool:
+    """ Prints the change of every benchmark against a baseline file
+
+    Returns:
+        bool: True if any benchmark got slower by more than `threshold`
+    """
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)['results']
+
+    print("\n%-36s %12s %12s %8s" % ("benchmark", "baseline ms", "current ms", "ratio"))
+    regression = False
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['best_ms'] / baseline[name]['best_ms']
+        flag = ""
+        if ratio > 1 + threshold:
+            flag, regression = "  SLOWER", True
+        print("%-36s %12.3f %12.3f %8.2f%s" % (
+            name, baseline[name]['best_ms'], result['best_ms'], ratio, flag
+        ))
+
+    return regression
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    PARSER.add_argument("--suites", nargs="+", default=['import', 'listing', 'receipt', 'e2e'],
+                        choices=['import', 'listing', 'receipt', 'e2e'])
+    PARSER.add_argument("--import-modules", nargs="+",
+                        default=['migros_api', 'migros_api.migros_api', 'migros_api.receipt_item'])
+    PARSER.add_argument("--listing-rows", type=int, nargs="+", default=[10, 100, 1000])
+    PARSER.add_argument("--receipt-lines", type=int, nargs="+", default=[10, 100, 500])
+    PARSER.add_argument("--days", type=int, default=60, help="e2e period length")
+    PARSER.add_argument("--receipts-per-day", type=int, default=2)
+    PARSER.add_argument("--lines", type=int, default=20, help="lines per e2e receipt")
+    PARSER.add_argument("--workers", type=int, default=8)
+    PARSER.add_argument("--parse-processes", type=int, help="parse e2e receipts in processes")
+    PARSER.add_argument("--latency", type=float, default=0.005, help="stub server latency, in s")
+    PARSER.add_argument("--repeat", type=int, default=5)
+    PARSER.add_argument("--output", help="json file where results are written")
+    PARSER.add_argument("--compare", help="json file of an earlier run")
+    PARSER.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown ratio above which --compare fails")
+    ARGS = PARSER.parse_args()
+
+    RESULTS = {}
+    if 'import' in ARGS.suites:
+        RESULTS.update(bench_import(ARGS.import_modules, ARGS.repeat))
+    if 'listing' in ARGS.suites:
+        RESULTS.update(bench_listing(ARGS.listing_rows, ARGS.repeat))
+    if 'receipt' in ARGS.suites:
+        RESULTS.update(bench_receipt(ARGS.receipt_lines, ARGS.repeat))
+    if 'e2e' in ARGS.suites:
+        RESULTS.update(bench_e2e(
+            ARGS.days, ARGS.receipts_per_day, ARGS.lines, ARGS.workers, ARGS.latency,
+            max(1, ARGS.repeat // 2), ARGS.parse_processes
+        ))
+
+    if ARGS.output:
+        with open(ARGS.output, 'w') as FILE:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': RESULTS,
+            }, FILE, indent=2)
+
+    if ARGS.compare and compare(RESULTS, ARGS.compare, ARGS.threshold):
+        sys.exit(1)
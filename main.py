@@ -1,2 +1,226 @@
-"""main script to execute"
+"""main script to execute
 
+Bulk sync of the receipts of a period: lists them, downloads and parses every receipt, and
+writes the line items (and optionally the pdfs) out. Progress is printed while running,
+with requests and receipts per second, latency percentiles and bytes transferred, followed
+by a summary that can be saved as json to compare runs,
+
+    export USERNAME_MIGROS=me@example.com PASSWORD_MIGROS=...
+    python main.py --from 2021-01-01 --to 2021-06-30 --workers 8 --rate-limit 10 \\
+        --output line_items.parquet --pdf-archive ./pdf_archive --summary-json run.json
+
+    # same run against a local stub server, no account needed
+    python main.py --from 2021-01-01 --to 2021-06-30 --stub --stub-latency 0.05
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+from getpass import getpass
+
+from migros_api import metrics
+from migros_api.migros_api import MigrosApi, configure_logging
+from migros_api.transport import Transport
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """ Command line arguments """
+    parser = argparse.ArgumentParser(description="Bulk sync of migros cumulus receipts")
+    date = lambda value: datetime.strptime(value, "%Y-%m-%d")
+
+    period = parser.add_argument_group("period")
+    period.add_argument("--from", dest="period_from", type=date, required=True, help="first day, YYYY-MM-DD")
+    period.add_argument("--to", dest="period_to", type=date, default=None, help="last day, YYYY-MM-DD. Defaults to today")
+    period.add_argument("--checkpoint", default=None,
+                        help="backfill checkpoint file, to resume long periods (see backfill_receipts)")
+
+    account = parser.add_argument_group("account")
+    account.add_argument("--username", default=os.environ.get("USERNAME_MIGROS"),
+                         help="defaults to $USERNAME_MIGROS. The password is read from $PASSWORD_MIGROS or asked for")
+    account.add_argument("--session-file", default=None, help="file keeping the session cookies between runs")
+    account.add_argument("--base-url", default=None, help="cumulus base url, e.g. a recorded fixtures server")
+    account.add_argument("--login-base-url", default=None, help="login base url. Defaults to --base-url")
+
+    tuning = parser.add_argument_group("throughput")
+    tuning.add_argument("--workers", type=int, default=4, help="concurrent downloads. Defaults to 4")
+    tuning.add_argument("--parse-processes", type=int, default=None, help="processes parsing receipts")
+    tuning.add_argument("--rate-limit", type=float, default=None, help="requests per second. Defaults to no limit")
+    tuning.add_argument("--burst", type=int, default=None, help="requests allowed at once by the rate limit")
+    tuning.add_argument("--pool-size", type=int, default=None, help="http connections kept open. Defaults to --workers + 1")
+    tuning.add_argument("--max-retries", type=int, default=3, help="retries of failed requests. Defaults to 3")
+    tuning.add_argument("--cache", default=None, help="sqlite receipt cache, receipts in it are not downloaded again")
+
+    output = parser.add_argument_group("output")
+    output.add_argument("--output", default=None, help="line items file, .csv or .parquet")
+    output.add_argument("--store", default=None, help="LineItemStore sqlite file to add the line items to")
+    output.add_argument("--pdf-dir", default=None, help="directory where to save one pdf per receipt")
+    output.add_argument("--pdf-archive", default=None, help="PdfArchive directory where to pack the pdfs")
+    output.add_argument("--summary-json", default=None, help="file where to write the run summary")
+    output.add_argument("--report-interval", type=float, default=5, help="seconds between progress lines, 0 disables them")
+    output.add_argument("--log-level", default="WARNING", help="logging level. Defaults to WARNING")
+
+    stub = parser.add_argument_group("stub server")
+    stub.add_argument("--stub", action="store_true", help="run against a local server with synthetic receipts")
+    stub.add_argument("--stub-receipts-per-day", type=int, default=1, help="defaults to 1")
+    stub.add_argument("--stub-latency", type=float, default=0.0, help="seconds added to every response")
+
+    args = parser.parse_args(argv)
+    if args.output and not args.output.endswith((".csv", ".parquet")):
+        parser.error("--output must end with .csv or .parquet")
+    if args.period_to is None:
+        args.period_to = datetime.now()
+    if args.period_to < args.period_from:
+        parser.error("--to is before --from")
+    return args
+
+
+def report_progress(stats: metrics.RunStats, interval: float, stop: threading.Event) -> None:
+    """ Prints a progress line every `interval` seconds until `stop` is set """
+    while not stop.wait(interval):
+        print(stats.format(stats.snapshot()), file=sys.stderr, flush=True)
+
+
+def sync(args: argparse.Namespace, stats: metrics.RunStats) -> dict:
+    """ Lists, downloads and writes the receipts of the period
+
+    Args:
+        args (argparse.Namespace): command line arguments
+        stats (metrics.RunStats): stats receiving the finished receipts
+
+    Returns:
+        dict: listed receipts and receipt ids that could not be fetched
+    """
+    options, cache = {}, None
+    if args.base_url:
+        options['base_url'] = args.base_url
+        options['login_base_url'] = args.login_base_url or args.base_url
+    if args.cache:
+        from migros_api.receipt_cache import ReceiptCache
+        options['cache'] = cache = ReceiptCache(args.cache)
+
+    password = os.environ.get("PASSWORD_MIGROS") or getpass("Password of %s: " % args.username)
+    transport = Transport(
+        pool_size=args.pool_size or args.workers + 1, max_retries=args.max_retries,
+        rate_limit=args.rate_limit, burst=args.burst
+    )
+    migros_api = MigrosApi(
+        password, args.username, session_file=args.session_file, transport=transport, **options
+    )
+
+    if args.checkpoint:
+        receipts_info = migros_api.backfill_receipts(
+            args.checkpoint, args.period_from, args.period_to, max_workers=args.workers
+        )
+    else:
+        receipts_info = migros_api.get_all_receipts(args.period_from, args.period_to, max_workers=args.workers)
+    logging.info("Listed %s receipts", len(receipts_info))
+
+    archive = None
+    if args.pdf_archive:
+        from migros_api.pdf_archive import PdfArchive
+        archive = PdfArchive(args.pdf_archive)
+    if args.pdf_dir:
+        os.makedirs(args.pdf_dir, exist_ok=True)
+
+    failures, receipts = {}, []
+    request_pdf = bool(args.pdf_dir) or archive is not None
+    receipt_ids = (x['receipt_id'] for x in receipts_info.values())
+    try:
+        for receipt in migros_api.get_receipts(
+            receipt_ids, max_workers=args.workers, request_pdf=request_pdf, lazy_pdf=True,
+            failures=failures, parse_processes=args.parse_processes
+        ):
+            if archive is not None:
+                # Every pdf is downloaded at most once, the pdf file is written from the archive
+                if receipt.receipt_id not in archive:
+                    archive.add(receipt.receipt_id, receipt.fetch_pdf())
+                if args.pdf_dir:
+                    archive.to_pdf(receipt.receipt_id, args.pdf_dir)
+            elif args.pdf_dir:
+                receipt.to_pdf(args.pdf_dir)
+            receipt.release(pdf=True)
+            receipts.append(receipt)
+            stats.add_receipt()
+    finally:
+        if archive is not None:
+            archive.close()
+        if cache is not None:
+            cache.close()
+
+    write_line_items(args, receipts, receipts_info)
+    return {'receipts_info': receipts_info, 'failures': failures}
+
+
+def write_line_items(args: argparse.Namespace, receipts: list, receipts_info: dict) -> None:
+    """ Writes the line items to `--output` and `--store` """
+    if args.store:
+        from migros_api.line_item_store import LineItemStore
+        store = LineItemStore(args.store)
+        try:
+            store.add_receipts(receipts, receipts_info)
+        finally:
+            store.close()
+
+    if args.output and receipts:
+        from migros_api.receipt_frame import build_receipt_frame
+        df_items = build_receipt_frame(receipts, receipts_info)
+        if args.output.endswith(".parquet"):
+            df_items.to_parquet(args.output, index=False)
+        else:
+            df_items.to_csv(args.output, index=False)
+        logging.info("Wrote %s line items to %s", len(df_items), args.output)
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    configure_logging(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+
+    server = None
+    if args.stub:
+        from migros_api.replay import StubMigrosServer
+        server = StubMigrosServer(receipts_per_day=args.stub_receipts_per_day, latency=args.stub_latency)
+        args.base_url = args.login_base_url = server.start()
+        args.username = args.username or "stub@example.com"
+        os.environ.setdefault("PASSWORD_MIGROS", "stub")
+    elif not args.username:
+        args.username = input("Username: ")
+
+    stats = metrics.RunStats()
+    metrics.set_metrics_hook(stats)
+    stop = threading.Event()
+    if args.report_interval > 0:
+        threading.Thread(
+            target=report_progress, args=(stats, args.report_interval, stop), daemon=True
+        ).start()
+
+    try:
+        result = sync(args, stats)
+    finally:
+        stop.set()
+        metrics.set_metrics_hook(None)
+        if server is not None:
+            server.stop()
+
+    summary = stats.snapshot()
+    summary['listed'] = len(result['receipts_info'])
+    summary['failed'] = len(result['failures'])
+    summary['settings'] = {
+        'workers': args.workers, 'parse_processes': args.parse_processes,
+        'rate_limit': args.rate_limit, 'burst': args.burst,
+        'pool_size': args.pool_size or args.workers + 1, 'stub': args.stub,
+    }
+
+    print("Done: %s  listed %s, failed %s" % (stats.format(summary), summary['listed'], summary['failed']))
+    if args.summary_json:
+        with open(args.summary_json, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+    return 1 if result['failures'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
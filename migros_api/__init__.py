@@ -1 +1,41 @@
-from .migros_api import MigrosApi
\ No newline at end of file
+"""migros_api package
+
+Submodules are imported on first access, so that `import migros_api` stays cheap and
+optional dependencies (aiohttp, pyarrow) are only loaded by the classes that need them
+"""
+
+import importlib
+
+_EXPORTS = {
+    'MigrosApi': '.migros_api',
+    'configure_logging': '.migros_api',
+    'AsyncMigrosApi': '.async_migros_api',
+    'AccountPool': '.account_pool',
+    'ReceiptCache': '.receipt_cache',
+    'build_listing_frame': '.receipt_frame',
+    'build_receipt_frame': '.receipt_frame',
+    'ReceiptParquetStore': '.parquet_store',
+    'LineItemStore': '.line_item_store',
+    'PdfArchive': '.pdf_archive',
+    'Transport': '.transport',
+    'RateLimiter': '.transport',
+    'MetricsHook': '.metrics',
+    'StatsdMetrics': '.metrics',
+    'RunStats': '.metrics',
+    'set_metrics_hook': '.metrics',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,171 @@
+"""account_pool class"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from .migros_api import MigrosApi
+from .receipt_item import ReceiptItem
+from .transport import Transport
+
+
+class AccountPool:
+    """
+    Runs many cumulus accounts from one process. Every account gets its own `MigrosApi`,
+    with a private session, its own thread pool of `max_workers` threads and its own rate
+    limit, so a slow or failing account does not hold back the others. Logins (and
+    re-logins after a session expired) share one lock, so accounts authenticate one at a time,
+
+        accounts = [("me@example.com", pwd_1), ("family@example.com", pwd_2)]
+        with AccountPool(accounts, max_workers=4, rate_limit=5) as pool:
+            listings = pool.get_all_receipts(period_from, period_to)
+            ids = {user: [x['receipt_id'] for x in receipts.values()] for user, receipts in listings.items()}
+            for username, receipt in pool.get_receipts(ids):
+                ...
+
+    Args:
+        accounts (Iterable[Tuple[str, str]]): (username, password) of every account
+        max_workers (int, optional): concurrent requests per account. Defaults to 4
+        rate_limit (float, optional): requests per second per account. Defaults to no limit
+        session_dir (str, optional): directory where every account keeps its session
+            file (see `MigrosApi`). Defaults to None
+        **kwargs: other `MigrosApi` arguments, e.g. `cache` or `base_url`
+    """
+
+    def __init__(self, accounts: Iterable[Tuple[str, str]], max_workers: int = 4,
+                 rate_limit: float = None, session_dir: str = None, **kwargs):
+        self.max_workers = max_workers
+        self._login_lock = threading.Lock()
+        self._apis = {}
+        self._executors = {}
+
+        for username, password in accounts:
+            session_file = None
+            if session_dir is not None:
+                session_file = os.path.join(session_dir, username + ".json")
+
+            self._apis[username] = MigrosApi(
+                password, username, session_file=session_file, lazy_login=True,
+                transport=Transport(pool_size=max_workers, rate_limit=rate_limit),
+                login_lock=self._login_lock, **kwargs
+            )
+            self._executors[username] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="account-%s" % len(self._executors)
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, username: str) -> MigrosApi:
+        return self._apis[username]
+
+    def __len__(self) -> int:
+        return len(self._apis)
+
+    @property
+    def usernames(self) -> List[str]:
+        return list(self._apis)
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    def get_all_receipts(self, period_from: datetime, period_to: datetime,
+                         **kwargs) -> Dict[str, Dict[str, dict]]:
+        """ Lists the receipts of every account concurrently, see `MigrosApi.get_all_receipts()`.
+            Accounts that fail are logged and stored in `failures`
+
+        Args:
+            period_from (datetime): period from, to execute search
+            period_to (datetime): period to, to execute search
+            failures (dict, optional): dictionary updated with username as key and
+                the raised exception as value, for every account that could not be listed
+
+        Returns:
+            Dict[str, Dict[str, dict]]: receipts information by username
+        """
+        failures = kwargs.get("failures", {})
+        futures = {
+            self._executors[username].submit(
+                api.get_all_receipts, period_from, period_to, max_workers=self.max_workers
+            ): username
+            for username, api in self._apis.items()
+        }
+
+        results = {}
+        for future in futures:
+            username = futures[future]
+            try:
+                results[username] = future.result()
+            except Exception as err:
+                logging.error("Could not list receipts of %s: %s", username, err)
+                failures[username] = err
+
+        return results
+
+    def get_receipts(self, receipt_ids: Dict[str, Iterable[str]], request_pdf: bool = True,
+                     lazy_pdf: bool = False, **kwargs) -> Iterator[Tuple[str, ReceiptItem]]:
+        """ Retrieves receipts of many accounts, yielding them as soon as they are ready.
+            Every account downloads on its own threads and keeps at most `max_workers * 2`
+            receipts queued, so accounts progress independently of each other
+
+        Args:
+            receipt_ids (Dict[str, Iterable[str]]): receipt ids to get by username, can be
+                lazy iterables
+            request_pdf (bool, optional): see `MigrosApi.get_receipt()`. Defaults to True
+            lazy_pdf (bool, optional): see `MigrosApi.get_receipt()`. Defaults to False
+            failures (dict, optional): dictionary updated with (username, receipt_id) as key
+                and the raised exception as value, for every receipt that could not be fetched
+
+        Yields:
+            Iterator[Tuple[str, ReceiptItem]]: username and receipt
+        """
+        failures = kwargs.get("failures", {})
+        max_pending = self.max_workers * 2
+        queues = {username: iter(ids) for username, ids in receipt_ids.items()}
+        in_flight = dict.fromkeys(queues, 0)
+        pending = {}
+
+        def fill(username: str) -> None:
+            api = self._apis[username]
+            while in_flight[username] < max_pending:
+                receipt_id = next(queues[username], None)
+                if receipt_id is None:
+                    return
+                future = self._executors[username].submit(
+                    api.get_receipt, receipt_id, request_pdf, lazy_pdf
+                )
+                pending[future] = (username, receipt_id)
+                in_flight[username] += 1
+
+        try:
+            for username in queues:
+                fill(username)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    username, receipt_id = pending.pop(future)
+                    in_flight[username] -= 1
+                    fill(username)
+                    try:
+                        receipt = future.result()
+                    except Exception as err:
+                        logging.error("Could not get receipt %s of %s: %s", receipt_id, username, err)
+                        failures[(username, receipt_id)] = err
+                        continue
+
+                    yield username, receipt
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        """ Stops the worker threads of every account """
+        for executor in self._executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,290 @@
+"""async migros_api class"""
+
+import asyncio
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from . import metrics
+from .exceptions_migros import ExceptionMigrosApi
+from .migros_api import (
+    MigrosApi, BASE_URL, LOGIN_BASE_URL, HEADERS_LOGIN, HEADERS_CUMULUS, HEADERS_LISTING, HEADERS_EXPORT, 
+    PARAMS_CUMULUS, PARAMS_RECEIPTS
+)
+from .receipt_item import ReceiptItem
+
+
+class AsyncMigrosApi:
+    """ Asyncio counterpart of `MigrosApi`, built on top of aiohttp.
+        Parsing is shared with `MigrosApi`, so results are the same as the sync client.
+
+        It is meant to be used as an async context manager, which logs in on enter
+        and closes the underlying connections on exit,
+
+            async with AsyncMigrosApi(password, username) as migros_api:
+                receipts = await migros_api.get_all_receipts(period_from, period_to)
+    """
+
+    def __init__(self, password, username, max_connections: int = 100, 
+                 base_url: str = BASE_URL, login_base_url: str = LOGIN_BASE_URL):
+        if aiohttp is None:
+            raise ExceptionMigrosApi(7)
+
+        self.__password = password
+        self.__username = username
+        self.__user_real_name = ""
+
+        self.max_connections = max_connections
+        self.session = None
+        self.headers = {}
+
+        self.csfr_pattern = r'(?<="_csrf" content=)(.*)(?=\/>)'
+        self.login_url = login_base_url + "/login"
+        self.cumulus_login = base_url + "/de/cumulus/konto~checkImmediate=true~.html"
+        self.url_receipts = base_url + "/de/cumulus/konto/kassenbons.html?sort=dateDsc&dateFrom={0}&dateTo={1}"
+        self.url_export_data = base_url + "/service/avantaReceiptExport/"
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # ---------------------------------------------------------------------------------------------
+    # Typical behavioral methods ------------------------------------------------------------------
+    @property
+    def user_name(self) -> str:
+        return self.__user_real_name
+    
+    @user_name.setter
+    def user_name(self, user_name: str) -> None:
+        self.__user_real_name = user_name
+    
+    @property
+    def user_email(self) -> str:
+        return self.__username
+
+    # ---------------------------------------------------------------------------------------------
+    # Private methods -----------------------------------------------------------------------------
+
+    async def _authenticate(self):
+        """ Initial authentication to migros.ch/login using 
+            username and password
+
+        Raises:
+            ExceptionMigrosApi: In case username was not found on migros site, meaning 
+                that authentication has failed
+            Exception: If credentials do not match any user on migros side
+        """
+        try:
+            self.headers = dict(HEADERS_LOGIN)
+
+            logging.debug("Getting CSRF token")
+            async with self.session.get(self.login_url, headers=self.headers) as response:
+                text = await response.text()
+
+            self.headers['content-type'] = 'application/x-www-form-urlencoded'
+            csrf = MigrosApi._get_csrf_token(text, self.csfr_pattern)
+
+            # Build up authentication payload
+            raw_data = "_csrf={0}&username={1}&password={2}".format(csrf, self.user_email, self.__password)
+
+            # Authenticate
+            async with self.session.post(self.login_url, headers=self.headers, data=raw_data) as response:
+                response.raise_for_status()
+                logging.debug("Response: %s", response.status)
+                content = await response.read()
+
+            self.user_name = MigrosApi._check_login(content, self.user_email)
+
+        except Exception as err:
+            error_line = sys.exc_info()[-1].tb_lineno
+            raise Exception("Unhandled exception, error: %s, line: %s" % (err, error_line))
+
+    async def _login_cumulus(self):
+        """ After initially login into migros, Cumulus requires an extra get request to land 
+            into the cumulus site
+
+        Raises:
+            Exception: Unhandled exceptions
+        """
+        try:
+            await self._authenticate()
+
+            self.headers.pop('content-type', None)
+            self.headers.update(HEADERS_CUMULUS)
+
+            logging.debug("Login into cumulus account")
+            async with self.session.get(self.cumulus_login, headers=self.headers, 
+                                        params=PARAMS_CUMULUS) as response:
+                logging.debug("Status code: %s", response.status)
+
+        except Exception as err:
+            error_line = sys.exc_info()[-1].tb_lineno
+            raise Exception("Unhandled exception, error: %s, line: %s" % (err, error_line))
+
+    async def _get(self, url: str, headers: dict) -> bytes:
+        """ GET request returning the response body
+
+        Args:
+            url (str): url to request
+            headers (dict): request headers
+
+        Returns:
+            bytes: response content
+        """
+        started = time.perf_counter()
+        async with self.session.get(url, headers=headers, params=PARAMS_RECEIPTS) as response:
+            content = await response.read()
+            if metrics.HOOK is not None:
+                metrics.HOOK.on_request(
+                    'GET', url, response.status, time.perf_counter() - started, len(content)
+                )
+            response.raise_for_status()
+            return content
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    async def login(self) -> None:
+        """ Opens the http session (if needed) and logs into the cumulus account """
+        if self.session is None:
+            # Unsafe cookie jar, so that cookies are also kept when talking to ip hosts
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                cookie_jar=aiohttp.CookieJar(unsafe=True)
+            )
+        await self._login_cumulus()
+
+    async def close(self) -> None:
+        """ Closes the underlying http session """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_all_receipts(self, period_from: datetime, period_to: datetime) -> Dict[str, dict]:
+        """ Retrieves dictionary with receipt (kassenbons) ids as key and receipt information as values.
+            Once the first page is parsed, the remaining pages are requested concurrently. 
+            See `MigrosApi.get_all_receipts()`
+            
+        Args:
+            period_from (datetime): period from, to execute search
+            period_to (datetime): period to, to execute search
+
+        Raises:
+            Exception: for any unhandled exceptions
+
+        Returns:
+            Dict[str, dict]: Period receipts information
+        """
+        try:
+            period_from, period_to = MigrosApi._format_period(period_from, period_to)
+
+            headers = dict(self.headers)
+            headers.update(HEADERS_LISTING)
+            request_url = self.url_receipts.format(period_from, period_to)
+
+            final_dict = {}
+            content = await self._get(request_url + "&p=1", headers)
+            total_pages = MigrosApi._parse_receipt_data(content, final_dict)
+
+            contents = await asyncio.gather(
+                *[
+                    self._get(request_url + "&p=%s" % page, headers) 
+                    for page in range(2, total_pages + 1)
+                ]
+            )
+
+            # Keep page order, same as the sync client
+            for content in contents:
+                MigrosApi._parse_receipt_data(content, final_dict)
+
+            return final_dict
+
+        except Exception as err:
+            error_line = sys.exc_info()[-1].tb_lineno
+            raise Exception("Unhandled exception error: %s, line: %s" % (err, error_line))
+
+    async def get_receipt(self, receipt_id: str, request_pdf: bool = True) -> ReceiptItem:
+        """ Retrieves receipt from given `receipt_id` and returns it into
+            a `ReceiptItem` object. Html and pdf exports are requested concurrently
+
+        Args:
+            receipt_id (str): receipt id to get data
+            request_pdf (bool, optional): also download the pdf export. Defaults to True
+
+        Returns:
+            ReceiptItem: Object containing receipt bought items information
+        """
+        headers = dict(self.headers)
+        headers.update(HEADERS_EXPORT)
+
+        request_url = self.url_export_data + "%s?receiptId=%s" % ('html', receipt_id)
+        logging.debug("Export url: %s", request_url)
+
+        if request_pdf:
+            pdf_url = self.url_export_data + "%s?receiptId=%s" % ('pdf', receipt_id)
+            content, pdf = await asyncio.gather(
+                self._get(request_url, headers), self._get(pdf_url, headers)
+            )
+        else:
+            content, pdf = await self._get(request_url, headers), None
+
+        receipt_id = receipt_id.split("?")[0]
+
+        return ReceiptItem(receipt_id=receipt_id, soup=content, pdf=pdf)
+
+    async def get_receipts(self, receipt_ids: Iterable[str], concurrency: int = 50, 
+                           request_pdf: bool = True, **kwargs) -> AsyncIterator[ReceiptItem]:
+        """ Retrieves many receipts concurrently, yielding every `ReceiptItem` as it completes. 
+            A receipt that fails is logged and stored in `failures` (if given), 
+            the rest of the batch keeps going. See `MigrosApi.get_receipts()`
+
+        Args:
+            receipt_ids (Iterable[str]): receipt ids to get data from
+            concurrency (int, optional): maximum number of receipts in flight. Defaults to 50
+            request_pdf (bool, optional): also download the pdf export. Defaults to True
+            failures (dict, optional): dictionary updated with `receipt_id` as key and 
+                the raised exception as value, for every receipt that could not be fetched
+
+        Yields:
+            AsyncIterator[ReceiptItem]: Objects containing receipt bought items information
+        """
+        failures = kwargs.get("failures", {})
+        receipt_ids = iter(receipt_ids)
+        pending = {}
+
+        def submit_next() -> None:
+            receipt_id = next(receipt_ids, None)
+            if receipt_id is not None:
+                task = asyncio.ensure_future(self.get_receipt(receipt_id, request_pdf))
+                pending[task] = receipt_id
+
+        try:
+            for _ in range(concurrency):
+                submit_next()
+
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    receipt_id = pending.pop(task)
+                    submit_next()
+                    try:
+                        receipt = task.result()
+                    except Exception as err:
+                        logging.error("Could not get receipt %s: %s", receipt_id, err)
+                        failures[receipt_id] = err
+                        continue
+
+                    yield receipt
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,164 @@
+"""backfill_state class"""
+
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+class BackfillState:
+    """
+    Checkpoint used by `MigrosApi.backfill_receipts()`, stored next to each other as
+
+        <path>                  json file with the completed windows and the window size
+        <path>.receipts.jsonl   receipts of the completed windows, one json line per window
+                                with its first and last day
+
+    Receipts are appended before their window is marked as completed, so after a crash a
+    window is at most fetched twice, and duplicated receipts are dropped by `download_id`
+    when loading them. The same checkpoint can be used for different periods, only the
+    receipts of the requested period are loaded
+    """
+
+    def __init__(self, path: str, window_days: int = 30):
+        self.path = path
+        self.receipts_path = path + ".receipts.jsonl"
+        self.window_days = window_days
+        self.done = []
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                state = json.load(file)
+            self.window_days = state.get('window_days', window_days)
+            self.done = [
+                (datetime.strptime(start, DATE_FORMAT), datetime.strptime(end, DATE_FORMAT))
+                for start, end in state.get('done', [])
+            ]
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    def pending_ranges(self, period_from: datetime, period_to: datetime) -> List[Tuple[datetime, datetime]]:
+        """ Parts of the period (whole days, both ends included) not covered by completed windows
+
+        Args:
+            period_from (datetime): first day of the backfill
+            period_to (datetime): last day of the backfill
+
+        Returns:
+            List[Tuple[datetime, datetime]]: first and last day of every missing range, oldest first
+        """
+        one_day = timedelta(days=1)
+        start = self._day(period_from)
+        last_day = self._day(period_to)
+
+        ranges = []
+        for done_start, done_end in sorted(self.done):
+            if done_end < start:
+                continue
+            if done_start > last_day:
+                break
+            if done_start > start:
+                ranges.append((start, done_start - one_day))
+            start = max(start, done_end + one_day)
+
+        if start <= last_day:
+            ranges.append((start, last_day))
+
+        return ranges
+
+    def complete(self, window_from: datetime, window_to: datetime, receipts: Dict[str, dict]) -> None:
+        """ Stores the receipts of a window, then marks it as completed
+
+        Args:
+            window_from (datetime): first day of the window
+            window_to (datetime): last day of the window
+            receipts (Dict[str, dict]): window receipts, as returned by `get_all_receipts()`
+        """
+        with open(self.receipts_path, 'a') as file:
+            file.write(json.dumps({
+                'from': self._day(window_from).strftime(DATE_FORMAT),
+                'to': self._day(window_to).strftime(DATE_FORMAT),
+                'receipts': receipts
+            }) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.done.append((self._day(window_from), self._day(window_to)))
+        self.save()
+
+    def receipts(self, period_from: datetime = None, period_to: datetime = None) -> Dict[str, dict]:
+        """ Receipts of the completed windows within the period, without duplicates. 
+            Windows only partly within the period (completed for another period) are 
+            narrowed down by the listing date of their receipts
+
+        Args:
+            period_from (datetime, optional): first day. Defaults to None, no lower bound
+            period_to (datetime, optional): last day. Defaults to None, no upper bound
+
+        Returns:
+            Dict[str, dict]: receipts information by download id, same format as `get_all_receipts()`
+        """
+        first_day = self._day(period_from) if period_from is not None else datetime.min
+        last_day = self._day(period_to) if period_to is not None else datetime.max
+
+        receipts = {}
+        if not os.path.exists(self.receipts_path):
+            return receipts
+
+        with open(self.receipts_path, 'r') as file:
+            for line in file:
+                # A crash while appending leaves at most one broken last line
+                try:
+                    window = json.loads(line)
+                    window_from = datetime.strptime(window['from'], DATE_FORMAT)
+                    window_to = datetime.strptime(window['to'], DATE_FORMAT)
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+                if window_to < first_day or window_from > last_day:
+                    continue
+                if first_day <= window_from and window_to <= last_day:
+                    receipts.update(window['receipts'])
+                    continue
+
+                for download_id, receipt in window['receipts'].items():
+                    day = self._listing_day(receipt)
+                    if day is not None and first_day <= day <= last_day:
+                        receipts[download_id] = receipt
+
+        return receipts
+
+    def save(self) -> None:
+        """ Writes the completed windows to disk, replacing the previous file atomically """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(
+                {
+                    'window_days': self.window_days,
+                    'done': [
+                        [start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)]
+                        for start, end in sorted(self.done)
+                    ]
+                },
+                file
+            )
+        os.replace(tmp_path, self.path)
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _day(date: datetime) -> datetime:
+        return datetime(date.year, date.month, date.day)
+
+    @staticmethod
+    def _listing_day(receipt: dict) -> datetime:
+        """ Day of a receipt from its listing date, `DD.MM.YYYY`. None if it has none """
+        try:
+            return datetime.strptime(receipt.get('date', ''), "%d.%m.%Y")
+        except ValueError:
+            return None
@@ -10,10 +10,14 @@ class ExceptionMigrosApi(Exception):
             '3': "Could not authenticate to cumulus",
             '4': "period_from and period_to should be datetime objects",
             '5': "`period_from` should be <= to `period_to`",
-            '6': "Request again the item and indicate request_pdf=True"
+            '6': "Request again the item and indicate request_pdf=True",
+            '7': "AsyncMigrosApi requires aiohttp, install it with `pip install aiohttp`",
+            '8': "`period_from` is needed when there is no previous sync",
+            '9': "ReceiptParquetStore requires pyarrow, install it with `pip install pyarrow`",
+            '10': "Receipt html was released, request the item again"
         }
         self.code = str(code)
-        self.msg = error_codes.get(code)
+        self.msg = error_codes.get(self.code)
     
     def __str__(self):
         return self.msg
@@ -0,0 +1,481 @@
+"""line_item_store class"""
+
+from __future__ import annotations
+
+import logging
+import re
+import sqlite3
+import threading
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Iterable, List
+
+from .receipt_frame import build_receipt_frame
+from .receipt_item import ReceiptItem
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Rollup key used for receipts without date
+UNKNOWN_DATE = ''
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    receipt_id TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    store_key TEXT NOT NULL,
+    total REAL NOT NULL,
+    items INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS line_items (
+    receipt_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    article_key TEXT NOT NULL,
+    store_key TEXT NOT NULL,
+    quantity REAL,
+    price REAL,
+    saved REAL,
+    total REAL
+);
+CREATE INDEX IF NOT EXISTS line_items_article ON line_items (article_key, day);
+CREATE INDEX IF NOT EXISTS line_items_store ON line_items (store_key, day);
+CREATE INDEX IF NOT EXISTS line_items_day ON line_items (day);
+CREATE INDEX IF NOT EXISTS line_items_receipt ON line_items (receipt_id);
+
+CREATE TABLE IF NOT EXISTS articles (
+    article_key TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stores (
+    store_key TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rollup_day (
+    day TEXT PRIMARY KEY,
+    total REAL NOT NULL,
+    saved REAL NOT NULL,
+    items INTEGER NOT NULL,
+    receipts INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollup_article (
+    article_key TEXT PRIMARY KEY,
+    quantity REAL NOT NULL,
+    total REAL NOT NULL,
+    items INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rollup_article_total ON rollup_article (total);
+CREATE TABLE IF NOT EXISTS rollup_article_month (
+    article_key TEXT NOT NULL,
+    month TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    total REAL NOT NULL,
+    items INTEGER NOT NULL,
+    PRIMARY KEY (article_key, month)
+);
+CREATE INDEX IF NOT EXISTS rollup_article_month_month ON rollup_article_month (month);
+CREATE TABLE IF NOT EXISTS rollup_store_month (
+    store_key TEXT NOT NULL,
+    month TEXT NOT NULL,
+    total REAL NOT NULL,
+    receipts INTEGER NOT NULL,
+    PRIMARY KEY (store_key, month)
+);
+"""
+
+
+@lru_cache(maxsize=65536)
+def normalize_name(name: str) -> str:
+    """ Key under which articles and stores are indexed: lower case, without accents
+        and with single spaces, so `Gruyère  surchoix` and `GRUYERE surchoix` match
+
+    Args:
+        name (str): article or store name
+
+    Returns:
+        str: normalized name
+    """
+    if not isinstance(name, str):
+        return ''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(x for x in name if not unicodedata.combining(x))
+    return re.sub(r'\s+', ' ', name).strip().lower()
+
+
+class LineItemStore:
+    """
+    Local SQLite store of receipt line items, for spend and product questions that should
+    not need to load every receipt again.
+
+    Line items are indexed by normalized article name, store and day, and rollups by day,
+    article, article and month, and store and month are updated in the same transaction as the new
+    receipts are added, so queries such as `spend_by_month()` or `top_stores()` read a few
+    rollup rows instead of scanning the line items. Receipts already stored are skipped
+    """
+
+    def __init__(self, path: str = "./line_items.sqlite"):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def __len__(self) -> int:
+        """ Number of stored receipts """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+
+    def __contains__(self, receipt_id: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM receipts WHERE receipt_id = ?", (receipt_id,)
+            ).fetchone()
+        return row is not None
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    def add_receipts(self, receipts: Iterable[ReceiptItem], receipts_info: Dict[str, dict] = None) -> int:
+        """ Adds parsed receipts, see `add_frame()`. A receipt given more than once is
+            only added once
+
+        Args:
+            receipts (Iterable[ReceiptItem]): receipts to add
+            receipts_info (Dict[str, dict], optional): receipts information, as returned by
+                `get_all_receipts()`, for the store name and date. Defaults to None
+
+        Returns:
+            int: number of new receipts stored
+        """
+        unique = {}
+        for receipt in receipts:
+            unique.setdefault(receipt.receipt_id, receipt)
+
+        return self.add_frame(build_receipt_frame(unique.values(), receipts_info))
+
+    def add_frame(self, df_items: pd.DataFrame) -> int:
+        """ Adds line items and updates the rollups, in one transaction. Receipts already 
+            stored are skipped, and a receipt whose rows come again further down the frame
+            is added with the rows of its first occurrence
+
+        Args:
+            df_items (pd.DataFrame): line items, as returned by `build_receipt_frame()`, with
+                the rows of a receipt next to each other. `store_name` and `date` columns 
+                are optional
+
+        Returns:
+            int: number of new receipts stored
+        """
+        import pandas as pd
+
+        if df_items.empty:
+            return 0
+
+        line_items, receipts = [], {}
+        articles, stores = {}, {}
+        rollup_day, rollup_article_month, rollup_store = {}, {}, {}
+
+        # Columns are converted once as a whole, rows are then plain python values
+        n_rows = len(df_items)
+        receipt_ids = df_items['receipt_id'].astype(str).tolist()
+        article_names = df_items['Artikelbezeichnung'].astype(str).str.strip().tolist()
+        store_names = [None] * n_rows
+        if 'store_name' in df_items:
+            store_names = df_items['store_name'].astype(object).where(
+                df_items['store_name'].notna(), None
+            ).tolist()
+        days = [UNKNOWN_DATE] * n_rows
+        if 'date' in df_items:
+            days = pd.to_datetime(df_items['date']).dt.strftime("%Y-%m-%d").fillna(UNKNOWN_DATE).tolist()
+        if UNKNOWN_DATE in days:
+            logging.warning("%s line items without date, left out of the day and month rollups",
+                            days.count(UNKNOWN_DATE))
+        quantities, prices, savings, totals = (
+            df_items[column].astype('float64').fillna(0.0).tolist()
+            for column in ('Menge', 'Preis', 'Gespart', 'Total')
+        )
+
+        with self._lock:
+            stored = self._stored_ids(set(receipt_ids))
+
+            # Rows of a receipt seen before in this frame are a second copy of it
+            previous_id, skip = None, False
+            for receipt_id, article_name, store_name, day, quantity, price, saved, total in zip(
+                receipt_ids, article_names, store_names, days, quantities, prices, savings, totals
+            ):
+                if receipt_id != previous_id:
+                    previous_id = receipt_id
+                    skip = receipt_id in stored or receipt_id in receipts
+                if skip:
+                    continue
+
+                store_key = normalize_name(store_name)
+                article_key = normalize_name(article_name)
+                month = day[:7]
+
+                line_items.append((
+                    receipt_id, day, article_key, store_key, quantity, price, saved, total
+                ))
+                articles[article_key] = article_name
+                if store_key:
+                    stores[store_key] = store_name.strip()
+
+                receipt = receipts.setdefault(receipt_id, [day, store_key, 0.0, 0])
+                receipt[2] += total
+                receipt[3] += 1
+
+                day_rollup = rollup_day.setdefault(day, [0.0, 0.0, 0, 0])
+                day_rollup[0] += total
+                day_rollup[1] += saved
+                day_rollup[2] += 1
+
+                article_rollup = rollup_article_month.setdefault((article_key, month), [0.0, 0.0, 0])
+                article_rollup[0] += quantity
+                article_rollup[1] += total
+                article_rollup[2] += 1
+
+            rollup_article = {}
+            for (article_key, _), values in rollup_article_month.items():
+                article_rollup = rollup_article.setdefault(article_key, [0.0, 0.0, 0])
+                for k, value in enumerate(values):
+                    article_rollup[k] += value
+
+            for day, store_key, total, _ in receipts.values():
+                rollup_day[day][3] += 1
+                store_rollup = rollup_store.setdefault((store_key, day[:7]), [0.0, 0])
+                store_rollup[0] += total
+                store_rollup[1] += 1
+
+            if not receipts:
+                return 0
+
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO receipts VALUES (?, ?, ?, ?, ?)",
+                    [(receipt_id, *values) for receipt_id, values in receipts.items()]
+                )
+                self._connection.executemany(
+                    "INSERT INTO line_items VALUES (?, ?, ?, ?, ?, ?, ?, ?)", line_items
+                )
+                self._connection.executemany(
+                    "INSERT INTO articles VALUES (?, ?) "
+                    "ON CONFLICT (article_key) DO UPDATE SET name = excluded.name",
+                    list(articles.items())
+                )
+                self._connection.executemany(
+                    "INSERT INTO stores VALUES (?, ?) "
+                    "ON CONFLICT (store_key) DO UPDATE SET name = excluded.name",
+                    list(stores.items())
+                )
+                self._connection.executemany(
+                    "INSERT INTO rollup_day VALUES (?, ?, ?, ?, ?) ON CONFLICT (day) DO UPDATE SET "
+                    "total = total + excluded.total, saved = saved + excluded.saved, "
+                    "items = items + excluded.items, receipts = receipts + excluded.receipts",
+                    [(day, *values) for day, values in rollup_day.items()]
+                )
+                self._connection.executemany(
+                    "INSERT INTO rollup_article VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (article_key) DO UPDATE SET "
+                    "quantity = quantity + excluded.quantity, total = total + excluded.total, "
+                    "items = items + excluded.items",
+                    [(key, *values) for key, values in rollup_article.items()]
+                )
+                self._connection.executemany(
+                    "INSERT INTO rollup_article_month VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (article_key, month) DO UPDATE SET "
+                    "quantity = quantity + excluded.quantity, total = total + excluded.total, "
+                    "items = items + excluded.items",
+                    [(*key, *values) for key, values in rollup_article_month.items()]
+                )
+                self._connection.executemany(
+                    "INSERT INTO rollup_store_month VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (store_key, month) DO UPDATE SET "
+                    "total = total + excluded.total, receipts = receipts + excluded.receipts",
+                    [(*key, *values) for key, values in rollup_store.items()]
+                )
+
+        logging.debug("Stored %s receipts with %s line items", len(receipts), len(line_items))
+
+        return len(receipts)
+
+    def spend_by_month(self, article: str = None, store: str = None) -> List[dict]:
+        """ Spend per month, for all purchases or for one article or store.
+            Receipts without date are left out
+
+        Args:
+            article (str, optional): article name, matched after normalizing. Defaults to None
+            store (str, optional): store name, matched after normalizing. Defaults to None
+
+        Returns:
+            List[dict]: `month` (YYYY-MM) and `total`, oldest first
+        """
+        if article is not None:
+            query = (
+                "SELECT month, SUM(total) FROM rollup_article_month "
+                "WHERE article_key = ? AND month != '' GROUP BY month ORDER BY month"
+            )
+            params = (normalize_name(article),)
+        elif store is not None:
+            query = (
+                "SELECT month, SUM(total) FROM rollup_store_month "
+                "WHERE store_key = ? AND month != '' GROUP BY month ORDER BY month"
+            )
+            params = (normalize_name(store),)
+        else:
+            query = (
+                "SELECT substr(day, 1, 7) AS month, SUM(total) FROM rollup_day "
+                "WHERE day != '' GROUP BY month ORDER BY month"
+            )
+            params = ()
+
+        return [{'month': month, 'total': total} for month, total in self._query(query, params)]
+
+    def spend_by_day(self, period_from: datetime = None, period_to: datetime = None) -> List[dict]:
+        """ Spend, savings, line items and receipts per day
+
+        Args:
+            period_from (datetime, optional): first day. Defaults to the first stored day
+            period_to (datetime, optional): last day. Defaults to the last stored day
+
+        Returns:
+            List[dict]: `day` (YYYY-MM-DD), `total`, `saved`, `items` and `receipts`, oldest first
+        """
+        day_from = self._format_day(period_from) if period_from else '0'
+        day_to = self._format_day(period_to) if period_to else '9'
+        rows = self._query(
+            "SELECT day, total, saved, items, receipts FROM rollup_day "
+            "WHERE day >= ? AND day <= ? AND day != '' ORDER BY day",
+            (day_from, day_to)
+        )
+        return [
+            {'day': day, 'total': total, 'saved': saved, 'items': items, 'receipts': receipts}
+            for day, total, saved, items, receipts in rows
+        ]
+
+    def top_articles(self, limit: int = 10, by: str = 'total', month: str = None) -> List[dict]:
+        """ Articles with the highest spend (or quantity)
+
+        Args:
+            limit (int, optional): number of articles. Defaults to 10
+            by (str, optional): `total` or `quantity`. Defaults to 'total'
+            month (str, optional): only this month, as YYYY-MM. Defaults to all months
+
+        Returns:
+            List[dict]: `article`, `quantity`, `total` and `items`
+        """
+        order = 'quantity' if by == 'quantity' else 'total'
+        if month is None:
+            query = (
+                "SELECT a.name, r.quantity, r.total, r.items "
+                "FROM rollup_article r JOIN articles a USING (article_key) "
+                "ORDER BY r.%s DESC LIMIT ?" % order
+            )
+            params = (limit,)
+        else:
+            query = (
+                "SELECT a.name, r.quantity, r.total, r.items "
+                "FROM rollup_article_month r JOIN articles a USING (article_key) "
+                "WHERE r.month = ? ORDER BY r.%s DESC LIMIT ?" % order
+            )
+            params = (month, limit)
+
+        rows = self._query(query, params)
+        return [
+            {'article': name, 'quantity': quantity, 'total': total, 'items': items}
+            for name, quantity, total, items in rows
+        ]
+
+    def top_stores(self, limit: int = 10, month: str = None) -> List[dict]:
+        """ Stores with the highest spend
+
+        Args:
+            limit (int, optional): number of stores. Defaults to 10
+            month (str, optional): only this month, as YYYY-MM. Defaults to all months
+
+        Returns:
+            List[dict]: `store`, `total` and `receipts`
+        """
+        where, params = "", ()
+        if month is not None:
+            where, params = "WHERE r.month = ?", (month,)
+
+        rows = self._query(
+            "SELECT s.name, SUM(r.total) AS total, SUM(r.receipts) "
+            "FROM rollup_store_month r JOIN stores s USING (store_key) %s "
+            "GROUP BY r.store_key ORDER BY total DESC LIMIT ?" % where,
+            params + (limit,)
+        )
+        return [{'store': name, 'total': total, 'receipts': receipts} for name, total, receipts in rows]
+
+    def find_articles(self, text: str, limit: int = 20) -> List[str]:
+        """ Stored article names starting with `text`, after normalizing
+
+        Args:
+            text (str): beginning of the article name
+            limit (int, optional): maximum number of names. Defaults to 20
+
+        Returns:
+            List[str]: article names
+        """
+        prefix = normalize_name(text)
+        rows = self._query(
+            "SELECT name FROM articles WHERE article_key >= ? AND article_key < ? "
+            "ORDER BY article_key LIMIT ?",
+            (prefix, prefix + '\uffff', limit)
+        )
+        return [name for name, in rows]
+
+    def article_purchases(self, article: str) -> List[dict]:
+        """ Every line item of an article, using the article index
+
+        Args:
+            article (str): article name, matched after normalizing
+
+        Returns:
+            List[dict]: `receipt_id`, `day`, `store_key`, `quantity`, `price`, `saved` and `total`
+        """
+        rows = self._query(
+            "SELECT receipt_id, day, store_key, quantity, price, saved, total FROM line_items "
+            "WHERE article_key = ? ORDER BY day",
+            (normalize_name(article),)
+        )
+        columns = ('receipt_id', 'day', 'store_key', 'quantity', 'price', 'saved', 'total')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self) -> None:
+        """ Closes the underlying SQLite connection """
+        with self._lock:
+            self._connection.close()
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    def _query(self, query: str, params: tuple) -> list:
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def _stored_ids(self, receipt_ids: set) -> set:
+        """ Receipt ids out of `receipt_ids` already in the store. Expects the lock held """
+        stored = set()
+        receipt_ids = list(receipt_ids)
+        # Stay below the SQLite limit of bound parameters
+        for k in range(0, len(receipt_ids), 500):
+            chunk = receipt_ids[k:k + 500]
+            stored.update(
+                x for x, in self._connection.execute(
+                    "SELECT receipt_id FROM receipts WHERE receipt_id IN (%s)"
+                    % ", ".join("?" * len(chunk)), chunk
+                )
+            )
+        return stored
+
+    @staticmethod
+    def _format_day(date) -> str:
+        """ YYYY-MM-DD for dates and timestamps, `UNKNOWN_DATE` for missing ones """
+        if date is None or date != date:
+            return UNKNOWN_DATE
+        return date.strftime("%Y-%m-%d")
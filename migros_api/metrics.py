@@ -0,0 +1,215 @@
+"""metrics hooks
+
+Requests sent by `Transport` and `AsyncMigrosApi`, and listing and receipt parsing, report
+their timings to the hook set with `set_metrics_hook()`. Without a hook (the default)
+instrumented code only checks `HOOK is None`,
+
+    class PrintMetrics(MetricsHook):
+        def on_request(self, method, url, status, elapsed, size):
+            print(method, url, status, elapsed, size)
+
+    set_metrics_hook(PrintMetrics())
+"""
+
+import logging
+import math
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+
+# Hook receiving the measurements, None disables instrumentation
+HOOK = None
+
+
+class MetricsHook:
+    """
+    Callback interface for measurements. Methods are called from the thread (or event loop)
+    doing the work, so they should return quickly. Override the ones you need
+    """
+
+    def on_request(self, method: str, url: str, status: int, elapsed: float, size: int) -> None:
+        """ Called once per request, after retries
+
+        Args:
+            method (str): http method
+            url (str): requested url
+            status (int): response status, None if the request failed
+            elapsed (float): seconds until the response was received (body included
+                unless it is streamed)
+            size (int): response size in bytes, None if unknown (streamed without length)
+        """
+
+    def on_parse(self, name: str, elapsed: float, rows: int) -> None:
+        """ Called after parsing a page
+
+        Args:
+            name (str): what was parsed, `listing`, `receipt_soup` (html tree of a receipt)
+                or `receipt_rows` (receipt lines to data frame)
+            elapsed (float): seconds spent parsing
+            rows (int): rows found, None if not applicable
+        """
+
+
+class StatsdMetrics(MetricsHook):
+    """
+    Sends measurements as StatsD packets over UDP, e.g. to a local agent or a
+    `statsd_exporter` for Prometheus,
+
+        migros_api.request.kassenbons.200:12.5|ms
+        migros_api.request.kassenbons.bytes:10432|c
+        migros_api.parse.listing:1.7|ms
+        migros_api.parse.listing.rows:20|c
+
+    Requests are named after the last part of their url path. Sending never raises,
+    failed packets are dropped
+
+    Args:
+        host (str, optional): StatsD host. Defaults to 127.0.0.1
+        port (int, optional): StatsD port. Defaults to 8125
+        prefix (str, optional): prefix of every metric. Defaults to migros_api
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8125, prefix: str = "migros_api"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def on_request(self, method: str, url: str, status: int, elapsed: float, size: int) -> None:
+        name = "%s.request.%s" % (self.prefix, self._request_name(url))
+        lines = ["%s.%s:%.3f|ms" % (name, status or 'error', elapsed * 1000)]
+        if size is not None:
+            lines.append("%s.bytes:%s|c" % (name, size))
+        self._send(lines)
+
+    def on_parse(self, name: str, elapsed: float, rows: int) -> None:
+        name = "%s.parse.%s" % (self.prefix, name)
+        lines = ["%s:%.3f|ms" % (name, elapsed * 1000)]
+        if rows is not None:
+            lines.append("%s.rows:%s|c" % (name, rows))
+        self._send(lines)
+
+    def close(self) -> None:
+        self._socket.close()
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _request_name(url: str) -> str:
+        """ Short metric name for an url, e.g. `kassenbons` or `pdf` """
+        path = urlparse(url).path.rstrip('/')
+        name = path.rsplit('/', 1)[-1].split('~')[0].split('.')[0]
+        return name or 'root'
+
+    def _send(self, lines: list) -> None:
+        try:
+            self._socket.sendto("\n".join(lines).encode('ascii'), self.address)
+        except OSError as err:
+            logging.debug("Could not send metrics: %s", err)
+
+
+class RunStats(MetricsHook):
+    """
+    Aggregates the measurements of one run in memory, e.g. to print progress and a summary
+    from a script. Receipts are counted with `add_receipt()`, since cached receipts do not
+    send requests,
+
+        stats = RunStats()
+        set_metrics_hook(stats)
+        for receipt in migros_api.get_receipts(receipt_ids):
+            stats.add_receipt()
+        print(stats.format(stats.snapshot()))
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.receipts = 0
+        self._latencies = []
+        self._lock = threading.Lock()
+
+    def on_request(self, method: str, url: str, status: int, elapsed: float, size: int) -> None:
+        with self._lock:
+            self.requests += 1
+            if status is None or status >= 400:
+                self.errors += 1
+            if size is not None:
+                self.bytes += size
+            self._latencies.append(elapsed)
+
+    def add_receipt(self, count: int = 1) -> None:
+        """ Counts finished receipts
+
+        Args:
+            count (int, optional): receipts finished. Defaults to 1
+        """
+        with self._lock:
+            self.receipts += count
+
+    def snapshot(self) -> dict:
+        """ Totals, rates and latency percentiles since the stats were created
+
+        Returns:
+            dict: counters, `*_per_s` rates and `latency_p50_ms`, `latency_p90_ms`,
+                `latency_p99_ms` and `latency_max_ms`
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            elapsed = time.perf_counter() - self.started
+            result = {
+                'elapsed_s': round(elapsed, 3),
+                'requests': self.requests,
+                'errors': self.errors,
+                'receipts': self.receipts,
+                'bytes': self.bytes,
+                'requests_per_s': round(self.requests / elapsed, 2) if elapsed else 0.0,
+                'receipts_per_s': round(self.receipts / elapsed, 2) if elapsed else 0.0,
+                'bytes_per_s': round(self.bytes / elapsed) if elapsed else 0,
+            }
+
+        for name, rank in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            result['latency_%s_ms' % name] = self._percentile(latencies, rank)
+        result['latency_max_ms'] = round(latencies[-1] * 1000, 2) if latencies else None
+        return result
+
+    @staticmethod
+    def format(snapshot: dict) -> str:
+        """ One line summary of a `snapshot()` """
+        return (
+            "{elapsed_s:.1f}s  requests {requests} ({requests_per_s}/s, {errors} errors)  "
+            "receipts {receipts} ({receipts_per_s}/s)  {megabytes:.2f} MB  "
+            "latency p50 {latency_p50_ms} ms, p90 {latency_p90_ms} ms, p99 {latency_p99_ms} ms"
+        ).format(megabytes=snapshot['bytes'] / 1024 / 1024, **snapshot)
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _percentile(latencies: list, rank: float) -> float:
+        """ Nearest rank percentile of sorted latencies, in milliseconds """
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, max(0, math.ceil(rank * len(latencies)) - 1))
+        return round(latencies[index] * 1000, 2)
+
+
+def set_metrics_hook(hook: MetricsHook) -> None:
+    """ Sets the hook receiving measurements, None turns instrumentation off
+
+    Args:
+        hook (MetricsHook): hook to call
+    """
+    global HOOK
+    HOOK = hook
+
+
+def response_size(response, stream: bool = False) -> int:
+    """ Size of a `requests` response without reading a streamed body """
+    if not stream:
+        return len(response.content)
+    length = response.headers.get('content-length')
+    return int(length) if length and length.isdigit() else None
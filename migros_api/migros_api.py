@@ -6,48 +6,158 @@ import re
 import logging
 import os
 import sys
-from typing import Dict
-from bs4 import BeautifulSoup as bs
-from datetime import datetime
-import numpy as np
-import pandas as pd
+import time
+import threading
+import functools
+import multiprocessing
+from urllib.parse import urlparse
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterable, Iterator
+from datetime import datetime, timedelta
+from . import metrics
 from .exceptions_migros import ExceptionMigrosApi
-from .receipt_item import ReceiptItem
+from .receipt_item import ReceiptItem, parse_receipt_rows
+from .receipt_cache import ReceiptCache
+from .sync_state import SyncState
+from .backfill_state import BackfillState
+from .transport import Transport
 
 
 FILE_PATH_CONF = "./"
 FILE_NAME_CONF = "log_files.log"
 
-logging.basicConfig(
-    format='%(levelname)s: %(asctime)s - %(message)s [%(filename)s:%(lineno)s - %(funcName)s()]',
-    datefmt='%d-%b-%y %H:%M:%S',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler(os.path.join(FILE_PATH_CONF, FILE_NAME_CONF)),
-        logging.StreamHandler()
-    ]
-)
 
+def configure_logging(path: str = FILE_PATH_CONF, file_name: str = FILE_NAME_CONF,
+                      level: int = logging.INFO) -> None:
+    """ Logs to the console and to `path`/`file_name`. Importing the package does not 
+        touch logging, call this from scripts that want the old default setup
+
+    Args:
+        path (str, optional): directory of the log file. Defaults to ./
+        file_name (str, optional): log file name. Defaults to log_files.log
+        level (int, optional): logging level. Defaults to logging.INFO
+    """
+    logging.basicConfig(
+        format='%(levelname)s: %(asctime)s - %(message)s [%(filename)s:%(lineno)s - %(funcName)s()]',
+        datefmt='%d-%b-%y %H:%M:%S',
+        level=level,
+        handlers=[
+            logging.FileHandler(os.path.join(path, file_name)),
+            logging.StreamHandler()
+        ]
+    )
+
+
+BASE_URL = "https://www.migros.ch"
+LOGIN_BASE_URL = "https://login.migros.ch"
+
+ACCEPT_DOCUMENT = "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9"
+
+# Headers used on each one of the steps, shared by the sync and async clients
+HEADERS_LOGIN = {
+    'accept': ACCEPT_DOCUMENT,
+    "accept-language": "en-US,en;q=0.9",
+    "sec-fetch-dest": "document",
+    "sec-fetch-mode": "navigate",
+    "sec-fetch-site": "same-origin",
+    'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/67.0.3396.99 Safari/537.36'
+}
+
+HEADERS_CUMULUS = {
+    "accept": ACCEPT_DOCUMENT,
+    "accept-language": "en-US,en;q=0.9",
+    "sec-fetch-dest": "document",
+    "sec-fetch-mode": "navigate",
+    "sec-fetch-site": "same-origin",
+    "upgrade-insecure-requests": "1",
+}
+
+HEADERS_LISTING = {
+    "accept": "text/html, */*; q=0.01",
+    "accept-language": "de",
+    "sec-fetch-dest": "empty",
+    "sec-fetch-mode": "cors",
+    "sec-fetch-site": "same-origin",
+    "x-requested-with": "XMLHttpRequest",
+}
+
+HEADERS_EXPORT = {
+    "accept": ACCEPT_DOCUMENT,
+    "sec-fetch-dest": "iframe",
+    "sec-fetch-mode": "navigate",
+    "sec-fetch-site": "https://www.migros.ch/de/cumulus/konto/kassenbons.html",
+    "sec-fetch-user": "?1",
+    "upgrade-insecure-requests": "1",
+    "referrer": "https://www.migros.ch/de/cumulus/konto/kassenbons.html",
+    "referrerPolicy": "no-referrer-when-downgrade",
+}
+
+PARAMS_CUMULUS = {
+    "referrer": "https://www.migros.ch/resources/loginPage~lang=de~.html",
+    "referrerPolicy": "no-referrer-when-downgrade",
+}
+
+PARAMS_RECEIPTS = {
+    "referrer": "https://www.migros.ch/de/cumulus/konto/kassenbons.html",
+    "referrerPolicy": "no-referrer-when-downgrade",
+}
 
-class MigrosApi: 
-    """ Migros api class declaration and definition """
 
-    def __init__(self, password, username):
+class MigrosApi: 
+    """ Migros api class declaration and definition 
+
+    Args:
+        password (str): migros account password
+        username (str): migros account email
+        cache (ReceiptCache, optional): if given, receipts are looked up in the cache 
+            before requesting them, and stored there after being downloaded
+        session_file (str, optional): json file where session cookies are stored after 
+            logging in. If it exists, the session is restored from it instead of logging in
+        lazy_login (bool, optional): do not log in when creating the object, but on the 
+            first request. Defaults to False
+        transport (Transport, optional): http layer with pool size, retries and rate limit 
+            settings. Defaults to `Transport()`
+        base_url (str, optional): cumulus site, e.g. a local `StubMigrosServer`. 
+            Defaults to https://www.migros.ch
+        login_base_url (str, optional): login site. Defaults to https://login.migros.ch
+        login_lock (threading.Lock, optional): lock shared with other instances, so that 
+            only one of them logs in at a time (see `AccountPool`). Defaults to a private lock
+
+        Whenever a request shows that the session has expired, it logs in again and the 
+        request is retried once
+    """
+
+    def __init__(self, password, username, cache: ReceiptCache = None, 
+                 session_file: str = None, lazy_login: bool = False, 
+                 transport: Transport = None, base_url: str = BASE_URL, 
+                 login_base_url: str = LOGIN_BASE_URL, login_lock: threading.Lock = None):
         self.__password = password
         self.__username = username
         self.__user_real_name = ""
 
-        self.session = requests.session()
+        self.cache = cache
+        self.session_file = session_file
+
+        # Logins are serialized, the counter lets threads that saw an expired 
+        # session know whether somebody else already logged in again
+        self._login_lock = login_lock if login_lock is not None else threading.Lock()
+        self._login_count = 0
+        self._logged_in = False
+
+        self.transport = transport if transport is not None else Transport()
         self.headers = {}
 
         self.csfr_pattern = r'(?<="_csrf" content=)(.*)(?=\/>)'
-        self.login_url = "https://login.migros.ch/login"
-        self.cumulus_login = "https://www.migros.ch/de/cumulus/konto~checkImmediate=true~.html"
-        self.url_receipts = "https://www.migros.ch/de/cumulus/konto/kassenbons.html?sort=dateDsc&dateFrom={0}&dateTo={1}"
-        self.url_export_data = "https://www.migros.ch/service/avantaReceiptExport/"
-
-        # Log into cumulus
-        self._login_cumulus()
+        self.login_url = login_base_url + "/login"
+        self.cumulus_login = base_url + "/de/cumulus/konto~checkImmediate=true~.html"
+        self.url_receipts = base_url + "/de/cumulus/konto/kassenbons.html?sort=dateDsc&dateFrom={0}&dateTo={1}"
+        self.url_export_data = base_url + "/service/avantaReceiptExport/"
+
+        if session_file and self._restore_session():
+            logging.debug("Restored session from %s", session_file)
+        elif not lazy_login:
+            # Log into cumulus
+            self._login()
         
     # ---------------------------------------------------------------------------------------------
     # Typical behavioral methods ------------------------------------------------------------------
@@ -62,6 +172,14 @@ class MigrosApi:
     @property
     def user_email(self) -> str:
         return self.__username
+
+    @property
+    def session(self) -> requests.Session:
+        return self.transport.session
+
+    @session.setter
+    def session(self, session: requests.Session) -> None:
+        self.transport.session = session
     
     # ---------------------------------------------------------------------------------------------
     # Private methods -----------------------------------------------------------------------------
@@ -77,62 +195,29 @@ class MigrosApi:
         """
 
         try: 
-            self.headers = {
-                'accept': "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-                "accept-language": "en-US,en;q=0.9",
-                "sec-fetch-dest": "document",
-                "sec-fetch-mode": "navigate",
-                "sec-fetch-site": "same-origin",
-                'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/67.0.3396.99 Safari/537.36'
-            }
+            self.headers = dict(HEADERS_LOGIN)
 
             logging.debug("Getting CSRF token")
-            response = self.session.get(self.login_url, headers=self.headers)
+            response = self.transport.get(self.login_url, headers=self.headers)
 
             # Build up cookies
             self.headers['cookie'] = '; '.join([x.name + '=' + x.value for x in response.cookies])
             self.headers['content-type'] = 'application/x-www-form-urlencoded'
 
             # Search first for the CSRF token upon first get request
-            csrf = re.search(self.csfr_pattern, response.text).group(0)
-            csrf = eval(csrf)
-            display_token = csrf[0:5] + "...."
-            logging.debug("Found CSR token: %s", display_token)
+            csrf = self._get_csrf_token(response.text, self.csfr_pattern)
 
             # Build up authentication payload
             raw_data = "_csrf={0}&username={1}&password={2}".format(csrf, self.user_email, self.__password)
             
             # Authenticate
-            response = self.session.post(self.login_url, headers=self.headers, data=raw_data)
+            response = self.transport.post(self.login_url, headers=self.headers, data=raw_data)
             response.raise_for_status()
             status_code = response.status_code
 
             logging.debug("Response: %s", status_code)
 
-            soup = bs(response.content, 'lxml')
-
-            # Check if we have logged in successfully
-            soup_item = soup.find("div", attrs={"class": "m-accountmenu"})
-
-            if not soup_item:
-                raise ExceptionMigrosApi(1)
-
-            # If the following attribute is true, then we are pretty much in
-            if soup_item.get('data-logged-in') != 'true':
-                raise ExceptionMigrosApi(1)
-
-            email_address = soup_item.find(
-                "span", attrs={"class": "m-accountmenuflyout__info-mail"}
-            ).text
-
-            # If email address not found
-            if email_address != self.user_email:
-                raise ExceptionMigrosApi(2)
-            
-            # Get user name
-            self.user_name = soup_item.find(
-                "span", attrs={"class": "m-accountmenuflyout__info-title"}
-            ).text
+            self.user_name = self._check_login(response.content, self.user_email)
         
         except Exception as err:
             error_line = sys.exc_info()[-1].tb_lineno
@@ -155,24 +240,10 @@ class MigrosApi:
             self.headers['cookie'] = '; '.join([x.name + '=' + x.value for x in self.session.cookies])
 
             # Update headers
-            self.headers.update(
-                {
-                    "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-                    "accept-language": "en-US,en;q=0.9",
-                    "sec-fetch-dest": "document",
-                    "sec-fetch-mode": "navigate",
-                    "sec-fetch-site": "same-origin",
-                    "upgrade-insecure-requests": "1",
-                }
-            )
-
-            params = {
-                "referrer": "https://www.migros.ch/resources/loginPage~lang=de~.html",
-                "referrerPolicy": "no-referrer-when-downgrade",
-            }
+            self.headers.update(HEADERS_CUMULUS)
 
             logging.debug("Login into cumulus account")
-            response = self.session.get(self.cumulus_login, headers=self.headers, params=params)
+            response = self.transport.get(self.cumulus_login, headers=self.headers, params=PARAMS_CUMULUS)
             status_code = response.status_code
             logging.debug("Status code: %s", status_code)
                 
@@ -180,10 +251,128 @@ class MigrosApi:
             error_line = sys.exc_info()[-1].tb_lineno
             raise Exception("Unhandled exception, line: %s" % error_line)
     
+    def _login(self, seen_login_count: int = None) -> None:
+        """ Logs into cumulus and stores the session, unless another thread already 
+            logged in since `seen_login_count` was read
+
+        Args:
+            seen_login_count (int, optional): value of the login counter seen by the caller
+        """
+        with self._login_lock:
+            if seen_login_count is not None and seen_login_count != self._login_count:
+                return
+
+            self._login_cumulus()
+            self._logged_in = True
+            self._login_count += 1
+            self._save_session()
+
+    def _get(self, url: str, headers: dict, **kwargs):
+        """ Session GET request with current cookies. Logs in first if needed, and logs in 
+            again and retries once if the response shows that the session expired
+
+        Args:
+            url (str): url to request
+            headers (dict): request headers, the cookie header is filled in here
+
+        Returns:
+            requests.Response: response
+        """
+        if not self._logged_in:
+            self._login(self._login_count)
+
+        login_count = self._login_count
+        response = self.transport.get(url, headers=self._with_cookies(headers), **kwargs)
+
+        if self._session_expired(response):
+            logging.info("Session expired, logging in again")
+            response.close()
+            self._login(login_count)
+            response = self.transport.get(url, headers=self._with_cookies(headers), **kwargs)
+
+        return response
+
+    def _with_cookies(self, headers: dict) -> dict:
+        """ Copy of `headers` with the session cookies -> otherwise it will not work """
+        headers = dict(headers)
+        headers['cookie'] = '; '.join(
+            [
+                x[0] + '=' + x[1] for x in self.session.cookies.get_dict().items()
+            ]
+        )
+        return headers
+
+    def _session_expired(self, response) -> bool:
+        """ Expired sessions are either refused or redirected to the login page """
+        if response.status_code in (401, 403):
+            return True
+
+        url = response.url or ""
+        login_host = urlparse(self.login_url).netloc
+        if login_host != urlparse(self.cumulus_login).netloc:
+            return urlparse(url).netloc == login_host
+        # Login and cumulus on the same host (e.g. stub server), only the login page counts
+        return url.startswith(self.login_url)
+
+    def _save_session(self) -> None:
+        """ Stores session cookies into `session_file`, readable only by the current user """
+        if not self.session_file:
+            return
+
+        state = {
+            'user_email': self.user_email,
+            'user_name': self.user_name,
+            'cookies': [
+                {
+                    'name': cookie.name, 
+                    'value': cookie.value, 
+                    'domain': cookie.domain,
+                    'path': cookie.path, 
+                    'expires': cookie.expires, 
+                    'secure': cookie.secure
+                } for cookie in self.session.cookies
+            ]
+        }
+
+        tmp_path = self.session_file + ".tmp"
+        file_descriptor = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp_path, self.session_file)
+
+    def _restore_session(self) -> bool:
+        """ Loads session cookies from `session_file`
+
+        Returns:
+            bool: whether a session for this user could be restored
+        """
+        try:
+            with open(self.session_file, 'r') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        if state.get('user_email') != self.user_email:
+            return False
+
+        now = time.time()
+        for cookie in state.get('cookies', []):
+            if cookie['expires'] is not None and cookie['expires'] < now:
+                continue
+            self.session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+
+        self.user_name = state.get('user_name', "")
+        self.headers = dict(HEADERS_LOGIN)
+        self.headers.update(HEADERS_CUMULUS)
+        self._logged_in = True
+
+        return True
+
     # ---------------------------------------------------------------------------------------------
     # Public methods ------------------------------------------------------------------------------
 
-    def get_all_receipts(self, period_from: datetime, period_to: datetime, **kwargs) -> Dict[str, dict]:
+    def get_all_receipts(self, period_from: datetime, period_to: datetime, 
+                         max_workers: int = None, **kwargs) -> Dict[str, dict]:
         """ Retrieves dictionary with receipt (kassenbons) ids as key and receipt information as values.
             Receipt information includes the following, 
                 `receipt_id`, `store_name`, `cost`, and `cumulus_points`
@@ -191,6 +380,11 @@ class MigrosApi:
         Args:
             period_from (datetime): period from, to execute search
             period_to (datetime): period to, to execute search
+            max_workers (int, optional): if given, once the first page is parsed the remaining 
+                pages are fetched concurrently using at most `max_workers` threads. Results are 
+                merged in page order, so the returned dictionary is the same as the serial one
+            page_retries (int, optional): only used together with `max_workers`, number of 
+                times a failed page is requested again before giving up. Defaults to 2
 
         Raises:
             ExceptionMigrosApi: if `period_from` or `period_to` are not datetime objects
@@ -201,71 +395,34 @@ class MigrosApi:
             Dict[str, dict]: Period receipts information
         """
 
-        current_page = 1
-
         # Used for troubleshooting, store response inside a list
         response_list = []
         if "response" in kwargs:
             response_list = kwargs.get("response")
         try:
-            # Check that all dates provided are correctly formatted
-            for date in (period_from, period_to): 
-                if not isinstance(period_from, datetime): 
-                    raise ExceptionMigrosApi(4)
-
-            if period_from > period_to:
-                raise ExceptionMigrosApi(5)
-
-            # Format according to payload needs
-            period_from = datetime.strftime(period_from, "%Y-%m-%-d")
-            period_to = datetime.strftime(period_to, "%Y-%m-%-d")
-
-            # Build up cookies -> otherwise it will not work
-            self.headers['cookie'] = '; '.join(
-                [
-                    x[0] + '=' + x[1] for x in self.session.cookies.get_dict().items()
-                ]
-            )
-
-            self.headers.update(
-                {
-                    "accept": "text/html, */*; q=0.01",
-                    "accept-language": "de",
-                    "sec-fetch-dest": "empty",
-                    "sec-fetch-mode": "cors",
-                    "sec-fetch-site": "same-origin",
-                    "x-requested-with": "XMLHttpRequest",
-                }
-            )
-
-            params = {
-                "referrer": "https://www.migros.ch/de/cumulus/konto/kassenbons.html",
-                "referrerPolicy": "no-referrer-when-downgrade",
-            }
-
-            # Request url to get receipts
-            request_url = self.url_receipts.format(period_from, period_to)
+            request_url = self._get_listing_url(period_from, period_to)
+            headers = self._listing_headers()
 
             # While we have pages available on cumulus side keep on getting the data
             final_dict = {}
-
-            url = request_url + "&p=%s" % current_page
-            response = self.session.get(url, headers=self.headers, params=params)
-
-            # For troubleshooting purposes
-            response_list.append(response)
+            pages = self._iter_receipt_pages(request_url, headers, response_list)
 
             # First response will give us info on how many pages to expect
-            total_pages: int = self._parse_receipt_data(response, final_dict)
+            page_dict, total_pages = next(pages)
+            final_dict.update(page_dict)
+
+            if max_workers and total_pages > 1:
+                pages.close()
+                page_retries = kwargs.get("page_retries", 2)
+                self._get_receipt_pages_parallel(
+                    request_url, range(2, total_pages + 1), headers, PARAMS_RECEIPTS, final_dict, 
+                    response_list, max_workers, page_retries
+                )
+                return final_dict
 
             # Keep on getting item data until we ran out of pages
-            while current_page != total_pages:
-                current_page += 1
-                url = request_url + "&p=%s" % current_page
-                response = self.session.get(url, headers=self.headers, params=params)
-                response_list.append(response)
-
-                total_pages: int = self._parse_receipt_data(response, final_dict)
+            for page_dict, _ in pages:
+                final_dict.update(page_dict)
             
             return final_dict
 
@@ -273,65 +430,710 @@ class MigrosApi:
             error_line = sys.exc_info()[-1].tb_lineno
             raise Exception("Unhandled exception error: %s, line: %s" % (err, error_line))
 
-    def get_receipt(self, receipt_id: str) -> ReceiptItem:
+    def iter_receipts(self, period_from: datetime, period_to: datetime, 
+                      fetch_receipts: bool = False, max_workers: int = 4, 
+                      request_pdf: bool = False, **kwargs) -> Iterator[tuple]:
+        """ Streaming counterpart of `get_all_receipts()`. Listing pages are requested one 
+            after the other and their receipts yielded as soon as a page is parsed, so memory 
+            does not grow with the length of the period
+
+            With `fetch_receipts`, receipt ids go straight into `get_receipts()`, exports start 
+            downloading while later listing pages are still being requested, and every 
+            receipt is yielded together with its export. Only `max_workers * 2` receipts are 
+            in flight at any time
+
+        Args:
+            period_from (datetime): period from, to execute search
+            period_to (datetime): period to, to execute search
+            fetch_receipts (bool, optional): also download every receipt. Defaults to False
+            max_workers (int, optional): see `get_receipts()`. Defaults to 4
+            request_pdf (bool, optional): see `get_receipt()`. Defaults to False
+            lazy_pdf, ordered, failures, parse_processes: passed on to `get_receipts()`
+
+        Raises:
+            ExceptionMigrosApi: if `period_from` or `period_to` are not datetime objects
+            ExceptionMigrosApi: if `period_from` > `period_to`
+
+        Yields:
+            Iterator[tuple]: (download id, receipt information), and the `ReceiptItem` as 
+                third element with `fetch_receipts`
+        """
+        request_url = self._get_listing_url(period_from, period_to)
+        headers = self._listing_headers()
+
+        def listing() -> Iterator[tuple]:
+            for page_dict, _ in self._iter_receipt_pages(request_url, headers):
+                yield from page_dict.items()
+
+        if not fetch_receipts:
+            yield from listing()
+            return
+
+        # Listing entries of receipts being downloaded, by `ReceiptItem.receipt_id`
+        in_flight = {}
+
+        def receipt_ids() -> Iterator[str]:
+            for download_id, receipt_info in listing():
+                receipt_id = receipt_info['receipt_id']
+                in_flight.setdefault(receipt_id.split("?")[0], []).append((download_id, receipt_info))
+                yield receipt_id
+
+        def pop_entry(receipt_id: str) -> tuple:
+            entries = in_flight[receipt_id]
+            entry = entries.pop(0)
+            if not entries:
+                del in_flight[receipt_id]
+            return entry
+
+        failures = kwargs.setdefault("failures", {})
+        n_failures = len(failures)
+        for receipt in self.get_receipts(receipt_ids(), max_workers, request_pdf=request_pdf, **kwargs):
+            download_id, receipt_info = pop_entry(receipt.receipt_id)
+            yield download_id, receipt_info, receipt
+
+            # Failed receipts are only reported in `failures`, forget their entries
+            if len(failures) != n_failures:
+                for receipt_id in list(failures)[n_failures:]:
+                    if receipt_id.split("?")[0] in in_flight:
+                        pop_entry(receipt_id.split("?")[0])
+                n_failures = len(failures)
+
+    def sync_receipts(self, state_path: str, period_from: datetime = None, 
+                      period_to: datetime = None) -> Dict[str, dict]:
+        """ Incremental version of get_all_receipts(), only returns receipts that were not 
+            seen on previous syncs. The newest known receipt ids and the last synced date 
+            are kept in a json file at `state_path` between runs.
+
+            Since receipts are listed newest first, paging stops as soon as a page 
+            contains an already known receipt, so a daily sync usually costs one request
+
+        Args:
+            state_path (str): path of the json file holding the sync state
+            period_from (datetime, optional): period from, needed on the first sync only. 
+                Defaults to the day before the last sync
+            period_to (datetime, optional): period to. Defaults to now
+
+        Raises:
+            ExceptionMigrosApi: if there is no previous sync and `period_from` is not given
+            Exception: for any other unhandled exceptions
+
+        Returns:
+            Dict[str, dict]: New receipts information, same format as get_all_receipts()
+        """
+        state = SyncState(state_path)
+
+        if period_from is None:
+            if state.last_sync is None:
+                raise ExceptionMigrosApi(8)
+            # Overlap one day, receipts from the last synced day may have been added later
+            period_from = state.last_sync - timedelta(days=1)
+        if period_to is None:
+            period_to = datetime.now()
+
+        try:
+            request_url = self._get_listing_url(period_from, period_to)
+            headers = self._listing_headers()
+
+            new_receipts = {}
+            for page_dict, _ in self._iter_receipt_pages(request_url, headers):
+                reached_known = False
+                for download_id, receipt in page_dict.items():
+                    if download_id in state:
+                        reached_known = True
+                    else:
+                        new_receipts[download_id] = receipt
+
+                if reached_known:
+                    break
+
+        except Exception as err:
+            error_line = sys.exc_info()[-1].tb_lineno
+            raise Exception("Unhandled exception error: %s, line: %s" % (err, error_line))
+
+        state.update(list(new_receipts), period_to)
+        state.save()
+        logging.info("Synced %s new receipts", len(new_receipts))
+
+        return new_receipts
+
+    def backfill_receipts(self, checkpoint_path: str, period_from: datetime, 
+                          period_to: datetime = None, max_workers: int = 4, 
+                          window_days: int = 30, **kwargs) -> Dict[str, dict]:
+        """ Resumable version of get_all_receipts() for long periods. The period is split
+            into date windows fetched concurrently, and every completed window is saved 
+            to a checkpoint at `checkpoint_path` (see `BackfillState`), so that running 
+            it again only fetches the windows that did not complete.
+
+            Window sizes adapt as windows complete: windows listing more than 
+            `target_pages` pages get narrower and sparse ones get wider. A window that 
+            keeps failing is logged and stored in `failures`, the others keep going
+
+        Args:
+            checkpoint_path (str): path of the json checkpoint file
+            period_from (datetime): period from, to execute search
+            period_to (datetime, optional): period to. Defaults to now
+            max_workers (int, optional): windows fetched at the same time. Defaults to 4
+            window_days (int, optional): initial window size, in days. Defaults to 30
+            target_pages (int, optional): listing pages aimed at per window. Defaults to 3
+            min_days (int, optional): smallest window, in days. Defaults to 1
+            max_days (int, optional): largest window, in days. Defaults to 365
+            window_retries (int, optional): times a failed window is requested again. Defaults to 2
+            failures (dict, optional): dictionary updated with (first day, last day) of 
+                every window that could not be fetched as key and the exception as value
+
+        Raises:
+            ExceptionMigrosApi: if `period_from` or `period_to` are not datetime objects
+            ExceptionMigrosApi: if `period_from` > `period_to`
+
+        Returns:
+            Dict[str, dict]: receipts information of the period without duplicates, 
+                same format as get_all_receipts()
+        """
+        target_pages = kwargs.get("target_pages", 3)
+        min_days = kwargs.get("min_days", 1)
+        max_days = kwargs.get("max_days", 365)
+        window_retries = kwargs.get("window_retries", 2)
+        failures = kwargs.get("failures", {})
+
+        if period_to is None:
+            period_to = datetime.now()
+        self._format_period(period_from, period_to)
+
+        state = BackfillState(checkpoint_path, window_days)
+        self.transport.ensure_pool_size(max_workers)
+
+        def windows() -> Iterator[tuple]:
+            # Window size is read for every window, so it follows the adaptation
+            for range_from, range_to in state.pending_ranges(period_from, period_to):
+                window_from = range_from
+                while window_from <= range_to:
+                    window_to = min(range_to, window_from + timedelta(days=state.window_days - 1))
+                    yield window_from, window_to
+                    window_from = window_to + timedelta(days=1)
+
+        pending_windows = windows()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+
+            def submit_next() -> None:
+                window = next(pending_windows, None)
+                if window is not None:
+                    future = executor.submit(self._get_receipts_window, *window, window_retries)
+                    pending[future] = window
+
+            for _ in range(max_workers):
+                submit_next()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window_from, window_to = pending.pop(future)
+                    try:
+                        receipts, total_pages = future.result()
+                    except Exception as err:
+                        logging.error("Could not get receipts from %s to %s: %s", 
+                                      window_from.date(), window_to.date(), err)
+                        failures[(window_from, window_to)] = err
+                    else:
+                        state.complete(window_from, window_to, receipts)
+
+                        # Scale the window towards `target_pages`, at most doubling it at once
+                        days = (window_to - window_from).days + 1
+                        new_days = int(days * target_pages / max(total_pages, 1))
+                        state.window_days = max(min_days, min(max_days, days * 2, new_days))
+                        logging.debug("Window %s - %s: %s pages, next windows %s days", 
+                                      window_from.date(), window_to.date(), total_pages, 
+                                      state.window_days)
+                    submit_next()
+
+        state.save()
+        receipts = state.receipts(period_from, period_to)
+        logging.info("Backfilled %s receipts", len(receipts))
+
+        return receipts
+
+    def get_receipt(self, receipt_id: str, request_pdf: bool = True, 
+                    lazy_pdf: bool = False, **kwargs) -> ReceiptItem:
         """ Retrieves receipt from given `receipt_id` and returns it into
             a `ReceiptItem` object. Object contains items bought 
             information, with quantities and prices
 
         Args:
             receipt_id (str): receipt id to get data
+            request_pdf (bool, optional): also download the pdf export. Defaults to True
+            lazy_pdf (bool, optional): do not download the pdf now, but on the first 
+                `ReceiptItem.to_pdf()` call, streaming it to disk. Defaults to False
+            parse (bool, optional): parse new receipts to store them in the cache. When 
+                False, new receipts are left for the caller to parse and cache. Defaults to True
 
         Returns:
             ReceiptItem: Object containing receipt bought items information
         """
+        parse = kwargs.get("parse", True)
+        cache_key = receipt_id.split("?")[0]
+        cached = self.cache.get(cache_key) if self.cache is not None else None
 
-        # Build up cookies -> otherwise it will not work
-        self.headers['cookie'] = '; '.join(
-            [
-                x[0] + '=' + x[1] for x in self.session.cookies.get_dict().items()
-            ]
-        )
-        self.headers.update(
-            {
-            "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-            "sec-fetch-dest": "iframe",
-            "sec-fetch-mode": "navigate",
-            "sec-fetch-site": "https://www.migros.ch/de/cumulus/konto/kassenbons.html",
-            "sec-fetch-user": "?1",
-            "upgrade-insecure-requests": "1",
-            "referrer": "https://www.migros.ch/de/cumulus/konto/kassenbons.html",
-            "referrerPolicy": "no-referrer-when-downgrade",
-            }
+        if cached is None:
+            response = self._get_receipt_export('html', receipt_id)
+            response.raise_for_status()
+            content = response.content
+            pdf = None
+            rows = None
+        else:
+            content = cached['html']
+            pdf = cached['pdf']
+            rows = cached['rows']
+
+        pdf_loader = None
+        if request_pdf and pdf is None:
+            if lazy_pdf:
+                pdf_loader = functools.partial(self._get_receipt_export, 'pdf', receipt_id, stream=True)
+            else:
+                response_pdf = self._get_receipt_export('pdf', receipt_id)
+                response_pdf.raise_for_status()
+                pdf = response_pdf.content
+
+        receipt_item = ReceiptItem(
+            receipt_id=cache_key, soup=content, pdf=pdf, pdf_loader=pdf_loader, rows=rows
         )
 
-        # Check if parameters are indeed needed
-        params = {
-            "referrer": "https://www.migros.ch/de/cumulus/konto/kassenbons.html",
-            "referrerPolicy": "no-referrer-when-downgrade"
-        }
+        # Store new receipts, or cached ones for which we just downloaded the pdf
+        if self.cache is not None and (cached is None or (pdf is not None and cached['pdf'] is None)):
+            if parse or receipt_item.parsed:
+                self.cache.put(cache_key, content, pdf, receipt_item.get_data_frame())
 
-        # Build url to search on that given period
-        request_url = self.url_export_data + "%s?receiptId=%s" % ('html', receipt_id)
-        logging.debug("Export url: %s", request_url)
+        return receipt_item
 
-        request_pdf = self.url_export_data + "%s?receiptId=%s" % ('pdf', receipt_id)
+    def get_receipts(self, receipt_ids: Iterable[str], max_workers: int = 4, 
+                     ordered: bool = False, request_pdf: bool = True, 
+                     lazy_pdf: bool = False, **kwargs) -> Iterator[ReceiptItem]:
+        """ Retrieves many receipts concurrently, yielding every `ReceiptItem` as soon as 
+            it is ready. At most `max_workers` receipts are being downloaded at the same 
+            time, and only a few more are queued, so `receipt_ids` can be a lazy iterable
 
-        response = self.session.get(request_url, headers=self.headers, params=params)
-        response_pdf = self.session.get(request_pdf, headers=self.headers, params=params)
+            A receipt that fails is logged and stored in `failures` (if given), 
+            the rest of the batch keeps going
 
-        receipt_id = receipt_id.split("?")[0]
+            With `parse_processes`, downloads stay on threads and the html exports are
+            parsed by a process pool, so parsing does not hold the GIL of the downloaders.
+            Only the parsed rows come back from the processes, and receipts are yielded 
+            already parsed
 
-        return ReceiptItem(receipt_id=receipt_id, soup=response.content, pdf=response_pdf.content)
+        Args:
+            receipt_ids (Iterable[str]): receipt ids to get data from
+            max_workers (int, optional): maximum number of concurrent downloads. Defaults to 4
+            ordered (bool, optional): yield receipts in the same order as `receipt_ids` 
+                instead of as they complete. Defaults to False
+            request_pdf (bool, optional): see `get_receipt()`. Defaults to True
+            lazy_pdf (bool, optional): see `get_receipt()`. Defaults to False
+            failures (dict, optional): dictionary updated with `receipt_id` as key and 
+                the raised exception as value, for every receipt that could not be fetched
+            parse_processes (int, optional): number of processes parsing receipts. 
+                Defaults to None, receipts are parsed on first use
+
+        Yields:
+            Iterator[ReceiptItem]: Objects containing receipt bought items information
+        """
+        failures = kwargs.get("failures", {})
+        parse_processes = kwargs.get("parse_processes")
+
+        if not parse_processes:
+            yield from self._fetch_receipts(
+                receipt_ids, max_workers, ordered, request_pdf, lazy_pdf, failures, parse=True
+            )
+            return
+
+        receipts = self._fetch_receipts(
+            receipt_ids, max_workers, ordered, request_pdf, lazy_pdf, failures, parse=False
+        )
+        yield from self._parse_receipts(receipts, parse_processes, ordered)
     
     # ---------------------------------------------------------------------------------------------
     # Helper functions ----------------------------------------------------------------------------
 
-    def _parse_receipt_data(self, response: bytes, result_dict: dict) -> int:
+    def _fetch_receipts(self, receipt_ids: Iterable[str], max_workers: int, ordered: bool,
+                        request_pdf: bool, lazy_pdf: bool, failures: dict, 
+                        parse: bool) -> Iterator[ReceiptItem]:
+        """ Downloads receipts on a thread pool, see `get_receipts()` """
+        max_pending = max_workers * 2
+        self.transport.ensure_pool_size(max_workers)
+        receipt_ids = iter(receipt_ids)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+
+            def submit_next() -> None:
+                receipt_id = next(receipt_ids, None)
+                if receipt_id is not None:
+                    future = executor.submit(
+                        self.get_receipt, receipt_id, request_pdf, lazy_pdf, parse=parse
+                    )
+                    pending[future] = receipt_id
+
+            try:
+                for _ in range(max_pending):
+                    submit_next()
+
+                while pending:
+                    if ordered:
+                        # Dictionaries keep insertion order, the first one is the oldest
+                        done = [next(iter(pending))]
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        receipt_id = pending.pop(future)
+                        submit_next()
+                        try:
+                            receipt = future.result()
+                        except Exception as err:
+                            logging.error("Could not get receipt %s: %s", receipt_id, err)
+                            failures[receipt_id] = err
+                            continue
+
+                        yield receipt
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _parse_receipts(self, receipts: Iterator[ReceiptItem], processes: int, 
+                        ordered: bool) -> Iterator[ReceiptItem]:
+        """ Parses downloaded receipts on a process pool, keeping at most `processes * 2`
+            receipts in flight. Receipts that already have rows (e.g. cached) pass through
+
+        Args:
+            receipts (Iterator[ReceiptItem]): downloaded receipts
+            processes (int): number of parsing processes
+            ordered (bool): yield receipts in the order they come in
+
+        Yields:
+            Iterator[ReceiptItem]: parsed receipts
+        """
+        max_pending = processes * 2
+
+        # Download threads are already running, forking this process could deadlock the 
+        # children, so they are started from a fresh interpreter instead
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        mp_context = multiprocessing.get_context(start_method)
+
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context) as executor:
+            pending = {}
+
+            def submit_next() -> bool:
+                receipt = next(receipts, None)
+                if receipt is None:
+                    return False
+
+                if receipt.parsed:
+                    future = Future()
+                    future.set_result(None)
+                else:
+                    future = executor.submit(
+                        parse_receipt_rows, receipt.receipt_id, receipt.get_raw_html()
+                    )
+                pending[future] = receipt
+                return True
+
+            try:
+                while len(pending) < max_pending and submit_next():
+                    pass
+
+                while pending:
+                    if ordered:
+                        done = [next(iter(pending))]
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        receipt = pending.pop(future)
+                        submit_next()
+                        rows = future.result()
+                        if receipt.parsed:
+                            yield receipt
+                            continue
+
+                        receipt.set_rows(rows)
+                        if self.cache is not None and rows is not None:
+                            self.cache.put(
+                                receipt.receipt_id, receipt.get_raw_html(), receipt.get_pdf(), rows
+                            )
+                        yield receipt
+            finally:
+                for future in pending:
+                    future.cancel()
+                receipts.close()
+
+    def _get_listing_url(self, period_from: datetime, period_to: datetime) -> str:
+        """ Checks the period and builds the listing url
+
+        Args:
+            period_from (datetime): period from, to execute search
+            period_to (datetime): period to, to execute search
+
+        Returns:
+            str: listing url without the page parameter
+        """
+        period_from, period_to = self._format_period(period_from, period_to)
+
+        # Request url to get receipts
+        return self.url_receipts.format(period_from, period_to)
+
+    def _listing_headers(self) -> dict:
+        """ Headers of the listing requests. Built once per listing as a copy, since a 
+            re-login replaces `self.headers` and backfill windows run concurrently. 
+            Cookies are added on every request by _get()
+        """
+        if not self._logged_in:
+            self._login(self._login_count)
+
+        headers = dict(self.headers)
+        headers.update(HEADERS_LISTING)
+        return headers
+
+    def _iter_receipt_pages(self, request_url: str, headers: dict, 
+                            response_list: list = None) -> Iterator[tuple]:
+        """ Requests listing pages one after the other, until we ran out of pages
+
+        Args:
+            request_url (str): listing url without the page parameter
+            headers (dict): listing request headers, see `_listing_headers()`
+            response_list (list, optional): list where responses are appended
+
+        Yields:
+            Iterator[tuple]: dictionary with the page receipts and total number of pages
+        """
+        current_page = 1
+        while True:
+            url = request_url + "&p=%s" % current_page
+            response = self._get(url, headers, params=PARAMS_RECEIPTS)
+
+            # For troubleshooting purposes
+            if response_list is not None:
+                response_list.append(response)
+
+            page_dict = {}
+            total_pages: int = self._parse_receipt_data(response, page_dict)
+            yield page_dict, total_pages
+
+            if current_page >= total_pages:
+                break
+            current_page += 1
+
+    def _get_receipts_window(self, window_from: datetime, window_to: datetime, 
+                             retries: int) -> tuple:
+        """ Fetches every listing page of a backfill window, starting over on failure
+
+        Args:
+            window_from (datetime): first day of the window
+            window_to (datetime): last day of the window
+            retries (int): times the window is requested again before giving up
+
+        Returns:
+            tuple: window receipts information and its number of listing pages
+        """
+        request_url = self._get_listing_url(window_from, window_to)
+        headers = self._listing_headers()
+
+        for attempt in range(retries + 1):
+            try:
+                receipts, total_pages = {}, 1
+                for page_dict, total_pages in self._iter_receipt_pages(request_url, headers):
+                    receipts.update(page_dict)
+                return receipts, total_pages
+            except Exception as err:
+                if attempt >= retries:
+                    raise
+                logging.warning("Window %s - %s failed (%s), retrying", 
+                                window_from.date(), window_to.date(), err)
+
+    def _get_receipt_export(self, export_type: str, receipt_id: str, stream: bool = False):
+        """ Requests the `export_type` (html or pdf) export of a receipt
+
+        Args:
+            export_type (str): either `html` or `pdf`
+            receipt_id (str): receipt id to get data
+            stream (bool, optional): do not read the response body yet. Defaults to False
+
+        Returns:
+            requests.Response: export response
+        """
+        # Headers are copied so that concurrent calls from get_receipts() 
+        # do not step on each other, cookies are added by _get()
+        headers = dict(self.headers)
+        headers.update(HEADERS_EXPORT)
+
+        # Build url to search on that given period
+        request_url = self.url_export_data + "%s?receiptId=%s" % (export_type, receipt_id)
+        logging.debug("Export url: %s", request_url)
+
+        # Check if parameters are indeed needed
+        return self._get(request_url, headers, params=PARAMS_RECEIPTS, stream=stream)
+
+    def _get_receipt_pages_parallel(self, request_url: str, pages: range, headers: dict, params: dict, 
+                                    result_dict: dict, response_list: list, 
+                                    max_workers: int, page_retries: int) -> None:
+        """ Fetches and parses the given listing `pages` concurrently. Used as a helper 
+            function to the get_all_receipts() method
+
+            Every page is parsed into its own dictionary, which are then merged into 
+            `result_dict` in page order, to keep the same ordering as the serial path
+
+        Args:
+            request_url (str): listing url without the page parameter
+            pages (range): page numbers to fetch
+            headers (dict): listing request headers, see `_listing_headers()`
+            params (dict): request parameters
+            result_dict (dict): dictionary to update items into
+            response_list (list): list where responses are appended, in page order
+            max_workers (int): maximum number of threads to use
+            page_retries (int): number of retries for a failing page
+        """
+        self.transport.ensure_pool_size(max_workers)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    self._get_receipt_page, request_url, page, headers, params, page_retries
+                ) for page in pages
+            ]
+            for future in futures:
+                response, page_dict = future.result()
+                response_list.append(response)
+                result_dict.update(page_dict)
+
+    def _get_receipt_page(self, request_url: str, page: int, headers: dict, 
+                          params: dict, retries: int) -> tuple:
+        """ Requests and parses a single listing page, retrying only this page 
+            in case it fails
+
+        Args:
+            request_url (str): listing url without the page parameter
+            page (int): page number to fetch
+            headers (dict): request headers
+            params (dict): request parameters
+            retries (int): number of times to retry the page before raising
+
+        Returns:
+            tuple: response and dictionary with the page receipts
+        """
+        url = request_url + "&p=%s" % page
+        attempt = 0
+        while True:
+            try:
+                response = self._get(url, headers, params=params)
+                response.raise_for_status()
+                page_dict = {}
+                self._parse_receipt_data(response, page_dict)
+                return response, page_dict
+
+            except Exception as err:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                logging.warning("Page %s failed (%s), retry %s/%s", page, err, attempt, retries)
+
+    @staticmethod
+    def _get_csrf_token(text: str, pattern: str) -> str:
+        """ Searches the CSRF token on the login page
+
+        Args:
+            text (str): login page html
+            pattern (str): regex pattern matching the token
+
+        Returns:
+            str: CSRF token
+        """
+        csrf = re.search(pattern, text).group(0)
+        csrf = eval(csrf)
+        display_token = csrf[0:5] + "...."
+        logging.debug("Found CSR token: %s", display_token)
+
+        return csrf
+
+    @staticmethod
+    def _check_login(content: bytes, user_email: str) -> str:
+        """ Checks on the page returned after posting the credentials that we 
+            are logged in as `user_email`
+
+        Args:
+            content (bytes): response content after authenticating
+            user_email (str): email used to log in
+
+        Raises:
+            ExceptionMigrosApi: If account menu is not found or user is not logged in
+            ExceptionMigrosApi: If logged in email does not match `user_email`
+
+        Returns:
+            str: user real name
+        """
+        from bs4 import BeautifulSoup as bs
+
+        soup = bs(content, 'lxml')
+
+        # Check if we have logged in successfully
+        soup_item = soup.find("div", attrs={"class": "m-accountmenu"})
+
+        if not soup_item:
+            raise ExceptionMigrosApi(1)
+
+        # If the following attribute is true, then we are pretty much in
+        if soup_item.get('data-logged-in') != 'true':
+            raise ExceptionMigrosApi(1)
+
+        email_address = soup_item.find(
+            "span", attrs={"class": "m-accountmenuflyout__info-mail"}
+        ).text
+
+        # If email address not found
+        if email_address != user_email:
+            raise ExceptionMigrosApi(2)
+        
+        # Get user name
+        return soup_item.find(
+            "span", attrs={"class": "m-accountmenuflyout__info-title"}
+        ).text
+
+    @staticmethod
+    def _format_period(period_from: datetime, period_to: datetime) -> tuple:
+        """ Checks and formats search period according to payload needs
+
+        Args:
+            period_from (datetime): period from, to execute search
+            period_to (datetime): period to, to execute search
+
+        Raises:
+            ExceptionMigrosApi: if `period_from` or `period_to` are not datetime objects
+            ExceptionMigrosApi: if `period_from` > `period_to`
+
+        Returns:
+            tuple: formatted `period_from` and `period_to`
+        """
+        # Check that all dates provided are correctly formatted
+        for date in (period_from, period_to): 
+            if not isinstance(date, datetime): 
+                raise ExceptionMigrosApi(4)
+
+        if period_from > period_to:
+            raise ExceptionMigrosApi(5)
+
+        return (
+            datetime.strftime(period_from, "%Y-%m-%-d"), 
+            datetime.strftime(period_to, "%Y-%m-%-d")
+        )
+
+    @staticmethod
+    def _parse_receipt_data(response, result_dict: dict) -> int:
         """ Parses response data to a dictionary. Used as a helper function to 
             the get_all_receipts() method
 
+            Instead of building a BeautifulSoup tree and searching it once per row, the lxml
+            tree is walked a single time in document order. Every checkbox opens a row that 
+            then takes the next `ui-js-toggle-modal` anchor and the three `td` after it, 
+            which is what `find_next()` did, so results are the same as
+            `_parse_receipt_data_soup()`
+
         Args:
-            response (bytes): requests response
+            response (bytes): requests response, or its raw content
             result_dict (dict): dictionary to update items into
 
         Raises:
@@ -340,9 +1142,147 @@ class MigrosApi:
         Returns:
             int: total number of pages of items from requested time period
         """
+        try: 
+            started = time.perf_counter()
+            content = getattr(response, 'content', response)
+            root = MigrosApi._parse_html(content)
+
+            pages = []
+            rows = []
+
+            # Rows waiting for the anchor, then for store name, cost and points cells
+            waiting = [[], [], [], []]
+
+            if root is not None:
+                for element in root.iter():
+                    tag = element.tag
+                    if tag == 'td':
+                        # Fill from the last field backwards, a cell only fills one field per row
+                        for row in waiting[3]:
+                            row[4] = element
+                        for row in waiting[2]:
+                            row[3] = element
+                        for row in waiting[1]:
+                            row[2] = element
+                        waiting[1:] = [[], waiting[1], waiting[2]]
+
+                    elif tag == 'a':
+                        if element.get('aria-label') == 'Seite':
+                            page_value = element.get('data-value')
+                            if page_value.isnumeric():
+                                pages.append(int(page_value))
+
+                        if waiting[0] and 'ui-js-toggle-modal' in (element.get('class') or '').split():
+                            for row in waiting[0]:
+                                row[1] = element
+                            waiting[1].extend(waiting[0])
+                            waiting[0] = []
+
+                    elif tag == 'input' and element.get('type') == 'checkbox':
+                        # Don't take first checkbox item to select all tick boxes
+                        download_id = element.get('value')
+                        if 'all' not in download_id:
+                            row = [download_id, None, None, None, None]
+                            rows.append(row)
+                            waiting[0].append(row)
+
+            if any(waiting):
+                raise ValueError("Receipt row without pdf link, store, cost or points")
+
+            total_pages = 1
+            if pages:
+                # Gets total number of pages from query
+                total_pages = max(pages)
+
+            for download_id, pdf_ref, store_name, cost, points in rows:
+                recepit_id = pdf_ref.get('href').split("receiptId=")[-1]
+
+                result_dict[download_id] = {
+                    'pdf_ref': pdf_ref.get('href'),
+                    'receipt_id': recepit_id,
+                    'date': MigrosApi._element_text(pdf_ref).strip(),
+                    'store_name': MigrosApi._element_text(store_name),
+                    'cost': MigrosApi._element_text(cost),
+                    'cumulus_points': MigrosApi._element_text(points)
+                }
+
+            if metrics.HOOK is not None:
+                metrics.HOOK.on_parse('listing', time.perf_counter() - started, len(rows))
+
+            return total_pages
+
+        except Exception as err:
+            error_line = sys.exc_info()[-1].tb_lineno
+            raise Exception("Unhandled exception error: %s, line: %s" % (err, error_line))
+
+    @staticmethod
+    def _parse_html(content: bytes):
+        """ Parses html with lxml, choosing the encoding the same way BeautifulSoup does 
+            (declared encoding first, then detected, then utf-8)
+
+        Args:
+            content (bytes): html content
+
+        Returns:
+            lxml.etree._Element: document root, None for empty documents
+        """
+        from bs4.dammit import EncodingDetector
+        from lxml import etree
+
+        if isinstance(content, str):
+            return etree.fromstring(content, etree.HTMLParser()) if content else None
+
+        for encoding in EncodingDetector(content, is_html=True).encodings:
+            try:
+                return etree.fromstring(content, etree.HTMLParser(encoding=encoding, recover=True))
+            except (UnicodeDecodeError, LookupError, etree.ParserError):
+                continue
+
+        return None
+
+    @staticmethod
+    def _element_text(element) -> str:
+        """ Text of an lxml element, like BeautifulSoup `.text` it leaves out comments 
+            and the content of script, style and template tags
+
+        Args:
+            element (lxml.etree._Element): element to get text from
+
+        Returns:
+            str: element text
+        """
+        if not len(element):
+            return element.text or ''
+
+        parts = [element.text or '']
+        for child in element:
+            if isinstance(child.tag, str) and child.tag not in ('script', 'style', 'template'):
+                parts.append(MigrosApi._element_text(child))
+            parts.append(child.tail or '')
+
+        return ''.join(parts)
+
+    @staticmethod
+    def _parse_receipt_data_soup(response, result_dict: dict) -> int:
+        """ Reference BeautifulSoup implementation of `_parse_receipt_data()`, 
+            kept to check and benchmark the faster parser against it
+
+        Args:
+            response (bytes): requests response, or its raw content
+            result_dict (dict): dictionary to update items into
+
+        Raises:
+            Exception: For unhandled exceptions
+
+        Returns:
+            int: total number of pages of items from requested time period
+        """
+        from bs4 import BeautifulSoup as bs
+
         try: 
             # Get total number of pages
-            soup = bs(response.content, 'lxml')
+            content = getattr(response, 'content', response)
+            soup = bs(content, 'lxml')
 
             pages = []
             for item in soup.find_all('a', attrs={"aria-label": "Seite"}):
@@ -354,7 +1294,7 @@ class MigrosApi:
             total_pages = 1
             if pages:
                 # Gets total number of pages from query
-                total_pages = np.max(pages)
+                total_pages = max(pages)
 
             for item in soup.find_all('input', attrs={'type': 'checkbox'}): 
                 # Don't take first checkbox item to select all tick boxes
@@ -370,6 +1310,7 @@ class MigrosApi:
                     result_dict[download_id] = {
                         'pdf_ref': pdf_ref.get('href'),
                         'receipt_id': recepit_id,
+                        'date': pdf_ref.text.strip(),
                         'store_name': store_name.text,
                         'cost': cost.text,
                         'cumulus_points': points.text
@@ -393,4 +1334,5 @@ if __name__ == "__main__":
     if not USERNAME:
         USERNAME = input("GIVE ME YOUR USERNAME: ")
 
+    configure_logging()
     MIGROS_API = MigrosApi(username=USERNAME, password=PWD)
\ No newline at end of file
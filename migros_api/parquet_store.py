@@ -0,0 +1,162 @@
+"""parquet_store class"""
+
+from __future__ import annotations
+
+import logging
+import os
+import uuid
+from typing import TYPE_CHECKING, List, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from .exceptions_migros import ExceptionMigrosApi
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class ReceiptParquetStore:
+    """
+    Receipt history stored as two parquet datasets, partitioned by year and month,
+
+        <path>/line_items/year=2021/month=5/part-<uuid>-0.parquet
+        <path>/receipts/year=2021/month=5/part-<uuid>-0.parquet
+
+    `line_items` holds frames from `build_receipt_frame()` and `receipts` holds the listing
+    from `build_listing_frame()`. Partitions are taken from the `date` column, rows without
+    a date end up in the default (null) partition. Every `append()` writes new files,
+    so existing data is never rewritten
+    """
+
+    def __init__(self, path: str):
+        if pa is None:
+            raise ExceptionMigrosApi(9)
+
+        self.path = path
+        self.line_items_path = os.path.join(path, "line_items")
+        self.receipts_path = os.path.join(path, "receipts")
+        self._partitioning = ds.partitioning(
+            pa.schema([('year', pa.int16()), ('month', pa.int8())]), flavor='hive'
+        )
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    def append(self, df_items: pd.DataFrame, df_receipts: pd.DataFrame) -> int:
+        """ Adds new receipts to the store. Receipts whose `receipt_id` is already stored
+            are skipped, so the same period can be appended more than once
+
+        Args:
+            df_items (pd.DataFrame): line items, as returned by `build_receipt_frame()`
+            df_receipts (pd.DataFrame): receipts information, as returned by `build_listing_frame()`
+
+        Returns:
+            int: number of new receipts written
+        """
+        df_receipts = df_receipts.reset_index()
+        stored_ids = self.stored_receipt_ids()
+        if stored_ids:
+            df_receipts = df_receipts[~df_receipts['receipt_id'].isin(stored_ids)]
+            df_items = df_items[~df_items['receipt_id'].isin(stored_ids)]
+
+        if df_receipts.empty:
+            logging.debug("No new receipts to store")
+            return 0
+
+        # Line items get their date from the receipt they belong to
+        if 'date' not in df_items and 'date' in df_receipts:
+            dates = df_receipts.drop_duplicates('receipt_id').set_index('receipt_id')['date']
+            df_items = df_items.assign(date=df_items['receipt_id'].map(dates))
+
+        basename = "part-%s-{i}.parquet" % uuid.uuid4().hex
+        self._write(df_receipts, self.receipts_path, basename)
+        if not df_items.empty:
+            self._write(df_items, self.line_items_path, basename)
+
+        logging.debug("Stored %s new receipts", len(df_receipts))
+
+        return len(df_receipts)
+
+    def read_line_items(self, columns: List[str] = None, months: List[Tuple[int, int]] = None,
+                        as_pandas: bool = True):
+        """ Loads line items, only reading the given columns and months. Files are memory mapped
+
+        Args:
+            columns (List[str], optional): columns to load. Defaults to all
+            months (List[Tuple[int, int]], optional): (year, month) partitions to load.
+                Defaults to all
+            as_pandas (bool, optional): return a data frame instead of a `pyarrow.Table`.
+                Defaults to True
+
+        Returns:
+            pd.DataFrame: line items
+        """
+        return self._read(self.line_items_path, columns, months, as_pandas)
+
+    def read_receipts(self, columns: List[str] = None, months: List[Tuple[int, int]] = None,
+                      as_pandas: bool = True):
+        """ Loads receipts information, only reading the given columns and months.
+            See `read_line_items()`
+        """
+        return self._read(self.receipts_path, columns, months, as_pandas)
+
+    def stored_receipt_ids(self) -> set:
+        """ Receipt ids already in the store, reading only that column
+
+        Returns:
+            set: stored receipt ids
+        """
+        if not os.path.exists(self.receipts_path):
+            return set()
+        table = self._read(self.receipts_path, ['receipt_id'], None, as_pandas=False)
+        return set(table.column('receipt_id').to_pylist())
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    def _write(self, df_data: pd.DataFrame, base_dir: str, basename: str) -> None:
+        """ Writes `df_data` into `base_dir` partitioned by year and month of its `date` """
+        import pandas as pd
+
+        if 'date' in df_data:
+            dates = pd.to_datetime(df_data['date'])
+            if dates.isna().any():
+                logging.warning("%s rows without date, stored outside of the month partitions",
+                                dates.isna().sum())
+            df_data = df_data.assign(
+                year=dates.dt.year.astype('Int16'), month=dates.dt.month.astype('Int8')
+            )
+        else:
+            logging.warning("No date column, rows are stored outside of the month partitions")
+            df_data = df_data.assign(
+                year=pd.array([None] * len(df_data), dtype='Int16'),
+                month=pd.array([None] * len(df_data), dtype='Int8')
+            )
+
+        ds.write_dataset(
+            pa.Table.from_pandas(df_data, preserve_index=False),
+            base_dir,
+            format='parquet',
+            partitioning=self._partitioning,
+            basename_template=basename,
+            existing_data_behavior='overwrite_or_ignore'
+        )
+
+    def _read(self, base_dir: str, columns: List[str], months: List[Tuple[int, int]],
+              as_pandas: bool):
+        """ Reads a dataset with column and partition pruning """
+        filters = None
+        if months:
+            filters = [[('year', '=', year), ('month', '=', month)] for year, month in months]
+
+        table = pq.read_table(
+            base_dir, columns=columns, filters=filters,
+            partitioning=self._partitioning, memory_map=True
+        )
+
+        return table.to_pandas() if as_pandas else table
@@ -0,0 +1,290 @@
+"""pdf_archive class"""
+
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+from typing import Iterable, List
+
+from .receipt_item import ReceiptItem
+
+
+class PdfArchive:
+    """
+    Receipt pdfs stored once per content in a few large segment files instead of one file
+    per receipt,
+
+        <path>/index.sqlite           receipt_id -> sha256 -> (segment, offset, length)
+        <path>/segment-000001.pack    pdf bytes appended one after the other
+
+    Pdfs added with `add()` are buffered and written in batches of `batch_size`: the batch is
+    appended to the current segment and synced once, then indexed in one transaction, so an
+    interrupted batch at most leaves unindexed bytes behind, which are cut off the next time
+    the archive is opened. Identical pdfs are only stored once, and receipts already archived
+    are skipped. Reads go through read-only memory maps
+
+    Args:
+        path (str): archive directory
+        batch_size (int, optional): pdfs buffered before writing. Defaults to 100
+        max_segment_bytes (int, optional): size after which a new segment is started.
+            Defaults to 256 MiB
+    """
+
+    def __init__(self, path: str, batch_size: int = 100, max_segment_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._maps = {}
+        self._connection = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS receipts (
+                receipt_id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL REFERENCES blobs (sha256)
+            );
+            """
+        )
+        self._connection.commit()
+        self._truncate_segments()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        """ Number of archived receipts, pending ones included """
+        with self._lock:
+            count = self._connection.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+            return count + len(self._pending)
+
+    def __contains__(self, receipt_id: str) -> bool:
+        with self._lock:
+            if receipt_id in self._pending:
+                return True
+            row = self._connection.execute(
+                "SELECT 1 FROM receipts WHERE receipt_id = ?", (receipt_id,)
+            ).fetchone()
+        return row is not None
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    def add(self, receipt_id: str, pdf: bytes) -> bool:
+        """ Queues a pdf for archiving, writing the batch once it is full
+
+        Args:
+            receipt_id (str): receipt id
+            pdf (bytes): pdf export
+
+        Returns:
+            bool: False if the receipt was already archived
+        """
+        with self._lock:
+            if receipt_id in self:
+                return False
+
+            self._pending[receipt_id] = pdf
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+        return True
+
+    def add_receipts(self, receipts: Iterable[ReceiptItem]) -> int:
+        """ Archives the pdf of every receipt not archived yet. Lazily requested pdfs
+            are downloaded here
+
+        Args:
+            receipts (Iterable[ReceiptItem]): receipts to archive
+
+        Returns:
+            int: number of newly archived receipts
+        """
+        added = 0
+        for receipt in receipts:
+            if receipt.receipt_id in self:
+                continue
+            added += self.add(receipt.receipt_id, receipt.fetch_pdf())
+
+        self.flush()
+        return added
+
+    def missing(self, receipt_ids: Iterable[str]) -> List[str]:
+        """ Receipt ids not archived yet, e.g. to only download those pdfs
+
+        Args:
+            receipt_ids (Iterable[str]): receipt ids to check
+
+        Returns:
+            List[str]: receipt ids without archived pdf, in the same order
+        """
+        return [x for x in receipt_ids if x.split("?")[0] not in self]
+
+    def get(self, receipt_id: str) -> bytes:
+        """ Reads an archived pdf
+
+        Args:
+            receipt_id (str): receipt id
+
+        Returns:
+            bytes: pdf export, None if the receipt is not archived
+        """
+        with self._lock:
+            if receipt_id in self._pending:
+                return self._pending[receipt_id]
+
+            row = self._connection.execute(
+                "SELECT b.segment, b.offset, b.length FROM receipts r JOIN blobs b USING (sha256) "
+                "WHERE r.receipt_id = ?", (receipt_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            segment, offset, length = row
+            segment_map = self._get_map(segment, offset + length)
+            return segment_map[offset:offset + length]
+
+    def to_pdf(self, receipt_id: str, path: str) -> None:
+        """ Writes an archived pdf to `path`/`receipt_id`.pdf
+
+        Args:
+            receipt_id (str): receipt id
+            path (str): directory where to save the pdf
+        """
+        pdf = self.get(receipt_id)
+        if pdf is None:
+            raise KeyError(receipt_id)
+        with open(os.path.join(path, receipt_id + ".pdf"), 'wb') as file:
+            file.write(pdf)
+
+    def flush(self) -> None:
+        """ Writes the pending pdfs to the current segment and indexes them """
+        with self._lock:
+            if not self._pending:
+                return
+
+            blobs, receipts, batch = {}, [], []
+            for receipt_id, pdf in self._pending.items():
+                sha256 = hashlib.sha256(pdf).hexdigest()
+                receipts.append((receipt_id, sha256))
+                if sha256 in blobs:
+                    continue
+
+                row = self._connection.execute(
+                    "SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)
+                ).fetchone()
+                if row is None:
+                    blobs[sha256] = len(pdf)
+                    batch.append(pdf)
+
+            segment, segment_path, offset = self._current_segment(sum(blobs.values()))
+            for sha256, length in blobs.items():
+                blobs[sha256] = (sha256, segment, offset, length)
+                offset += length
+
+            if batch:
+                with open(segment_path, 'ab') as file:
+                    file.write(b''.join(batch))
+                    file.flush()
+                    os.fsync(file.fileno())
+
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)", list(blobs.values())
+                )
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO receipts VALUES (?, ?)", receipts
+                )
+
+            logging.debug("Archived %s pdfs, %s new", len(receipts), len(batch))
+            self._pending = {}
+
+    def stats(self) -> dict:
+        """ Archive counters
+
+        Returns:
+            dict: number of receipts, unique pdfs, segments and stored bytes
+        """
+        self.flush()
+        with self._lock:
+            receipts = self._connection.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+            blobs, size, segments = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0), COUNT(DISTINCT segment) FROM blobs"
+            ).fetchone()
+
+        return {'receipts': receipts, 'pdfs': blobs, 'segments': segments, 'bytes': size}
+
+    def close(self) -> None:
+        """ Writes pending pdfs and closes the index and memory maps """
+        with self._lock:
+            self.flush()
+            for segment_map, file in self._maps.values():
+                segment_map.close()
+                file.close()
+            self._maps = {}
+            self._connection.close()
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, "segment-%06d.pack" % segment)
+
+    def _current_segment(self, batch_size: int) -> tuple:
+        """ Last segment and its size, or a new one if the batch does not fit anymore """
+        segment = self._connection.execute("SELECT MAX(segment) FROM blobs").fetchone()[0] or 1
+        segment_path = self._segment_path(segment)
+        size = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+        if size and size + batch_size > self.max_segment_bytes:
+            segment += 1
+            segment_path = self._segment_path(segment)
+            # Bytes of a batch that failed after the rollover may already be there
+            size = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+        return segment, segment_path, size
+
+    def _truncate_segments(self) -> None:
+        """ Cuts every segment back to the end of its last indexed pdf, dropping the bytes
+            of batches interrupted before they were indexed
+        """
+        ends = dict(self._connection.execute(
+            "SELECT segment, MAX(offset + length) FROM blobs GROUP BY segment"
+        ).fetchall())
+
+        for file_name in os.listdir(self.path):
+            if not (file_name.startswith("segment-") and file_name.endswith(".pack")):
+                continue
+            segment = int(file_name[len("segment-"):-len(".pack")])
+            segment_path = os.path.join(self.path, file_name)
+            end = ends.get(segment, 0)
+            if os.path.getsize(segment_path) > end:
+                logging.warning("Dropping %s unindexed bytes from %s",
+                                os.path.getsize(segment_path) - end, file_name)
+                os.truncate(segment_path, end)
+
+    def _get_map(self, segment: int, min_size: int) -> mmap.mmap:
+        """ Memory map of a segment, mapped again if it grew past the mapped size """
+        if segment in self._maps:
+            segment_map, file = self._maps[segment]
+            if len(segment_map) >= min_size:
+                return segment_map
+            segment_map.close()
+            file.close()
+
+        file = open(self._segment_path(segment), 'rb')
+        segment_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[segment] = (segment_map, file)
+        return segment_map
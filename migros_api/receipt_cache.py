@@ -0,0 +1,270 @@
+"""receipt_cache class"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+# Access times of this many hits are written at once
+ACCESS_BATCH = 100
+
+
+class ReceiptCache:
+    """
+    Persistent receipt cache stored in a single SQLite file.
+
+    A receipt does not change once it has been issued, so the raw html export, the pdf
+    and the parsed line items are stored by `receipt_id` and reused by `MigrosApi.get_receipt()`.
+    Entries older than `max_age` seconds are dropped, and if the cache grows over `max_bytes`
+    the least recently used receipts are evicted first.
+
+    Line items are stored as json, column by column with their dtypes. Hits do not write to
+    the file, their access times are kept in memory and written in batches (and before 
+    evicting or closing), and the cache size is kept as a running total of this connection
+    """
+
+    def __init__(self, path: str = "./receipts_cache.sqlite", max_bytes: int = None,
+                 max_age: float = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._accessed = {}
+
+        # Same connection is used from the get_receipts() worker threads
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS receipts (
+                receipt_id TEXT PRIMARY KEY,
+                html BLOB NOT NULL,
+                pdf BLOB,
+                rows BLOB,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS receipts_accessed ON receipts (accessed)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS receipts_created ON receipts (created)"
+        )
+        self._connection.commit()
+        self._total_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM receipts"
+        ).fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+
+    def __contains__(self, receipt_id: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM receipts WHERE receipt_id = ?", (receipt_id,)
+            ).fetchone()
+        return row is not None
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    def get(self, receipt_id: str) -> dict:
+        """ Looks up a receipt in the cache
+
+        Args:
+            receipt_id (str): receipt id to look for
+
+        Returns:
+            dict: with `html`, `pdf` and `rows` keys, or None if the receipt is not cached
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT html, pdf, rows, size, created FROM receipts WHERE receipt_id = ?",
+                (receipt_id,)
+            ).fetchone()
+
+            if row is not None and self.max_age is not None and now - row[4] > self.max_age:
+                self._connection.execute("DELETE FROM receipts WHERE receipt_id = ?", (receipt_id,))
+                self._connection.commit()
+                self._accessed.pop(receipt_id, None)
+                self._total_bytes -= row[3]
+                self.evictions += 1
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._accessed[receipt_id] = now
+            if len(self._accessed) >= ACCESS_BATCH:
+                self._write_accessed()
+                self._connection.commit()
+
+        html, pdf, rows, _, _ = row
+        return {
+            'html': html,
+            'pdf': pdf,
+            'rows': self._rows_from_json(rows) if rows is not None else None
+        }
+
+    def put(self, receipt_id: str, html: bytes, pdf: bytes = None, rows=None) -> None:
+        """ Stores a receipt in the cache, replacing any previous entry
+
+        Args:
+            receipt_id (str): receipt id
+            html (bytes): raw html export
+            pdf (bytes, optional): pdf export. Defaults to None
+            rows (pd.DataFrame, optional): parsed line items. Defaults to None
+        """
+        rows = self._rows_to_json(rows) if rows is not None else None
+        size = len(html) + len(pdf or b'') + len(rows or b'')
+        now = time.time()
+
+        with self._lock:
+            previous = self._connection.execute(
+                "SELECT size FROM receipts WHERE receipt_id = ?", (receipt_id,)
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO receipts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (receipt_id, html, pdf, rows, size, now, now)
+            )
+            self._connection.commit()
+            self._accessed.pop(receipt_id, None)
+            self._total_bytes += size - (previous[0] if previous else 0)
+            over_size = self.max_bytes is not None and self._total_bytes > self.max_bytes
+
+        if over_size or self.max_age is not None:
+            self.evict()
+
+    def evict(self) -> int:
+        """ Removes expired receipts and, if needed, least recently used ones until
+            the cache is below `max_bytes`
+
+        Returns:
+            int: number of removed receipts
+        """
+        removed = 0
+        with self._lock:
+            if self.max_age is not None:
+                expired = self._connection.execute(
+                    "DELETE FROM receipts WHERE created < ? RETURNING receipt_id, size", 
+                    (time.time() - self.max_age,)
+                ).fetchall()
+                for receipt_id, size in expired:
+                    self._accessed.pop(receipt_id, None)
+                    self._total_bytes -= size
+                removed += len(expired)
+
+            if self.max_bytes is not None and self._total_bytes > self.max_bytes:
+                # Least recently used order needs the access times of the latest hits
+                self._write_accessed()
+                to_delete = []
+                for receipt_id, size in self._connection.execute(
+                    "SELECT receipt_id, size FROM receipts ORDER BY accessed"
+                ):
+                    if self._total_bytes <= self.max_bytes:
+                        break
+                    to_delete.append((receipt_id,))
+                    self._total_bytes -= size
+                self._connection.executemany(
+                    "DELETE FROM receipts WHERE receipt_id = ?", to_delete
+                )
+                removed += len(to_delete)
+
+            self._connection.commit()
+            self.evictions += removed
+
+        if removed:
+            logging.debug("Evicted %s receipts from cache", removed)
+
+        return removed
+
+    def stats(self) -> dict:
+        """ Cache counters
+
+        Returns:
+            dict: hits, misses, evictions, number of receipts and size in bytes
+        """
+        with self._lock:
+            count = self._connection.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+            size = self._total_bytes
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'receipts': count,
+            'bytes': size
+        }
+
+    def clear(self) -> None:
+        """ Removes every receipt from the cache """
+        with self._lock:
+            self._connection.execute("DELETE FROM receipts")
+            self._connection.commit()
+            self._accessed = {}
+            self._total_bytes = 0
+
+    def flush(self) -> None:
+        """ Writes the access times of the latest hits to disk """
+        with self._lock:
+            self._write_accessed()
+            self._connection.commit()
+
+    def close(self) -> None:
+        """ Writes the pending access times and closes the underlying SQLite connection """
+        with self._lock:
+            self._write_accessed()
+            self._connection.commit()
+            self._connection.close()
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    def _write_accessed(self) -> None:
+        """ Writes the access times kept in memory, without committing. Expects the lock held """
+        if self._accessed:
+            self._connection.executemany(
+                "UPDATE receipts SET accessed = ? WHERE receipt_id = ?",
+                [(accessed, receipt_id) for receipt_id, accessed in self._accessed.items()]
+            )
+            self._accessed = {}
+
+    @staticmethod
+    def _rows_to_json(rows) -> bytes:
+        """ Line items as json, column by column with their dtypes, so they come back the same """
+        return json.dumps({
+            'columns': [str(column) for column in rows.columns],
+            'dtypes': [str(dtype) for dtype in rows.dtypes],
+            'data': [rows[column].tolist() for column in rows.columns]
+        }).encode('utf-8')
+
+    @staticmethod
+    def _rows_from_json(rows: bytes):
+        """ Line items stored by `_rows_to_json()`. None for entries that cannot be read, e.g.
+            written by an older version, so that their html is parsed again
+        """
+        import pandas as pd
+
+        try:
+            data = json.loads(rows)
+            return pd.DataFrame({
+                column: pd.Series(values, dtype=dtype)
+                for column, dtype, values in zip(data['columns'], data['dtypes'], data['data'])
+            })
+        except (ValueError, KeyError, TypeError, UnicodeDecodeError):
+            logging.debug("Could not read cached rows, parsing the receipt again")
+            return None
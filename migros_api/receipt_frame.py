@@ -0,0 +1,127 @@
+"""receipt_frame functions
+
+Builds single, long format data frames out of many receipts, with typed columns
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Dict, Iterable
+from .receipt_item import ReceiptItem
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+LINE_ITEM_NUMERIC_COLUMNS = ['Menge', 'Preis', 'Gespart', 'Total']
+
+
+def build_listing_frame(receipts_info: Dict[str, dict]) -> pd.DataFrame:
+    """ Converts the `get_all_receipts()` dictionary into a data frame, with `cost` as float,
+        `cumulus_points` as integer, `store_name` as category and `date` (`DD.MM.YYYY` in
+        the listing) as datetime
+
+    Args:
+        receipts_info (Dict[str, dict]): receipts information, as returned by `get_all_receipts()`
+
+    Returns:
+        pd.DataFrame: one row per receipt, indexed by download id
+    """
+    import pandas as pd
+
+    df_listing = pd.DataFrame.from_dict(receipts_info, orient='index')
+    df_listing.index.name = 'download_id'
+
+    if df_listing.empty:
+        return df_listing
+
+    df_listing['cost'] = _to_number(df_listing['cost'])
+    df_listing['cumulus_points'] = _to_number(df_listing['cumulus_points']).round().astype('Int64')
+    df_listing['store_name'] = df_listing['store_name'].str.strip().astype('category')
+    if 'date' in df_listing:
+        df_listing['date'] = _to_date(df_listing['date'])
+
+    return df_listing
+
+
+def build_receipt_frame(receipts: Iterable[ReceiptItem],
+                        receipts_info: Dict[str, dict] = None) -> pd.DataFrame:
+    """ Concatenates the line items of many receipts into one long format data frame.
+
+        Line item amounts are converted to float in one go over the whole frame, and
+        repeated strings (`Artikelbezeichnung`, `store_name`, `receipt_id`) are stored as
+        categories. If `receipts_info` is given, `store_name` and `date` are added from
+        the listing
+
+    Args:
+        receipts (Iterable[ReceiptItem]): receipts to put together
+        receipts_info (Dict[str, dict], optional): receipts information, as returned by
+            `get_all_receipts()`. Defaults to None
+
+    Returns:
+        pd.DataFrame: one row per bought article
+    """
+    import pandas as pd
+
+    frames = []
+    for receipt in receipts:
+        df_receipt = receipt.get_data_frame()
+        if df_receipt is None:
+            logging.warning("Could not parse receipt %s, skipping it", receipt.receipt_id)
+            continue
+        df_receipt = df_receipt[['Artikelbezeichnung'] + LINE_ITEM_NUMERIC_COLUMNS]
+        df_receipt.insert(0, 'receipt_id', receipt.receipt_id)
+        frames.append(df_receipt)
+
+    if not frames:
+        return pd.DataFrame(columns=['receipt_id', 'Artikelbezeichnung'] + LINE_ITEM_NUMERIC_COLUMNS)
+
+    df_final = pd.concat(frames, ignore_index=True, sort=False)
+
+    for column in LINE_ITEM_NUMERIC_COLUMNS:
+        df_final[column] = _to_number(df_final[column])
+    df_final['Artikelbezeichnung'] = df_final['Artikelbezeichnung'].str.strip().astype('category')
+
+    if receipts_info:
+        df_listing = build_listing_frame(receipts_info)
+        df_listing = df_listing.drop_duplicates('receipt_id').set_index('receipt_id')
+        metadata = [x for x in ('store_name', 'date') if x in df_listing]
+        df_final = df_final.join(df_listing[metadata], on='receipt_id')
+
+    df_final['receipt_id'] = df_final['receipt_id'].astype('category')
+
+    return df_final
+
+
+def _to_number(series: pd.Series) -> pd.Series:
+    """ Vectorized conversion of amounts such as `CHF 1'234.50`, `-0.40` or `1` to float.
+        Values that cannot be converted become NaN
+    """
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+
+    cleaned = (
+        series.astype('string')
+        .str.replace(',', '.', regex=False)
+        .str.replace(r"[^0-9.\-]", "", regex=True)
+    )
+    return pd.to_numeric(cleaned, errors='coerce').astype('float64')
+
+
+def _to_date(series: pd.Series) -> pd.Series:
+    """ Listing dates such as `31.01.2021` to datetime, other day first formats are parsed
+        one by one. Values that cannot be converted become NaT
+    """
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    text = series.astype('string').str.strip()
+    dates = pd.to_datetime(text, format="%d.%m.%Y", errors='coerce')
+    missing = dates.isna() & text.notna()
+    if missing.any():
+        dates[missing] = pd.to_datetime(text[missing], dayfirst=True, errors='coerce', format='mixed')
+    return dates
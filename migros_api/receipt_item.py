@@ -1,21 +1,73 @@
 
+from __future__ import annotations
+
 import os
 import logging
-from bs4 import BeautifulSoup as bs
-import pandas as pd
+import time
 import sys
+from typing import TYPE_CHECKING
+from . import metrics
 from .exceptions_migros import ExceptionMigrosApi
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+def parse_receipt_rows(receipt_id: str, content: bytes) -> pd.DataFrame:
+    """ Parses a receipt html export into its rows. Module level, so that it can run in 
+        a process pool and only send the rows back
+
+    Args:
+        receipt_id (str): receipt id, for logging
+        content (bytes): receipt html export
+
+    Returns:
+        pd.DataFrame: receipt rows, None if it could not be parsed
+    """
+    return ReceiptItem(receipt_id, content).get_data_frame()
+
 
 class ReceiptItem:
     """
     Receipt items to be parsed as data frame or as bytes
+
+    The pdf can either be given as bytes with `pdf`, or as a `pdf_loader` callable returning 
+    a streamed response, in which case it is only downloaded on `to_pdf()`.
+    Already parsed `rows` (e.g. coming from a cache) skip parsing the html altogether.
+
+    Only the id and the raw bytes are kept. The html is parsed on the first `get_data_frame()`
+    and the rows are kept instead of the tree, and `release()` drops the raw buffers once
+    the rows are all that is needed, so that many receipts can be held in memory
     """
-    def __init__(self, receipt_id: str, soup: bytes, pdf=None):
+    __slots__ = ('_receipt_id', '_raw', '_soup', '_pdf', '_pdf_loader', '_rows')
+
+    def __init__(self, receipt_id: str, soup: bytes, pdf=None, pdf_loader=None, rows=None):
         self._receipt_id = receipt_id
-        self._soup = bs(soup, 'lxml')
+        self._raw = soup
+        self._soup = None
         self._pdf = pdf
-        self._index_to_ignore = set()
+        self._pdf_loader = pdf_loader
+        self._rows = rows
+
+    @property
+    def receipt_id(self) -> str:
+        return self._receipt_id
+
+    @property
+    def parsed(self) -> bool:
+        """ Whether the rows are already available, without parsing """
+        return self._rows is not None
+
+    def set_rows(self, rows: pd.DataFrame) -> None:
+        """ Sets rows parsed elsewhere, e.g. by `parse_receipt_rows()` in another process
+
+        Args:
+            rows (pd.DataFrame): parsed receipt rows
+        """
+        self._rows = rows
 
     def get_raw_data(self) -> bytes:
         """ Get raw soup in bytes of the receipt item that was queried
@@ -23,55 +75,147 @@ class ReceiptItem:
         Returns:
             bytes: Beautifoulsoup object
         """
-        return self._soup
+        return self._get_soup()
+
+    def get_raw_html(self) -> bytes:
+        """ Get the receipt html export as it was received
+
+        Returns:
+            bytes: html export
+        """
+        return self._raw
+
+    def get_pdf(self) -> bytes:
+        """ Get the receipt pdf bytes, if these were requested eagerly
+
+        Returns:
+            bytes: pdf export or None
+        """
+        return self._pdf
+
+    def fetch_pdf(self) -> bytes:
+        """ Get the receipt pdf bytes, downloading them now if the pdf was requested lazily.
+            Downloaded bytes are not kept on the item
+
+        Returns:
+            bytes: pdf export
+        """
+        if self._pdf:
+            return self._pdf
+        if not self._pdf_loader:
+            raise ExceptionMigrosApi(6)
+
+        with self._pdf_loader() as response:
+            response.raise_for_status()
+            return b''.join(response.iter_content(chunk_size=PDF_CHUNK_SIZE))
 
     def get_data_frame(self) -> pd.DataFrame:
-        """ Parses all purchase data into a pandas data frame
+        """ Parses all purchase data into a pandas data frame. Parsing only happens
+            on the first call, later calls return a copy of the same rows
 
         Returns:
             pd.DataFrame: All `receipt_id` purchase data as a data frame
         """
+        if self._rows is None:
+            self._rows = self._parse_receipt_data()
+
+        return self._rows.copy() if self._rows is not None else None
+
+    def release(self, pdf: bool = False) -> None:
+        """ Parses the rows if that has not happened yet, then drops the html tree and 
+            the raw html. Afterwards only `get_data_frame()` (and `to_pdf()`) are available
+
+        Args:
+            pdf (bool, optional): also drop the pdf bytes. Defaults to False
+        """
+        if self._rows is None and self._raw is not None:
+            self._rows = self._parse_receipt_data()
 
-        return self._parse_receipt_data()
+        self._soup = None
+        self._raw = None
+        if pdf:
+            self._pdf = None
     
     def to_pdf(self, path: str) -> None:
         """
-        Uses response that parses bytes to generate pdf
+        Uses response that parses bytes to generate pdf. If the pdf was requested lazily,
+        it is downloaded now and written to disk in chunks, without keeping it in memory
 
         Args: 
             path (str): path where to save pdf
         """
         try: 
+            file_name = self._receipt_id + ".pdf"
+            full_path = os.path.join(path, file_name)
+
             if self._pdf:
-                file_name = self._receipt_id + ".pdf"
-                full_path = os.path.join(path, file_name)
                 with open(full_path, 'wb') as file:
                     file.write(self._pdf)
-                logging.debug("Saved file: %s", file_name)
+            elif self._pdf_loader:
+                self._stream_pdf(full_path)
             else:
                 raise ExceptionMigrosApi(6)
 
+            logging.debug("Saved file: %s", file_name)
+
         except Exception as err:
             line_no = sys.exc_info()[-1].tb_lineno
             raise Exception("Unhandled exception, error: %s, line: %s" % (err, line_no))
 
+    def _get_soup(self, keep: bool = True):
+        """
+        Parses the raw html on first use, so that cached items never build the tree.
+        With `keep=False` the tree is returned without holding on to it
+        """
+        if self._soup is not None:
+            return self._soup
+        if self._raw is None:
+            raise ExceptionMigrosApi(10)
+
+        from bs4 import BeautifulSoup as bs
+
+        started = time.perf_counter()
+        soup = bs(self._raw, 'lxml')
+        if metrics.HOOK is not None:
+            metrics.HOOK.on_parse('receipt_soup', time.perf_counter() - started, None)
+
+        if keep:
+            self._soup = soup
+        return soup
+
+    def _stream_pdf(self, full_path: str) -> None:
+        """
+        Downloads the lazily requested pdf into `full_path` chunk by chunk. Data is first
+        written to a `.part` file, so an interrupted download does not leave a broken pdf
+        """
+        part_path = full_path + ".part"
+        with self._pdf_loader() as response:
+            response.raise_for_status()
+            with open(part_path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=PDF_CHUNK_SIZE):
+                    file.write(chunk)
+        os.replace(part_path, full_path)
+
     def _parse_receipt_data(self):
         """
         Parses bytes content into data frame from queried bytes receipt item
         """
         try: 
-            data_text = self._soup.find('div', attrs={'class': 'article pre'}).text
-            data_text.split("\n")
+            # The tree is only needed for the text, rows are kept instead
+            data_text = self._get_soup(keep=False).find('div', attrs={'class': 'article pre'}).text
+            started = time.perf_counter()
             
             for k, txt in enumerate(data_text.split("\n")):
                 if 'CHF' in txt:
-                    self._index_to_ignore = set()
                     df_result = self._receipt_data_parser_type_one(data_text)
                     break
                 else:
                     df_result = self._receipt_data_parser_type_two(data_text)
                     break
 
+            if metrics.HOOK is not None:
+                metrics.HOOK.on_parse('receipt_rows', time.perf_counter() - started, len(df_result))
+
             return df_result
 
         except Exception as err:
@@ -84,22 +228,69 @@ class ReceiptItem:
 
         Migros uses two types of receipts, depending on which type we are dealing with
         we use one of these two methods to parse byte data into data frame
+
+        Rows are classified in a single pass, looking ahead by index for the quantity and 
+        action lines. Data frames are only built once all rows are collected
         """
+        import pandas as pd
+
         new_text = []
         
-        for k, txt in enumerate(data_text.split("\n")):
+        for txt in data_text.split("\n"):
             if (txt != "") & ('CHF' not in txt):
                 temp_list = [x.strip() for x in txt.split("  ") if x!= ""]
                 if 'AKT' not in temp_list:
                     temp_list.insert(0, ' ')
                 new_text.append(temp_list)
-                
-        df_temp_data = pd.DataFrame(new_text)
-        
-        frame = []
-        for df_type in ['AKT', 'SEVERAL', '']:
-            df_bdf = self._build_data_frame(df_data=df_temp_data, df_type=df_type)
-            frame.append(df_bdf)
+
+        n_columns = max([len(row) for row in new_text], default=0)
+        if n_columns < 4:
+            raise ValueError("Receipt has no article rows")
+
+        akt_data = []
+        several_data = []
+        single_index = []
+        index_to_ignore = set()
+
+        for idx, row in enumerate(new_text):
+            # Rows with less than four columns are the name of an article bought 
+            # several times (or with an action), its quantity comes on the next line
+            if len(row) < 4:
+                new_index = idx + 1
+                index_to_ignore.add(new_index)
+
+                if row[0] == 'AKT':
+                    akt_index = idx + 2
+                    index_to_ignore.add(akt_index)
+                    # Aktien part
+                    akt_price = new_text[akt_index][2]
+                    akt_price = akt_price.replace("-", '')
+                    akt_price = float(akt_price) * -1
+                    data = akt_data
+                else:
+                    akt_price = 0
+                    data = several_data
+
+                menge, price = new_text[new_index][1].split("x")
+                total = new_text[new_index][2]
+                if "-" in total:
+                    total = total.replace("-", "")
+                    total = float(total) * -1
+                else:
+                    total = float(total)
+                menge = float(menge.strip())
+                price = float(price.strip())
+
+                data.append((row[1], menge, price, akt_price, total))
+
+            elif idx not in index_to_ignore:
+                single_index.append(idx)
+
+        frame = [
+            self._build_quantity_data_frame(akt_data),
+            self._build_quantity_data_frame(several_data),
+            self._build_single_data_frame(pd.DataFrame(new_text), single_index)
+        ]
         df_final = pd.concat(frame, sort=False)
         df_final = df_final.reset_index().drop(columns='index')
         
@@ -112,6 +303,8 @@ class ReceiptItem:
         Migros uses two types of receipts, depending on which type we are dealing with
         we use one of these two methods to parse byte data into data frame
         """
+        import pandas as pd
+
         # There are two types of receipts -> limmatfeld
 
         new_text = []
@@ -134,70 +327,29 @@ class ReceiptItem:
         
         return df_receipt
     
-    def _build_data_frame(self, df_data: pd.DataFrame, df_type: str):
+    def _build_quantity_data_frame(self, data: list) -> pd.DataFrame:
         """
-        Used by `_receipt_data_parser_type_one()` method
-        to build three different types of data frames
+        Used by `_receipt_data_parser_type_one()` method to build the data frame 
+        of articles with a quantity line, with or without action
         """
+        import pandas as pd
 
-        # Depending on the row type
-        if df_type == 'SEVERAL': 
-            temp_df = df_data[(df_data[3].isna()) & (df_data[0] != 'AKT')]
-            index_quantity = temp_df.index
-            
-        elif df_type == 'AKT':
-            temp_df = df_data[(df_data[3].isna()) & (df_data[0] == 'AKT')]
-            index_quantity = temp_df.index
-            
-        else: 
-            index_to_ignore_list = list(self._index_to_ignore)
-            temp_df = df_data[(df_data[3].isna() == False) & (df_data.index.isin(index_to_ignore_list) == False)]
-        
-        if df_type in ['SEVERAL', 'AKT']:
-            
-            new_data = []
-            for idx in index_quantity:
-                new_index = idx + 1
-                
-                self._index_to_ignore.add(new_index)
+        columns = ['Artikelbezeichnung', 'Menge', 'Preis', 'Gespart', 'Total']
 
-                if df_type == 'AKT': 
-                    akt_index = idx + 2
-                    self._index_to_ignore.add(akt_index)
-                    df_aktien = df_data[df_data.index == akt_index]
-                    # Aktien part
-                    akt_price = df_aktien[2].values[0]
-                    akt_price = akt_price.replace("-", '')
-                    akt_price = float(akt_price) * -1
-                else:
-                    akt_price = 0
-                    
-                df_current = df_data[df_data.index == idx]
-                df_temp = df_data[df_data.index == new_index]
-                
-                menge, price = df_temp[1].values[0].split("x")
-                total = df_temp[2].values[0]
-                if "-" in total:
-                    total = total.replace("-", "")
-                    total = float(total) * -1
-                else:
-                    total = float(total)
-                menge = float(menge.strip())
-                price = float(price.strip())
+        df_final = pd.DataFrame(data, columns=columns)
+        df_final["Total"] = df_final['Total'] + df_final['Gespart']
 
-                concept = df_current[1].values[0]
+        return df_final
 
-                new_data.append((concept, menge, price, akt_price, total))
+    def _build_single_data_frame(self, df_data: pd.DataFrame, single_index: list) -> pd.DataFrame:
+        """
+        Used by `_receipt_data_parser_type_one()` method to build the data frame 
+        of articles in a single line, taking their rows by position out of all receipt rows
+        """
+        df_final = df_data.take(single_index).reset_index(drop=True)
+        df_final = df_final.rename(columns={0: 'Gespart', 1: 'Artikelbezeichnung', 2: 'Preis', 3: 'Menge'})
+        df_final['Gespart'] = [0 for x in df_final['Preis']]
+        df_final['Preis'] = [float(x) for x in df_final['Preis']]
+        df_final['Total'] = df_final['Preis']
 
-            columns = ['Artikelbezeichnung', 'Menge', 'Preis', 'Gespart', 'Total']
-            
-            df_final = pd.DataFrame(new_data, columns=columns)  
-            df_final["Total"] = df_final['Total'] + df_final['Gespart']
-        else:
-            df_final = temp_df.rename(columns={0: 'Gespart', 1: 'Artikelbezeichnung', 2: 'Preis', 3: 'Menge'}).reset_index()
-            df_final = df_final.drop(columns='index')
-            df_final['Gespart'] = [0 for x in df_final['Preis']]
-            df_final['Preis'] = [float(x) for x in df_final['Preis']]
-            df_final['Total'] = df_final['Preis']
-            
-        return df_final
\ No newline at end of file
+        return df_final
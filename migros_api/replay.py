@@ -0,0 +1,277 @@
+"""record and replay helpers
+
+`ResponseRecorder` saves the responses seen by a `Transport` as fixture files, and
+`StubMigrosServer` serves them back (or synthetic pages of any size) on the same paths,
+so `MigrosApi` can run against a local server without network access,
+
+    with StubMigrosServer(fixtures_dir="./fixtures") as server:
+        migros_api = MigrosApi(pwd, email, base_url=server.base_url, login_base_url=server.base_url)
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+import requests
+from . import synthetic
+
+
+# Query parameters that only change the referrer, not the response
+IGNORED_PARAMS = ('referrer', 'referrerPolicy')
+
+
+def fixture_key(method: str, url: str) -> str:
+    """ File name (without extension) under which a request is recorded. Built from
+        method, path and sorted query parameters, so the client and the stub server agree
+
+    Args:
+        method (str): http method
+        url (str): full url, or path with query
+
+    Returns:
+        str: fixture key
+    """
+    parsed = urlparse(url)
+    query = sorted(
+        (key, value) for key, values in parse_qs(parsed.query).items()
+        for value in values if key not in IGNORED_PARAMS
+    )
+    raw_key = "%s %s?%s" % (method.upper(), parsed.path, urlencode(query))
+    key = re.sub(r'[^A-Za-z0-9._=-]+', '_', raw_key).strip('_')
+
+    # Long keys keep a readable prefix and a hash for uniqueness
+    if len(key) > 150:
+        key = key[:100] + "_" + hashlib.sha1(raw_key.encode('utf-8')).hexdigest()
+    return key
+
+
+class ResponseRecorder:
+    """
+    Saves every response sent through a `Transport` into `directory`, one `<key>.body`
+    file with the content and one `<key>.json` file with status and headers,
+
+        transport = Transport(recorder=ResponseRecorder("./fixtures"))
+        migros_api = MigrosApi(pwd, email, transport=transport)
+
+    Login responses contain personal data, fixtures should not be shared as they are
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def record(self, method: str, url: str, response, params: dict = None) -> None:
+        """ Stores `response` for `method` and `url`
+
+        Args:
+            method (str): http method
+            url (str): requested url
+            response (requests.Response): response received
+            params (dict, optional): query parameters sent along with `url`
+        """
+        url = requests.Request(method, url, params=params).prepare().url
+        key = fixture_key(method, url)
+        meta = {
+            'method': method.upper(),
+            'url': url,
+            'status': response.status_code,
+            'content_type': response.headers.get('content-type', 'text/html'),
+        }
+
+        with self._lock:
+            with open(os.path.join(self.directory, key + ".body"), 'wb') as file:
+                file.write(response.content)
+            with open(os.path.join(self.directory, key + ".json"), 'w') as file:
+                json.dump(meta, file, indent=2)
+
+        logging.debug("Recorded %s", key)
+
+
+class StubMigrosServer:
+    """
+    Local http server standing in for login.migros.ch and www.migros.ch.
+
+    Requests are answered with a recorded fixture when one matches, otherwise with
+    synthetic pages: any credentials are accepted, listings have `receipts_per_day`
+    receipts for every day of the requested period (`receipts_per_page` per page) and
+    exports have `lines_per_receipt` article lines
+
+    Args:
+        fixtures_dir (str, optional): directory written by `ResponseRecorder`
+        synthetic (bool, optional): answer requests without fixture with synthetic pages. Defaults to True
+        receipts_per_day (int, optional): synthetic receipts per day. Defaults to 1
+        receipts_per_page (int, optional): receipts per listing page. Defaults to 20
+        lines_per_receipt (int, optional): article lines per receipt. Defaults to 20
+        receipt_type (int, optional): synthetic receipt format, 1 or 2. Defaults to 1
+        pdf_size (int, optional): size of synthetic pdfs in bytes. Defaults to 30 KiB
+        latency (float, optional): seconds to wait before answering. Defaults to 0
+        host (str, optional): address to bind to. Defaults to 127.0.0.1
+        port (int, optional): port to bind to. Defaults to a free one
+    """
+
+    CSRF_TOKEN = "stub-csrf-token"
+    SESSION_COOKIE = "JSESSIONID"
+
+    def __init__(self, fixtures_dir: str = None, synthetic: bool = True,
+                 receipts_per_day: int = 1, receipts_per_page: int = 20,
+                 lines_per_receipt: int = 20, receipt_type: int = 1,
+                 pdf_size: int = 30 * 1024, latency: float = 0.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.fixtures_dir = fixtures_dir
+        self.synthetic = synthetic
+        self.receipts_per_day = receipts_per_day
+        self.receipts_per_page = receipts_per_page
+        self.lines_per_receipt = lines_per_receipt
+        self.receipt_type = receipt_type
+        self.pdf_size = pdf_size
+        self.latency = latency
+
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://%s:%s" % (host, port)
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    def start(self) -> str:
+        """ Starts serving on a background thread
+
+        Returns:
+            str: base url of the server
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.debug("Stub server listening on %s", self.base_url)
+        return self.base_url
+
+    def stop(self) -> None:
+        """ Stops the server and closes its socket """
+        self._server.shutdown()
+        self._server.server_close()
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    def _handler_class(self):
+        """ Request handler bound to this server instance """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stub._handle(self, 'GET', b'')
+
+            def do_POST(self):
+                length = int(self.headers.get('content-length') or 0)
+                stub._handle(self, 'POST', self.rfile.read(length))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str, body: bytes) -> None:
+        """ Answers a request with a fixture, a synthetic page or a 404 """
+        with self._lock:
+            self.requests_served += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        status, content_type, content, cookies = 404, 'text/plain', b'Not found', []
+        fixture = self._load_fixture(method, handler.path)
+        if fixture is not None:
+            status, content_type, content = fixture
+        elif self.synthetic:
+            answer = self._synthetic_response(method, handler.path, body)
+            if answer is not None:
+                status, content_type, content, cookies = answer
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(content)))
+        for cookie in cookies:
+            handler.send_header('Set-Cookie', cookie)
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def _load_fixture(self, method: str, path: str):
+        """ Recorded status, content type and content for the request, if any """
+        if not self.fixtures_dir:
+            return None
+
+        key = fixture_key(method, path)
+        body_path = os.path.join(self.fixtures_dir, key + ".body")
+        if not os.path.exists(body_path):
+            return None
+
+        with open(os.path.join(self.fixtures_dir, key + ".json"), 'r') as file:
+            meta = json.load(file)
+        with open(body_path, 'rb') as file:
+            content = file.read()
+
+        return meta['status'], meta['content_type'], content
+
+    def _synthetic_response(self, method: str, path: str, body: bytes):
+        """ Synthetic answer for the paths used by `MigrosApi` """
+        parsed = urlparse(path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        html = 'text/html; charset=utf-8'
+
+        if parsed.path == '/login' and method == 'GET':
+            return 200, html, synthetic.login_page(self.CSRF_TOKEN), []
+
+        if parsed.path == '/login' and method == 'POST':
+            form = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+            if form.get('_csrf') != self.CSRF_TOKEN:
+                return 403, 'text/plain', b'Invalid CSRF token', []
+            cookie = "%s=stub-%s; Path=/" % (self.SESSION_COOKIE, hashlib.sha1(body).hexdigest()[:16])
+            page = synthetic.account_page(form.get('username', ''), "Stub User")
+            return 200, html, page, [cookie]
+
+        if parsed.path.startswith('/de/cumulus/konto~'):
+            return 200, html, b'<html><body>Cumulus</body></html>', []
+
+        if parsed.path == '/de/cumulus/konto/kassenbons.html':
+            period_from = datetime.strptime(query['dateFrom'], "%Y-%m-%d")
+            period_to = datetime.strptime(query['dateTo'], "%Y-%m-%d")
+            page = int(query.get('p', 1))
+
+            ids = synthetic.receipt_ids_for_period(period_from, period_to, self.receipts_per_day)
+            total_pages = max(1, math.ceil(len(ids) / self.receipts_per_page))
+            page_ids = ids[(page - 1) * self.receipts_per_page:page * self.receipts_per_page]
+            return 200, html, synthetic.listing_page(page_ids, page, total_pages), []
+
+        if parsed.path == '/service/avantaReceiptExport/html':
+            content = synthetic.receipt_html(
+                query['receiptId'], self.lines_per_receipt, self.receipt_type
+            )
+            return 200, html, content, []
+
+        if parsed.path == '/service/avantaReceiptExport/pdf':
+            return 200, 'application/pdf', synthetic.receipt_pdf(query['receiptId'], self.pdf_size), []
+
+        return None
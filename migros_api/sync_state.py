@@ -0,0 +1,57 @@
+"""sync_state class"""
+
+import json
+import os
+from datetime import datetime
+from typing import List
+
+
+class SyncState:
+    """
+    High-water mark used by `MigrosApi.sync_receipts()`, stored as a json file.
+
+    Keeps the date of the last sync and the most recent `max_known_ids` receipt
+    download ids (newest first), which is enough to know where a new sync can stop
+    """
+
+    def __init__(self, path: str, max_known_ids: int = 1000):
+        self.path = path
+        self.max_known_ids = max_known_ids
+        self.last_sync = None
+        self.known_ids = []
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                state = json.load(file)
+            if state.get('last_sync'):
+                self.last_sync = datetime.strptime(state['last_sync'], "%Y-%m-%d")
+            self.known_ids = state.get('known_ids', [])
+
+        self._known_set = set(self.known_ids)
+
+    def __contains__(self, download_id: str) -> bool:
+        return download_id in self._known_set
+
+    def update(self, new_ids: List[str], synced_until: datetime) -> None:
+        """ Adds freshly synced ids, which come newest first, on top of the known ones
+
+        Args:
+            new_ids (List[str]): new download ids, newest first
+            synced_until (datetime): end of the synced period
+        """
+        self.known_ids = (new_ids + self.known_ids)[:self.max_known_ids]
+        self._known_set = set(self.known_ids)
+        self.last_sync = datetime(synced_until.year, synced_until.month, synced_until.day)
+
+    def save(self) -> None:
+        """ Writes the state to disk, replacing the previous file atomically """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(
+                {
+                    'last_sync': self.last_sync.strftime("%Y-%m-%d") if self.last_sync else None,
+                    'known_ids': self.known_ids
+                },
+                file
+            )
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,175 @@
+"""synthetic pages
+
+Generators for pages shaped like the ones served by migros.ch (login, receipts listing
+and receipt exports), used by the stub server and the benchmarks
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+
+ARTICLES = [
+    "M-Classic Vollmilch", "Bio Eier 6 Stk", "Ruchbrot", "Gala Aepfel", "Bananen",
+    "Gruyere surchoix", "Rispentomaten", "Anna's Best Pizza", "Zweifel Chips Paprika",
+    "Volg Mineral", "Emmi Caffe Latte", "Cailler Milchschokolade", "Rueebli", "Basmati Reis",
+]
+
+STORES = [
+    "MM Zuerich Limmatplatz", "M Bern Marktgasse", "MMM Basel Stuecki", "M Luzern Bahnhof",
+    "Migros Limmatfeld", "MM Winterthur Neuwiesen",
+]
+
+
+def login_page(csrf: str) -> bytes:
+    """ Login page holding the CSRF token, as searched by `MigrosApi.csfr_pattern` """
+    return (
+        '<html><head><meta name="_csrf" content="%s"/></head>'
+        '<body><form method="post"></form></body></html>' % csrf
+    ).encode('utf-8')
+
+
+def account_page(email: str, user_name: str) -> bytes:
+    """ Page returned after logging in, with the account menu checked by `MigrosApi._check_login()` """
+    return (
+        '<html><body><div class="m-accountmenu" data-logged-in="true">'
+        '<span class="m-accountmenuflyout__info-title">%s</span>'
+        '<span class="m-accountmenuflyout__info-mail">%s</span>'
+        '</div></body></html>' % (user_name, email)
+    ).encode('utf-8')
+
+
+def receipt_ids_for_period(period_from: datetime, period_to: datetime,
+                           receipts_per_day: int = 1) -> List[str]:
+    """ Stable download ids for a period, newest first, as listed with `sort=dateDsc`.
+        The same day always gives the same ids, so overlapping periods share receipts
+
+    Args:
+        period_from (datetime): first day
+        period_to (datetime): last day
+        receipts_per_day (int, optional): receipts on each day. Defaults to 1
+
+    Returns:
+        List[str]: download ids
+    """
+    ids = []
+    day = datetime(period_to.year, period_to.month, period_to.day)
+    first_day = datetime(period_from.year, period_from.month, period_from.day)
+    while day >= first_day:
+        for k in range(receipts_per_day - 1, -1, -1):
+            ids.append("%s%03d" % (day.strftime("%Y%m%d"), k))
+        day -= timedelta(days=1)
+    return ids
+
+
+def listing_page(download_ids: List[str], page: int = 1, total_pages: int = 1) -> bytes:
+    """ Receipts (kassenbons) listing page, with the same table and pager structure
+        parsed by `MigrosApi._parse_receipt_data()`
+
+    Args:
+        download_ids (List[str]): receipts in this page
+        page (int, optional): current page. Defaults to 1
+        total_pages (int, optional): number of pages shown on the pager. Defaults to 1
+
+    Returns:
+        bytes: html page
+    """
+    table = ['<tr><th><input type="checkbox" value="all"/></th><th>Datum</th><th>Filiale</th></tr>']
+    for download_id in download_ids:
+        seed = int(download_id) if download_id.isdigit() else hash(download_id)
+        date = download_id[6:8] + "." + download_id[4:6] + "." + download_id[:4]
+        table.append(
+            '<tr><td><input type="checkbox" value="{0}"/></td>'
+            '<td><a class="ui-js-toggle-modal" '
+            'href="/service/avantaReceiptExport/pdf?receiptId={0}">{1}</a></td>'
+            '<td>{2}</td><td>{3}.{4:02d}</td><td>{5}</td></tr>'.format(
+                download_id, date, STORES[seed % len(STORES)],
+                seed % 150, seed % 100, seed % 40
+            )
+        )
+
+    pager = ''.join(
+        '<a aria-label="Seite" data-value="%s" class="%s">%s</a>'
+        % (k, "is-active" if k == page else "", k)
+        for k in range(1, total_pages + 1)
+    )
+
+    return (
+        '<html><head><meta charset="utf-8"></head><body>'
+        '<table class="receipts">%s</table>'
+        '<nav>%s<a aria-label="Seite" data-value="next">&gt;</a></nav>'
+        '</body></html>' % (''.join(table), pager)
+    ).encode('utf-8')
+
+
+def receipt_lines_type_one(n_lines: int, rnd: random.Random) -> List[str]:
+    """ Lines of a receipt parsed by `ReceiptItem._receipt_data_parser_type_one()`. Articles
+        are bought once, several times (name and quantity lines) or in action (`AKT`, with an
+        extra action line). `n_lines` is the number of article lines, the total line is added
+    """
+    lines = ["                                   CHF"]
+    while len(lines) - 1 < n_lines:
+        article = rnd.choice(ARTICLES)
+        price = rnd.randint(50, 2000) / 100
+        kind = rnd.random()
+        left = n_lines - (len(lines) - 1)
+        if kind < 0.6 or left < 3:
+            lines.append("%s  %.2f  %s" % (article, price, rnd.randint(1, 2)))
+        elif kind < 0.85:
+            quantity = rnd.randint(2, 6)
+            lines.append(article)
+            lines.append("%s x %.2f  %.2f  %s" % (quantity, price, quantity * price, 1))
+        else:
+            quantity = rnd.randint(2, 6)
+            lines.append("AKT  %s" % article)
+            lines.append("%s x %.2f  %.2f  %s" % (quantity, price, quantity * price, 1))
+            lines.append("Aktion  -%.2f  %s" % (quantity * price / 5, 1))
+    lines.append("Total CHF  %.2f" % rnd.randint(100, 30000))
+    return lines
+
+
+def receipt_lines_type_two(n_lines: int, rnd: random.Random) -> List[str]:
+    """ Lines of a receipt parsed by `ReceiptItem._receipt_data_parser_type_two()` (limmatfeld) """
+    lines = ["Artikelbezeichnung  Menge  Preis  Aktion  Total  MwSt"]
+    for _ in range(n_lines):
+        article = rnd.choice(ARTICLES)
+        price = rnd.randint(50, 2000) / 100
+        quantity = rnd.randint(1, 4)
+        if rnd.random() < 0.2:
+            discount = price * quantity / 5
+            lines.append("%s  %s  %.2f  -%.2f  %.2f  1" % (
+                article, quantity, price, discount, price * quantity - discount
+            ))
+        else:
+            lines.append("%s  %s  %.2f  %.2f  1" % (article, quantity, price, price * quantity))
+    return lines
+
+
+def receipt_html(receipt_id: str, n_lines: int = 20, receipt_type: int = 1) -> bytes:
+    """ Receipt html export, as returned by `avantaReceiptExport/html`
+
+    Args:
+        receipt_id (str): receipt id, used as random seed so a receipt is always the same
+        n_lines (int, optional): number of article lines. Defaults to 20
+        receipt_type (int, optional): 1 for the usual receipt, 2 for the limmatfeld one. Defaults to 1
+
+    Returns:
+        bytes: html export
+    """
+    rnd = random.Random(receipt_id)
+    if receipt_type == 1:
+        lines = receipt_lines_type_one(n_lines, rnd)
+    else:
+        lines = receipt_lines_type_two(n_lines, rnd)
+
+    return (
+        '<html><head><meta charset="utf-8"></head><body><div class="receipt">'
+        '<div class="article pre">%s\n</div></div></body></html>' % "\n".join(lines)
+    ).encode('utf-8')
+
+
+def receipt_pdf(receipt_id: str, size: int = 30 * 1024) -> bytes:
+    """ Bytes standing in for a receipt pdf export, of about `size` bytes """
+    header = ("%%PDF-1.4\n%% receipt %s\n" % receipt_id).encode('utf-8')
+    body = random.Random(receipt_id).randbytes(max(0, size - len(header) - 6))
+    return header + body + b"\n%%EOF"
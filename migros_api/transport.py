@@ -0,0 +1,164 @@
+"""transport classes
+
+Http layer used by `MigrosApi`: connection pooling, retries with backoff and rate limiting
+"""
+
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from . import metrics
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all threads using the same `Transport`. Allows bursts of
+    up to `burst` requests and `rate` requests per second on average
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """ Blocks until a request can be sent """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait_time = (1 - self._tokens) / self.rate
+
+            time.sleep(wait_time)
+
+
+class Transport:
+    """
+    Wraps a `requests.Session` with a pool sized for the concurrency in use, exponential
+    backoff with full jitter for 429 and 5xx responses (and connection errors), and an
+    optional client side rate limit
+
+    Args:
+        pool_size (int, optional): connections kept per host. Defaults to 10
+        max_retries (int, optional): retries for idempotent requests. Defaults to 3
+        backoff_factor (float, optional): base of the exponential backoff, in seconds. Defaults to 0.5
+        max_backoff (float, optional): maximum wait between retries, in seconds. Defaults to 30
+        rate_limit (float, optional): maximum requests per second, shared across threads
+        burst (int, optional): requests allowed at once above `rate_limit`. Defaults to `rate_limit`
+        recorder (ResponseRecorder, optional): if given, every final response is recorded
+    """
+
+    def __init__(self, pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5,
+                 max_backoff: float = 30, rate_limit: float = None, burst: int = None,
+                 recorder=None):
+        self.recorder = recorder
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.rate_limiter = RateLimiter(rate_limit, burst) if rate_limit else None
+
+        self.pool_size = 0
+        self._pool_lock = threading.Lock()
+        self.session = requests.session()
+        self.ensure_pool_size(pool_size)
+
+    # ---------------------------------------------------------------------------------------------
+    # Public methods ------------------------------------------------------------------------------
+
+    def ensure_pool_size(self, pool_size: int) -> None:
+        """ Grows the connection pool so that `pool_size` concurrent requests do not
+            open and throw away extra connections
+
+        Args:
+            pool_size (int): number of concurrent requests expected
+        """
+        with self._pool_lock:
+            if pool_size <= self.pool_size:
+                return
+
+            replaced = {self.session.adapters.get(prefix) for prefix in ("https://", "http://")}
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.pool_size = pool_size
+
+            # Idle connections of the smaller pool are closed, busy ones once they are released
+            for old_adapter in replaced:
+                if old_adapter is not None:
+                    old_adapter.close()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """ Sends a request, waiting for the rate limiter and retrying idempotent requests
+            that fail with a connection error, 429 or 5xx
+
+        Args:
+            method (str): http method
+            url (str): url to request
+
+        Returns:
+            requests.Response: last response received
+        """
+        retries = self.max_retries if method.upper() in IDEMPOTENT_METHODS else 0
+        attempt = 0
+
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if attempt >= retries:
+                    if metrics.HOOK is not None:
+                        metrics.HOOK.on_request(method, url, None, time.perf_counter() - started, None)
+                    raise
+                wait_time = self._backoff(attempt)
+                logging.warning("%s %s failed (%s), retrying in %.2fs", method, url, err, wait_time)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                    if metrics.HOOK is not None:
+                        metrics.HOOK.on_request(
+                            method, url, response.status_code, time.perf_counter() - started,
+                            metrics.response_size(response, kwargs.get('stream', False))
+                        )
+                    if self.recorder is not None:
+                        self.recorder.record(method, url, response, kwargs.get('params'))
+                    return response
+                wait_time = self._backoff(attempt, response.headers.get('retry-after'))
+                logging.warning(
+                    "%s %s returned %s, retrying in %.2fs", method, url, response.status_code, wait_time
+                )
+                response.close()
+
+            attempt += 1
+            time.sleep(wait_time)
+
+    # ---------------------------------------------------------------------------------------------
+    # Helper functions ----------------------------------------------------------------------------
+
+    def _backoff(self, attempt: int, retry_after: str = None) -> float:
+        """ Exponential backoff with full jitter, a `Retry-After` header in seconds wins """
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff, float(retry_after))
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
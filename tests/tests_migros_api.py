@@ -0,0 +1,432 @@
+"""tests for migros_api, run against the local stub server
+
+    python -m pytest tests/tests_migros_api.py
+"""
+
+import asyncio
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import warnings
+from datetime import datetime
+
+import pandas as pd
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+
+from migros_api import synthetic
+from migros_api.migros_api import MigrosApi
+from migros_api.receipt_frame import build_listing_frame, build_receipt_frame
+from migros_api.receipt_item import ReceiptItem
+from migros_api.replay import StubMigrosServer
+
+
+class TestListingHeaders(unittest.TestCase):
+    """ Listing pages keep their headers after a re-login in the middle of a listing """
+
+    def setUp(self):
+        self.server = StubMigrosServer(receipts_per_day=3)
+        base_url = self.server.start()
+        self.migros_api = MigrosApi(
+            "password", "test@example.com", base_url=base_url, login_base_url=base_url
+        )
+        self.pages = []
+
+        # Expire the session once, on listing page 2
+        transport_get = self.migros_api.transport.get
+
+        def get(url, headers=None, **kwargs):
+            response = transport_get(url, headers=headers, **kwargs)
+            if "&p=" in url:
+                page = url.rsplit("&p=", 1)[1]
+                self.pages.append((page, headers.get("x-requested-with")))
+                if page == "2" and [x[0] for x in self.pages].count("2") == 1:
+                    response.status_code = 401
+            return response
+
+        self.migros_api.transport.get = get
+
+    def tearDown(self):
+        self.server.stop()
+
+    def assert_listing_headers(self, receipts: dict) -> None:
+        self.assertEqual(len(receipts), 270)
+        self.assertEqual([x[0] for x in self.pages].count("2"), 2)
+        self.assertTrue(all(header == "XMLHttpRequest" for _, header in self.pages), self.pages)
+
+    def test_serial_pages(self):
+        receipts = self.migros_api.get_all_receipts(
+            datetime(2021, 1, 1), datetime(2021, 3, 31), max_workers=0
+        )
+        self.assert_listing_headers(receipts)
+
+    def test_parallel_pages(self):
+        receipts = self.migros_api.get_all_receipts(
+            datetime(2021, 1, 1), datetime(2021, 3, 31), max_workers=4
+        )
+        self.assert_listing_headers(receipts)
+
+    def test_iter_receipts(self):
+        receipts = dict(self.migros_api.iter_receipts(datetime(2021, 1, 1), datetime(2021, 3, 31)))
+        self.assert_listing_headers(receipts)
+
+
+class TestListingParser(unittest.TestCase):
+    """ The lxml listing parser returns the same as the BeautifulSoup one """
+
+    def assert_same(self, content: bytes) -> None:
+        results = []
+        for parser in (MigrosApi._parse_receipt_data, MigrosApi._parse_receipt_data_soup):
+            receipts = {}
+            try:
+                total_pages = parser(content, receipts)
+            except Exception:
+                total_pages, receipts = "error", None
+            results.append((total_pages, receipts))
+
+        self.assertEqual(results[0], results[1])
+
+    def test_synthetic_pages(self):
+        for rows, page, total_pages in ((0, 1, 1), (1, 1, 1), (20, 3, 9), (500, 2, 2)):
+            download_ids = ["2021%02d%02d%03d" % (1 + row % 12, 1 + row % 28, row) for row in range(rows)]
+            with self.subTest(rows=rows):
+                self.assert_same(synthetic.listing_page(download_ids, page, total_pages))
+
+    def test_nested_tags(self):
+        self.assert_same(
+            '<input type="checkbox" value="1"/>'
+            '<a class="foo  ui-js-toggle-modal" href="x?receiptId=9"><b>01.02.2021</b></a>'
+            '<table><tr><td>Zürich <span>Limmat<i>platz</i></span>'
+            '<table><tr><td>inner</td></tr></table></td><td>c</td></tr></table><td>3</td>'.encode('utf-8')
+        )
+
+    def test_comments_and_scripts(self):
+        self.assert_same(
+            b'<html><body><input type="checkbox" value="1"/>'
+            b'<a class="ui-js-toggle-modal" href="x?receiptId=9">01.02.2021<!-- date --></a>'
+            b'<td>Basel <!-- store --> <span>a</span><script>var x = "<td>";</script>'
+            b'<style>td {}</style></td><td>&nbsp;1.00</td><td>3</td></body></html>'
+        )
+
+    def test_encodings(self):
+        cell = '<input type="checkbox" value="1"/><a class="ui-js-toggle-modal" href="x">p</a>' \
+               '<td>Caf\xe9 Zürich €</td><td>c</td><td>p</td>'
+        for name, content in (
+            ('declared latin-1', ('<html><head><meta charset="iso-8859-1"></head><body>%s</body></html>'
+                                  % cell.replace('€', '')).encode('latin-1')),
+            ('undeclared utf-8', cell.encode('utf-8')),
+            ('undeclared cp1252', cell.encode('cp1252')),
+        ):
+            with self.subTest(name):
+                self.assert_same(content)
+
+    def test_empty_pages(self):
+        for content in (b'', b'<html></html>', b'<html><body><table></table></body></html>'):
+            with self.subTest(content=content):
+                self.assert_same(content)
+
+    def test_odd_rows(self):
+        for content in (
+            # Two checkboxes before the first anchor share it
+            b'<input type="checkbox" value="1"/><input type="checkbox" value="2"/>'
+            b'<a class="ui-js-toggle-modal" href="r=1">p</a><td>s</td><td>c</td>'
+            b'<a class="ui-js-toggle-modal" href="receiptId=2"></a><td>p</td><td>q</td>',
+            # Row without its last cells
+            b'<input type="checkbox" value="1"/><a class="ui-js-toggle-modal" href="x">p</a><td>s</td>',
+            # Cell inside the anchor
+            b'<input type="checkbox" value="1"/><a class="ui-js-toggle-modal" href="x"><td>in</td></a>'
+            b'<td>s</td><td>t</td>',
+            # Same download id twice and a pager
+            b'<input type="checkbox" value="1"/><a class="ui-js-toggle-modal" href="x">p</a>'
+            b'<td>s</td><td>c</td><td>p</td><input type="checkbox" value="1"/>'
+            b'<a class="ui-js-toggle-modal" href="y">p</a><td>s2</td><td>c</td><td>p</td>'
+            b'<a aria-label="Seite" data-value="12"></a><a aria-label="Seite" data-value="next"></a>',
+        ):
+            with self.subTest(content=content):
+                self.assert_same(content)
+
+
+class TestListingDates(unittest.TestCase):
+    """ Receipt dates are read from the listing and typed by the frame builders """
+
+    download_ids = ["20210131000", "20210131001", "20210201000"]
+
+    def parse(self) -> dict:
+        receipts_info = {}
+        MigrosApi._parse_receipt_data(synthetic.listing_page(self.download_ids), receipts_info)
+        return receipts_info
+
+    def test_listing_date(self):
+        receipts_info = self.parse()
+        self.assertEqual(
+            [x['date'] for x in receipts_info.values()], ["31.01.2021", "31.01.2021", "01.02.2021"]
+        )
+
+        receipts_soup = {}
+        MigrosApi._parse_receipt_data_soup(synthetic.listing_page(self.download_ids), receipts_soup)
+        self.assertEqual(receipts_info, receipts_soup)
+
+    def test_frames_date(self):
+        receipts_info = self.parse()
+        df_listing = build_listing_frame(receipts_info)
+        self.assertEqual(
+            df_listing['date'].dt.strftime("%Y-%m-%d").tolist(), ["2021-01-31", "2021-01-31", "2021-02-01"]
+        )
+
+        receipts = [
+            ReceiptItem(x, synthetic.receipt_html(x, n_lines=3)) for x in self.download_ids
+        ]
+        df_items = build_receipt_frame(receipts, receipts_info)
+        self.assertFalse(df_items['date'].isna().any())
+        self.assertEqual(
+            df_items.groupby('receipt_id', observed=True)['date'].first().dt.day.tolist(), [31, 31, 1]
+        )
+
+
+class TestStores(unittest.TestCase):
+    """ Receipts listed and downloaded from the stub server land in the right months """
+
+    @classmethod
+    def setUpClass(cls):
+        with StubMigrosServer() as server:
+            migros_api = MigrosApi(
+                "password", "test@example.com", base_url=server.base_url, login_base_url=server.base_url
+            )
+            cls.receipts_info = migros_api.get_all_receipts(datetime(2021, 1, 1), datetime(2021, 2, 28))
+            cls.receipts = list(migros_api.get_receipts(
+                [x['receipt_id'] for x in cls.receipts_info.values()], request_pdf=False
+            ))
+        cls.df_items = build_receipt_frame(cls.receipts, cls.receipts_info)
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    @unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "pyarrow is not installed")
+    def test_parquet_months(self):
+        from migros_api.parquet_store import ReceiptParquetStore
+
+        store = ReceiptParquetStore(self.path)
+        self.assertEqual(store.append(self.df_items, build_listing_frame(self.receipts_info)), 59)
+
+        for month, days in ((1, 31), (2, 28)):
+            df_month = store.read_line_items(months=[(2021, month)])
+            self.assertEqual(len(df_month), (self.df_items['date'].dt.month == month).sum())
+            self.assertEqual(df_month['date'].dt.month.unique().tolist(), [month])
+            self.assertEqual(len(store.read_receipts(months=[(2021, month)])), days)
+
+        self.assertEqual(len(store.read_line_items()), len(self.df_items))
+
+    def test_line_item_store_rollups(self):
+        from migros_api.line_item_store import LineItemStore
+
+        store = LineItemStore(os.path.join(self.path, "line_items.sqlite"))
+        try:
+            self.assertEqual(store.add_receipts(self.receipts, self.receipts_info), 59)
+
+            by_month = self.df_items.groupby(self.df_items['date'].dt.strftime("%Y-%m"))['Total'].sum()
+            self.assertEqual([x['month'] for x in store.spend_by_month()], ["2021-01", "2021-02"])
+            for row in store.spend_by_month():
+                self.assertAlmostEqual(row['total'], by_month[row['month']], places=6)
+            self.assertEqual(len(store.spend_by_day()), 59)
+
+            article = self.df_items['Artikelbezeichnung'].iloc[0]
+            df_article = self.df_items[self.df_items['Artikelbezeichnung'] == article]
+            self.assertAlmostEqual(
+                sum(x['total'] for x in store.spend_by_month(article=article)),
+                df_article['Total'].sum(), places=6
+            )
+            self.assertTrue(store.top_articles(limit=5, month="2021-02"))
+        finally:
+            store.close()
+
+    def test_line_item_store_duplicates(self):
+        from migros_api.line_item_store import LineItemStore
+
+        receipt = self.receipts[0]
+        df_receipt = self.df_items[self.df_items['receipt_id'] == receipt.receipt_id]
+        store = LineItemStore(os.path.join(self.path, "line_items.sqlite"))
+        try:
+            self.assertEqual(store.add_receipts([receipt, receipt, self.receipts[1]], self.receipts_info), 2)
+            self.assertEqual(store.add_receipts([receipt], self.receipts_info), 0)
+
+            day_receipt = df_receipt['date'].iloc[0].strftime("%Y-%m-%d")
+            day, = [x for x in store.spend_by_day() if x['day'] == day_receipt]
+            self.assertAlmostEqual(day['total'], df_receipt['Total'].sum(), places=6)
+            self.assertEqual(day['items'], len(df_receipt))
+            self.assertEqual(day['receipts'], 1)
+        finally:
+            store.close()
+
+        # Frames of several runs put together
+        df_other = self.df_items[self.df_items['receipt_id'] == self.receipts[1].receipt_id]
+        store = LineItemStore(os.path.join(self.path, "line_items_frame.sqlite"))
+        try:
+            self.assertEqual(store.add_frame(pd.concat([df_receipt, df_other, df_receipt])), 2)
+            day, = [x for x in store.spend_by_day() if x['day'] == day_receipt]
+            self.assertAlmostEqual(day['total'], df_receipt['Total'].sum(), places=6)
+            self.assertEqual(day['items'], len(df_receipt))
+        finally:
+            store.close()
+
+
+class TestParseProcesses(unittest.TestCase):
+    """ Receipts parsed on the process pool match receipts parsed in this process """
+
+    def test_same_frames(self):
+        with StubMigrosServer(receipts_per_day=2) as server:
+            migros_api = MigrosApi(
+                "password", "test@example.com", base_url=server.base_url, login_base_url=server.base_url
+            )
+            receipts_info = migros_api.get_all_receipts(datetime(2021, 1, 1), datetime(2021, 1, 10))
+            receipt_ids = [x['receipt_id'] for x in receipts_info.values()]
+
+            with warnings.catch_warnings():
+                # Forking while the download threads run warns on python 3.12+
+                warnings.simplefilter("error", DeprecationWarning)
+                parsed = list(migros_api.get_receipts(
+                    receipt_ids, request_pdf=False, ordered=True, parse_processes=2
+                ))
+            expected = list(migros_api.get_receipts(receipt_ids, request_pdf=False, ordered=True))
+
+        self.assertEqual([x.receipt_id for x in parsed], [x.receipt_id for x in expected])
+        for receipt, receipt_expected in zip(parsed, expected):
+            self.assertTrue(receipt.parsed)
+            self.assertTrue(receipt.get_data_frame().equals(receipt_expected.get_data_frame()))
+
+
+class TestBackfill(unittest.TestCase):
+    """ `backfill_receipts()` resumes from its checkpoint and only returns the requested period """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.path, "backfill.json")
+        self.server = StubMigrosServer()
+        base_url = self.server.start()
+        self.migros_api = MigrosApi(
+            "password", "test@example.com", base_url=base_url, login_base_url=base_url
+        )
+        self.windows = []
+        self.failing = set()
+
+        get_receipts_window = self.migros_api._get_receipts_window
+
+        def get_window(window_from, window_to, retries):
+            self.windows.append((window_from, window_to))
+            if window_from in self.failing:
+                self.failing.discard(window_from)
+                raise ConnectionError("window failed")
+            return get_receipts_window(window_from, window_to, retries)
+
+        self.migros_api._get_receipts_window = get_window
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.path)
+
+    def backfill(self, period_from: datetime, period_to: datetime, **kwargs) -> dict:
+        self.windows = []
+        return self.migros_api.backfill_receipts(
+            self.checkpoint, period_from, period_to, max_workers=1, **kwargs
+        )
+
+    def test_resume_after_failure(self):
+        self.failing.add(datetime(2021, 1, 31))
+        failures = {}
+        receipts = self.backfill(datetime(2021, 1, 1), datetime(2021, 3, 31), window_retries=0,
+                                 failures=failures)
+        self.assertEqual(list(failures), [(datetime(2021, 1, 31), datetime(2021, 3, 16))])
+        self.assertEqual(len(receipts), 90 - 45)
+
+        # Only the failed window is listed again, possibly split up in smaller windows
+        receipts = self.backfill(datetime(2021, 1, 1), datetime(2021, 3, 31))
+        self.assertEqual(self.windows[0][0], datetime(2021, 1, 31))
+        self.assertEqual(self.windows[-1][1], datetime(2021, 3, 16))
+        for (_, previous_to), (window_from, _) in zip(self.windows, self.windows[1:]):
+            self.assertEqual((window_from - previous_to).days, 1)
+        self.assertEqual(len(receipts), 90)
+
+        receipts = self.backfill(datetime(2021, 1, 1), datetime(2021, 3, 31))
+        self.assertEqual(self.windows, [])
+        self.assertEqual(len(receipts), 90)
+
+    def test_dedup_by_download_id(self):
+        receipts = self.backfill(datetime(2021, 1, 1), datetime(2021, 1, 31))
+
+        # Crash after appending the receipts of a window, before marking it as completed
+        with open(self.checkpoint + ".receipts.jsonl", 'r') as file:
+            lines = file.readlines()
+        with open(self.checkpoint + ".receipts.jsonl", 'a') as file:
+            file.writelines(lines)
+
+        self.assertEqual(self.backfill(datetime(2021, 1, 1), datetime(2021, 1, 31)), receipts)
+        self.assertEqual(len(receipts), 31)
+
+    def test_other_periods(self):
+        self.assertEqual(len(self.backfill(datetime(2020, 1, 1), datetime(2020, 12, 31))), 366)
+
+        receipts = self.backfill(datetime(2021, 1, 1), datetime(2021, 1, 31))
+        self.assertEqual(len(receipts), 31)
+        self.assertTrue(all(x['date'].endswith(".01.2021") for x in receipts.values()))
+
+        # Completed windows only partly within the period are not fetched again
+        receipts = self.backfill(datetime(2020, 12, 20), datetime(2021, 1, 10))
+        self.assertEqual(self.windows, [])
+        self.assertEqual(len(receipts), 22)
+
+    def test_window_sizes(self):
+        # One listing page for 20 days, so windows get wider
+        self.backfill(datetime(2021, 1, 1), datetime(2021, 12, 31), window_days=10)
+        days = [(end - start).days + 1 for start, end in self.windows]
+        self.assertEqual(days[:3], [10, 20, 40])
+
+        # Ten receipts a day are 15 pages for 30 days, so windows get narrower
+        self.server.receipts_per_day = 10
+        self.checkpoint = os.path.join(self.path, "backfill_dense.json")
+        self.backfill(datetime(2022, 1, 1), datetime(2022, 3, 31), window_days=30, target_pages=3)
+        days = [(end - start).days + 1 for start, end in self.windows]
+        self.assertEqual(days[:2], [30, 6])
+
+
+@unittest.skipIf(importlib.util.find_spec("aiohttp") is None, "aiohttp is not installed")
+class TestAsyncReceipts(unittest.TestCase):
+    """ `AsyncMigrosApi` only requests the pdf export when asked to """
+
+    def setUp(self):
+        self.server = StubMigrosServer()
+        self.base_url = self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_receipt(self, request_pdf: bool) -> tuple:
+        from migros_api.async_migros_api import AsyncMigrosApi
+
+        async def run():
+            async with AsyncMigrosApi("password", "test@example.com", base_url=self.base_url,
+                                      login_base_url=self.base_url) as migros_api:
+                served = self.server.requests_served
+                receipt = await migros_api.get_receipt("20210101000", request_pdf=request_pdf)
+                return receipt, self.server.requests_served - served
+
+        return asyncio.run(run())
+
+    def test_without_pdf(self):
+        receipt, requests = self.get_receipt(request_pdf=False)
+        self.assertEqual(requests, 1)
+        self.assertIsNone(receipt.get_pdf())
+
+    def test_with_pdf(self):
+        receipt, requests = self.get_receipt(request_pdf=True)
+        self.assertEqual(requests, 2)
+        self.assertTrue(receipt.get_pdf())
+
+
+if __name__ == "__main__":
+    unittest.main()
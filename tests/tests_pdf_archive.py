@@ -0,0 +1,114 @@
+"""tests for pdf_archive
+
+    python -m pytest tests/tests_pdf_archive.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+
+from migros_api import synthetic
+from migros_api.pdf_archive import PdfArchive
+from migros_api.receipt_item import ReceiptItem
+
+
+def not_downloaded():
+    raise AssertionError("pdf of an archived receipt was downloaded")
+
+
+class TestPdfArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, "segment-%06d.pack" % segment)
+
+    def test_content_dedup(self):
+        pdf = synthetic.receipt_pdf("same", 1000)
+        with PdfArchive(self.path, batch_size=2) as archive:
+            archive.add("r1", pdf)
+            archive.add("r2", pdf)
+            archive.add("r3", pdf)
+            stats = archive.stats()
+
+        self.assertEqual(stats, {'receipts': 3, 'pdfs': 1, 'segments': 1, 'bytes': len(pdf)})
+        self.assertEqual(os.path.getsize(self.segment_path(1)), len(pdf))
+        with PdfArchive(self.path) as archive:
+            self.assertEqual([archive.get(x) for x in ("r1", "r2", "r3")], [pdf] * 3)
+
+    def test_skips_archived(self):
+        with PdfArchive(self.path) as archive:
+            self.assertTrue(archive.add("r1", b"%PDF one"))
+
+        with PdfArchive(self.path) as archive:
+            self.assertFalse(archive.add("r1", b"%PDF other"))
+            added = archive.add_receipts([
+                ReceiptItem("r1", b"", pdf_loader=not_downloaded),
+                ReceiptItem("r2", b"", pdf=b"%PDF two"),
+            ])
+            self.assertEqual(added, 1)
+            self.assertEqual(archive.missing(["r1", "r2", "r3?language=de"]), ["r3?language=de"])
+            self.assertEqual(archive.get("r1"), b"%PDF one")
+            self.assertEqual(archive.get("r2"), b"%PDF two")
+            self.assertIsNone(archive.get("r3"))
+
+    def test_segment_rollover(self):
+        pdfs = {"r%s" % k: synthetic.receipt_pdf("r%s" % k, 1000) for k in range(20)}
+        with PdfArchive(self.path, batch_size=3, max_segment_bytes=4000) as archive:
+            for receipt_id, pdf in pdfs.items():
+                archive.add(receipt_id, pdf)
+            # Read back while the archive grows, memory maps are refreshed
+            self.assertEqual(archive.get("r0"), pdfs["r0"])
+            stats = archive.stats()
+
+        self.assertGreater(stats['segments'], 1)
+        for segment in range(1, stats['segments'] + 1):
+            self.assertLessEqual(os.path.getsize(self.segment_path(segment)), 4000)
+
+        with PdfArchive(self.path) as archive:
+            for receipt_id, pdf in pdfs.items():
+                self.assertEqual(archive.get(receipt_id), pdf)
+
+    def test_interrupted_batch(self):
+        with PdfArchive(self.path, max_segment_bytes=10) as archive:
+            archive.add("r1", b"%PDF one")
+
+        # Batches that were written but never indexed, in the current and the next segment
+        with open(self.segment_path(1), 'ab') as file:
+            file.write(b"GARBAGE-ONE")
+        with open(self.segment_path(2), 'wb') as file:
+            file.write(b"GARBAGE-TWO")
+
+        with PdfArchive(self.path, max_segment_bytes=10) as archive:
+            self.assertEqual(os.path.getsize(self.segment_path(1)), len(b"%PDF one"))
+            self.assertEqual(os.path.getsize(self.segment_path(2)), 0)
+            archive.add("r2", b"%PDF two")
+            archive.flush()
+            self.assertEqual(archive.get("r1"), b"%PDF one")
+            self.assertEqual(archive.get("r2"), b"%PDF two")
+
+    def test_leftover_bytes_in_next_segment(self):
+        with PdfArchive(self.path, max_segment_bytes=10) as archive:
+            archive.add("r1", b"%PDF one")
+            archive.flush()
+
+            # Batch that failed after rolling over, while the archive stays open
+            with open(self.segment_path(2), 'wb') as file:
+                file.write(b"GARBAGE-FROM-CRASHED-BATCH")
+
+            archive.add("r2", b"%PDF two")
+            archive.flush()
+            self.assertEqual(archive.get("r2"), b"%PDF two")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+"""tests for receipt_cache
+
+    python -m pytest tests/tests_receipt_cache.py
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+
+from migros_api import synthetic
+from migros_api.migros_api import MigrosApi
+from migros_api.receipt_cache import ReceiptCache
+from migros_api.receipt_item import ReceiptItem
+from migros_api.replay import StubMigrosServer
+
+
+class TestReceiptCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.path, "cache.sqlite")
+        self.now = 1000.0
+        patcher = mock.patch("migros_api.receipt_cache.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_rows(self):
+        cache = ReceiptCache(self.cache_path)
+        for seed in range(20):
+            for receipt_type in (1, 2):
+                content = synthetic.receipt_html(str(seed), n_lines=1 + seed, receipt_type=receipt_type)
+                rows = ReceiptItem(str(seed), content).get_data_frame()
+                cache.put("%s-%s" % (seed, receipt_type), content, None, rows)
+                cached = cache.get("%s-%s" % (seed, receipt_type))
+                pd.testing.assert_frame_equal(cached['rows'], rows)
+                self.assertEqual(cached['html'], content)
+                self.assertIsNone(cached['pdf'])
+        cache.close()
+
+    def test_unreadable_rows(self):
+        cache = ReceiptCache(self.cache_path)
+        cache.put("r1", b"<html/>", None, pd.DataFrame({'Total': [1.0]}))
+        cache.close()
+
+        with sqlite3.connect(self.cache_path) as connection:
+            connection.execute("UPDATE receipts SET rows = ?", (b"\x80\x04not json",))
+
+        cache = ReceiptCache(self.cache_path)
+        self.assertIsNone(cache.get("r1")['rows'])
+        cache.close()
+
+    def test_max_age(self):
+        cache = ReceiptCache(self.cache_path, max_age=60)
+        cache.put("r1", b"one")
+        self.now += 30
+        cache.put("r2", b"two")
+        self.assertIsNotNone(cache.get("r1"))
+
+        self.now += 31
+        self.assertIsNone(cache.get("r1"))
+        self.assertIsNotNone(cache.get("r2"))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        self.now += 30
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['bytes'], 0)
+        cache.close()
+
+    def test_lru_max_bytes(self):
+        cache = ReceiptCache(self.cache_path, max_bytes=30)
+        for receipt_id in ("r1", "r2", "r3"):
+            self.now += 1
+            cache.put(receipt_id, b"x" * 10)
+
+        # r1 was used more recently than r2, so r2 goes first
+        self.now += 1
+        cache.get("r1")
+        self.now += 1
+        cache.put("r4", b"x" * 10)
+        self.assertNotIn("r2", cache)
+        self.assertEqual([x in cache for x in ("r1", "r3", "r4")], [True, True, True])
+        self.assertEqual(cache.stats()['bytes'], 30)
+
+        # Replacing an entry counts its new size only
+        self.now += 1
+        cache.put("r3", b"x" * 20)
+        self.assertEqual(cache.stats()['bytes'], 30)
+        self.assertEqual(cache.stats()['evictions'], 2)
+        self.assertEqual([x in cache for x in ("r1", "r3", "r4")], [False, True, True])
+        cache.close()
+
+    def test_access_times_persisted(self):
+        cache = ReceiptCache(self.cache_path)
+        for receipt_id in ("r1", "r2"):
+            self.now += 1
+            cache.put(receipt_id, b"x" * 10)
+        self.now += 1
+        cache.get("r1")
+        cache.close()
+
+        cache = ReceiptCache(self.cache_path, max_bytes=10)
+        self.assertEqual(cache.stats()['bytes'], 20)
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(["r1" in cache, "r2" in cache], [True, False])
+        cache.close()
+
+    def test_counters(self):
+        cache = ReceiptCache(self.cache_path)
+        self.assertIsNone(cache.get("r1"))
+        cache.put("r1", b"one", b"%PDF")
+        cache.get("r1")
+        cache.get("r1")
+        self.assertEqual(cache.stats(), {
+            'hits': 2, 'misses': 1, 'evictions': 0, 'receipts': 1, 'bytes': len(b"one%PDF")
+        })
+        cache.clear()
+        self.assertEqual(cache.stats()['receipts'], 0)
+        self.assertEqual(cache.stats()['bytes'], 0)
+        cache.close()
+
+
+class TestCachedReceipts(unittest.TestCase):
+    """ `MigrosApi.get_receipt()` makes no request for cached receipts """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = StubMigrosServer()
+        base_url = self.server.start()
+        self.cache = ReceiptCache(os.path.join(self.path, "cache.sqlite"))
+        self.migros_api = MigrosApi(
+            "password", "test@example.com", base_url=base_url, login_base_url=base_url,
+            cache=self.cache
+        )
+
+    def tearDown(self):
+        self.cache.close()
+        self.server.stop()
+        shutil.rmtree(self.path)
+
+    def test_no_requests_on_hit(self):
+        receipt = self.migros_api.get_receipt("20210101000", request_pdf=True)
+        served = self.server.requests_served
+
+        cached = self.migros_api.get_receipt("20210101000", request_pdf=True)
+        self.assertEqual(self.server.requests_served, served)
+        self.assertEqual(cached.get_pdf(), receipt.get_pdf())
+        self.assertTrue(cached.parsed)
+        pd.testing.assert_frame_equal(cached.get_data_frame(), receipt.get_data_frame())
+
+        receipts = list(self.migros_api.get_receipts(["20210101000"], request_pdf=True))
+        self.assertEqual(self.server.requests_served, served)
+        self.assertEqual([x.receipt_id for x in receipts], ["20210101000"])
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+"""tests for receipt_item
+
+    python -m pytest tests/tests_receipt_item.py
+"""
+
+import os
+import random
+import sys
+import unittest
+
+import pandas as pd
+from bs4 import BeautifulSoup as bs
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+
+from migros_api import synthetic
+from migros_api.receipt_item import ReceiptItem
+
+
+class BaselineReceiptParser:
+    """
+    Receipt parser as it was before rows were collected in a single pass, kept as the
+    reference the current `ReceiptItem` has to match
+    """
+
+    def __init__(self, content: bytes):
+        self._soup = bs(content, 'lxml')
+        self._index_to_ignore = set()
+
+    def get_data_frame(self) -> pd.DataFrame:
+        try:
+            data_text = self._soup.find('div', attrs={'class': 'article pre'}).text
+            for txt in data_text.split("\n"):
+                if 'CHF' in txt:
+                    self._index_to_ignore = set()
+                    return self._receipt_data_parser_type_one(data_text)
+                return self._receipt_data_parser_type_two(data_text)
+        except Exception:
+            return None
+
+    def _receipt_data_parser_type_one(self, data_text: str) -> pd.DataFrame:
+        new_text = []
+        for txt in data_text.split("\n"):
+            if (txt != "") & ('CHF' not in txt):
+                temp_list = [x.strip() for x in txt.split("  ") if x != ""]
+                if 'AKT' not in temp_list:
+                    temp_list.insert(0, ' ')
+                new_text.append(temp_list)
+
+        df_temp_data = pd.DataFrame(new_text)
+        frame = [self._build_data_frame(df_temp_data, df_type) for df_type in ['AKT', 'SEVERAL', '']]
+        df_final = pd.concat(frame, sort=False)
+        return df_final.reset_index().drop(columns='index')
+
+    @staticmethod
+    def _receipt_data_parser_type_two(data_text: str) -> pd.DataFrame:
+        new_text = []
+        for k, txt in enumerate(data_text.split("\n")):
+            if txt:
+                if k == 0:
+                    col_names = [x.strip() for x in txt.split("  ") if x != ""]
+                else:
+                    new_text.append([x.strip() for x in txt.split("  ") if x != ""])
+
+        for row in new_text:
+            if len(row) == 5:
+                row.insert(3, '')
+
+        df_receipt = pd.DataFrame(new_text, columns=col_names)
+        df_receipt['Gespart'] = ['' for x in df_receipt.Menge]
+        return df_receipt[['Artikelbezeichnung', 'Menge', 'Preis', 'Gespart', 'Total']]
+
+    def _build_data_frame(self, df_data: pd.DataFrame, df_type: str) -> pd.DataFrame:
+        if df_type == 'SEVERAL':
+            index_quantity = df_data[(df_data[3].isna()) & (df_data[0] != 'AKT')].index
+        elif df_type == 'AKT':
+            index_quantity = df_data[(df_data[3].isna()) & (df_data[0] == 'AKT')].index
+        else:
+            temp_df = df_data[
+                (df_data[3].isna() == False) & (df_data.index.isin(list(self._index_to_ignore)) == False)
+            ]
+
+        if df_type in ['SEVERAL', 'AKT']:
+            new_data = []
+            for idx in index_quantity:
+                new_index = idx + 1
+                self._index_to_ignore.add(new_index)
+
+                if df_type == 'AKT':
+                    akt_index = idx + 2
+                    self._index_to_ignore.add(akt_index)
+                    akt_price = df_data[df_data.index == akt_index][2].values[0]
+                    akt_price = float(akt_price.replace("-", '')) * -1
+                else:
+                    akt_price = 0
+
+                df_current = df_data[df_data.index == idx]
+                df_temp = df_data[df_data.index == new_index]
+
+                menge, price = df_temp[1].values[0].split("x")
+                total = df_temp[2].values[0]
+                if "-" in total:
+                    total = float(total.replace("-", "")) * -1
+                else:
+                    total = float(total)
+
+                new_data.append(
+                    (df_current[1].values[0], float(menge.strip()), float(price.strip()), akt_price, total)
+                )
+
+            columns = ['Artikelbezeichnung', 'Menge', 'Preis', 'Gespart', 'Total']
+            df_final = pd.DataFrame(new_data, columns=columns)
+            df_final["Total"] = df_final['Total'] + df_final['Gespart']
+        else:
+            df_final = temp_df.rename(
+                columns={0: 'Gespart', 1: 'Artikelbezeichnung', 2: 'Preis', 3: 'Menge'}
+            ).reset_index()
+            df_final = df_final.drop(columns='index')
+            df_final['Gespart'] = [0 for x in df_final['Preis']]
+            df_final['Preis'] = [float(x) for x in df_final['Preis']]
+            df_final['Total'] = df_final['Preis']
+
+        return df_final
+
+
+def random_receipt(n_lines: int, rnd: random.Random, mode: str) -> bytes:
+    """ Type one receipt mixing single articles, articles bought several times and actions.
+        `mode` narrows it down to some line kinds or adds trailing columns
+    """
+    lines = ["                          CHF"]
+    count = 0
+    while count < n_lines:
+        kind = rnd.random()
+        name = "Artikel %d" % rnd.randint(0, 50)
+        if mode == 'plain' or kind < 0.6:
+            extra = "  A" if mode == 'extra' and rnd.random() < 0.2 else ""
+            lines.append("%s  %.2f  %d%s" % (name, rnd.random() * 20, rnd.randint(1, 3), extra))
+            count += 1
+        elif mode == 'several' or kind < 0.8:
+            quantity, price = rnd.randint(2, 5), rnd.random() * 5
+            lines.append(name)
+            lines.append("%d x %.2f  %s%.2f  1%s" % (
+                quantity, price, '-' if rnd.random() < 0.1 else '', quantity * price,
+                '  B' if mode == 'several_extra' else ''
+            ))
+            count += 2
+        else:
+            quantity, price = rnd.randint(2, 5), rnd.random() * 5
+            lines.append("AKT  " + name)
+            lines.append("%d x %.2f  %.2f  1" % (quantity, price, quantity * price))
+            lines.append("Aktion  -%.2f  1" % (price / 3))
+            count += 3
+    lines.append("Total CHF  12.00")
+    return ('<div class="article pre">%s\n</div>' % "\n".join(lines)).encode('utf-8')
+
+
+class TestReceiptParser(unittest.TestCase):
+    """ `ReceiptItem.get_data_frame()` returns the same frames as the baseline parser """
+
+    def assert_same_frame(self, content: bytes) -> None:
+        expected = BaselineReceiptParser(content).get_data_frame()
+        result = ReceiptItem("receipt", content).get_data_frame()
+
+        if expected is None:
+            self.assertIsNone(result, content)
+            return
+
+        self.assertIsNotNone(result, content)
+        self.assertEqual(list(result.columns), list(expected.columns))
+        self.assertEqual(list(result.dtypes), list(expected.dtypes))
+        self.assertTrue(result.index.equals(expected.index))
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_synthetic_receipts(self):
+        for seed in range(300):
+            for receipt_type in (1, 2):
+                with self.subTest(seed=seed, receipt_type=receipt_type):
+                    self.assert_same_frame(
+                        synthetic.receipt_html(str(seed), n_lines=1 + seed % 40, receipt_type=receipt_type)
+                    )
+
+    def test_random_receipts(self):
+        rnd = random.Random(1)
+        for mode in ('mixed', 'plain', 'several', 'extra', 'several_extra'):
+            for n_lines in (0, 1, 2, 3, 5, 10, 40, 200):
+                for _ in range(5):
+                    content = random_receipt(n_lines, rnd, mode)
+                    with self.subTest(mode=mode, n_lines=n_lines):
+                        self.assert_same_frame(content)
+
+    def test_odd_receipts(self):
+        for content in (
+            b'<div class="article pre">CHF\nfoo\n</div>',
+            b'<div class="article pre">CHF\n</div>',
+            b'<div class="article pre">CHF\nA  1.00  1\nAKT  X\n</div>',
+            b'<div class="article pre">CHF\nA   1.00   1   \nB  2.00  3\n</div>',
+        ):
+            with self.subTest(content=content):
+                self.assert_same_frame(content)
+
+
+if __name__ == "__main__":
+    unittest.main()
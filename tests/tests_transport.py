@@ -0,0 +1,191 @@
+"""tests for transport, run against a local http server
+
+    python -m pytest tests/tests_transport.py
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+
+from migros_api.transport import RateLimiter, Transport
+
+
+class StatusServer:
+    """ Answers every request with the next status of `statuses`, then with 200 """
+
+    def __init__(self):
+        self.statuses = []
+        self.headers = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._answer(self)
+
+            def do_POST(self):
+                server._answer(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%s/" % self._server.server_address[1]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _answer(self, handler: BaseHTTPRequestHandler) -> None:
+        length = int(handler.headers.get('content-length') or 0)
+        handler.rfile.read(length)
+        self.requests.append(handler.command)
+        status = self.statuses.pop(0) if self.statuses else 200
+        handler.send_response(status)
+        for name, value in self.headers.get(status, {}).items():
+            handler.send_header(name, value)
+        handler.send_header('content-length', '2')
+        handler.end_headers()
+        handler.wfile.write(b"ok")
+
+
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StatusServer()
+        self.transport = Transport(max_retries=3, backoff_factor=0.5, max_backoff=10)
+        patcher = mock.patch("migros_api.transport.time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def waits(self) -> list:
+        return [x.args[0] for x in self.sleep.call_args_list]
+
+    def test_retry_statuses(self):
+        for status in (429, 500, 502, 503, 504):
+            with self.subTest(status=status):
+                self.server.requests, self.server.statuses = [], [status, status]
+                self.sleep.reset_mock()
+                response = self.transport.get(self.server.url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(self.server.requests), 3)
+                # Full jitter, below the exponential cap of every attempt
+                for attempt, wait_time in enumerate(self.waits()):
+                    self.assertLessEqual(wait_time, 0.5 * 2 ** attempt)
+
+    def test_gives_up(self):
+        self.server.statuses = [503] * 10
+        response = self.transport.get(self.server.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(len(self.waits()), 3)
+
+    def test_no_retry_other_statuses(self):
+        self.server.statuses = [404]
+        self.assertEqual(self.transport.get(self.server.url).status_code, 404)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_retry_after(self):
+        self.server.statuses = [429, 429]
+        self.server.headers = {429: {'Retry-After': '3'}}
+        self.transport.get(self.server.url)
+        self.assertEqual(self.waits(), [3.0, 3.0])
+
+        # Capped at max_backoff
+        self.sleep.reset_mock()
+        self.server.statuses = [503]
+        self.server.headers = {503: {'Retry-After': '120'}}
+        self.transport.get(self.server.url)
+        self.assertEqual(self.waits(), [10])
+
+    def test_no_retry_post(self):
+        self.server.statuses = [503, 503]
+        response = self.transport.post(self.server.url, data={'a': 1})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.server.requests, ['POST'])
+        self.assertEqual(self.waits(), [])
+
+    def test_connection_errors(self):
+        url = self.server.url
+        self.server.stop()
+        with self.assertRaises(Exception):
+            self.transport.get(url, timeout=1)
+        self.assertEqual(len(self.waits()), 3)
+
+        self.sleep.reset_mock()
+        with self.assertRaises(Exception):
+            self.transport.post(url, timeout=1)
+        self.assertEqual(self.waits(), [])
+        self.server = StatusServer()
+
+
+class TestPool(unittest.TestCase):
+
+    def test_replaced_adapter_closed(self):
+        transport = Transport(pool_size=2)
+        adapter = transport.session.adapters["https://"]
+        with mock.patch.object(adapter, 'close') as close:
+            transport.ensure_pool_size(2)
+            close.assert_not_called()
+            transport.ensure_pool_size(8)
+            close.assert_called_once_with()
+
+        self.assertIsNot(transport.session.adapters["https://"], adapter)
+        self.assertIs(transport.session.adapters["https://"], transport.session.adapters["http://"])
+        self.assertEqual(transport.pool_size, 8)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_token_bucket(self):
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        with mock.patch("migros_api.transport.time.monotonic", side_effect=lambda: clock[0]), \
+                mock.patch("migros_api.transport.time.sleep", side_effect=sleep):
+            limiter = RateLimiter(rate=10, burst=5)
+            for _ in range(5):
+                limiter.acquire()
+            self.assertEqual(clock[0], 0)
+
+            for _ in range(10):
+                limiter.acquire()
+            self.assertAlmostEqual(clock[0], 1.0)
+
+    def test_shared_between_threads(self):
+        server = StatusServer()
+        transport = Transport(pool_size=4, rate_limit=50, burst=1)
+        try:
+            started = time.monotonic()
+            threads = [
+                threading.Thread(target=lambda: [transport.get(server.url) for _ in range(5)])
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - started
+        finally:
+            server.stop()
+
+        self.assertEqual(len(server.requests), 20)
+        # 20 requests at 50 per second, the first one right away
+        self.assertGreaterEqual(elapsed, 19 / 50 * 0.95)
+
+
+if __name__ == "__main__":
+    unittest.main()